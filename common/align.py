@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Drift-aligned summation of spectra.
+
+The velocity scale of a drive shifts slowly (a fraction of a channel over
+days), so summing the intervals of a long run, or runs taken on different
+days, smears the lines. Here each spectrum is aligned with a reference
+before summing:
+
+    * the shift is the position of the maximum of the cross-correlation
+      with the reference. It is computed from the FFTs of all the spectra
+      at once (a 2D array), keeping only the harmonics where the reference
+      stands over the Poisson noise, on a grid of 1/upsample channel, and
+      refined with a parabola through the three highest points;
+    * the spectra are moved by their shifts with the Fourier shift theorem
+      (the spectrum of a MAC record is periodic in the channel). The total
+      counts are conserved, and the shifted spectra are summed in the
+      frequency domain: one inverse FFT for the whole sum.
+
+The shift moves the whole record (a time delay of the drive, seen as a
+change of the fold point); to align a velocity offset use folded spectra.
+
+Offline (thousands of intervals in a few seconds)::
+
+    >>> ar = archive.Reader('run.00.mdz')
+    >>> total, shifts = align.alignsum(ar[:])       # shift series per interval
+
+Live (in the acquisition loop)::
+
+    >>> al = align.Aligner()
+    >>> shift = al.update(COUNTSnow)     # al.total: aligned sum so far
+
+Command line (intervals of archives, or whole runs from .counts files)::
+
+    python align.py run.00.mdz run.01.counts run.02.counts -o aligned
+
+Class:
+    align.Aligner
+
+Func:
+    align.alignsum
+"""
+
+import numpy as np
+
+
+class Aligner():
+    """ Sub-channel alignment against a reference spectrum.
+
+    Args:
+        ref: reference spectrum. If None the aligned sum itself is the
+            reference, once it has "mincounts" counts (live use).
+        maxshift: largest shift searched (channels).
+        upsample: points per channel of the correlation grid.
+        mincounts: counts of the aligned sum before it is used as
+            reference (ref None); the spectra before are not moved.
+    """
+
+    def __init__(self, ref=None, maxshift=8., upsample=16, mincounts=1e5):
+        self.maxshift = maxshift
+        self.upsample = upsample
+        self.mincounts = mincounts
+        self.fixed = ref is not None
+        self._R = None
+        if ref is not None:
+            self.reference(ref)
+        self.total = None
+        self.shifts = []
+
+    def reference(self, ref):
+        """ Set the reference spectrum. """
+        ref = np.asarray(ref, float)
+        R = np.fft.rfft(ref - ref.mean())
+        C = ref.size
+        # Only the harmonics where the reference stands over its noise floor
+        # (the upper half of the spectrum) carry information on the shift.
+        power = np.abs(R)
+        floor = np.median(power[C//4:])
+        keep = np.flatnonzero(power > 3*floor)
+        keep = keep[keep > 0]
+        if power[1:].max() <= 1e-9*max(np.abs(ref).sum(), 1.):
+            keep = keep[:0]                 # flat reference: no shift
+        self._k = keep
+        self._R = np.conj(R[keep])
+        self._lags = np.arange(-self.maxshift, self.maxshift + 0.5/self.upsample,
+                               1./self.upsample)
+        self._E = np.exp(2j*np.pi*np.outer(keep, self._lags)/C)
+
+    def shift(self, spectra):
+        """ Shifts (channels) of the spectra relative to the reference.
+
+        Args:
+            spectra: one spectrum or a 2D array (one spectrum per row).
+
+        Returns: the shift s of each spectrum, such that spectrum(x) is
+            ref(x - s). A float for one spectrum, an array for a 2D array.
+        """
+        a = np.asarray(spectra, float)
+        one = a.ndim == 1
+        a = np.atleast_2d(a)
+        if self._k.size == 0:
+            return 0. if one else np.zeros(a.shape[0])
+        F = np.fft.rfft(a, axis=1)[:, self._k]
+        # Cross-correlation on the lags grid, only with the useful harmonics.
+        xc = np.real((F*self._R) @ self._E)
+        j = np.clip(np.argmax(xc, axis=1), 1, xc.shape[1] - 2)
+        rows = np.arange(a.shape[0])
+        y0, y1, y2 = xc[rows, j - 1], xc[rows, j], xc[rows, j + 1]
+        den = y0 - 2*y1 + y2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            d = np.where(den < 0, 0.5*(y0 - y2)/den, 0.)
+        s = self._lags[j] + np.clip(d, -1., 1.)/self.upsample
+        return float(s[0]) if one else s
+
+    def move(self, spectra, shifts):
+        """ Spectra moved back by their shifts (aligned with the reference),
+        one per row. """
+        return np.fft.irfft(self._moved(spectra, shifts), n=np.shape(spectra)[-1],
+                            axis=-1)
+
+    def _moved(self, spectra, shifts):
+        a = np.atleast_2d(np.asarray(spectra, float))
+        C = a.shape[1]
+        k = np.arange(C//2 + 1)
+        ph = np.exp(2j*np.pi*np.outer(np.atleast_1d(shifts), k)/C)
+        return np.fft.rfft(a, axis=1)*ph
+
+    def sum(self, spectra, shifts):
+        """ Sum of the aligned spectra (one inverse FFT). """
+        C = np.shape(spectra)[-1]
+        return np.fft.irfft(self._moved(spectra, shifts).sum(axis=0), n=C)
+
+    def update(self, spectrum):
+        """ Align a new spectrum and add it to self.total.
+
+        Returns: its shift (also appended to self.shifts).
+        """
+        c = np.asarray(spectrum, float)
+        if self.total is None:
+            self.total = np.zeros(c.size)
+        if self._R is None and self.total.sum() >= self.mincounts:
+            self.reference(self.total)
+        if self._R is None:
+            s = 0.
+            self.total += c
+        else:
+            s = self.shift(c)
+            self.total += self.sum(c, [s])
+            if not self.fixed:
+                self.reference(self.total)
+        self.shifts.append(s)
+        return s
+
+
+def alignsum(spectra, ref=None, iterations=2, chunk=2048, **kw):
+    """ Aligned sum of many spectra.
+
+    Args:
+        spectra: 2D array (one spectrum per row), memory-mapped arrays and
+            archive readers included: it is read in chunks of "chunk" rows.
+        ref: reference spectrum. If None the plain sum is the first
+            reference and the aligned sum the next ones ("iterations"
+            passes).
+        kw: options of :class:`Aligner` (maxshift, upsample).
+
+    Returns: (total, shifts): the aligned sum and the shift of each row.
+    """
+    n = len(spectra)
+    if ref is None:
+        ref = sum(np.asarray(spectra[a:a + chunk], float).sum(axis=0)
+                  for a in range(0, n, chunk))
+        passes = iterations
+    else:
+        passes = 1
+    for p in range(passes):
+        al = Aligner(ref, **kw)
+        shifts = np.empty(n)
+        total = 0.
+        for a in range(0, n, chunk):
+            block = np.asarray(spectra[a:a + chunk], float)
+            shifts[a:a + block.shape[0]] = al.shift(block)
+            total = total + al.sum(block, shifts[a:a + block.shape[0]])
+        ref = total
+    return total, shifts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Drift-aligned sum of the intervals of archives (.mdz) '
+                    'or of whole runs (.counts).')
+    parser.add_argument('files', nargs='+', help='.mdz archives or .counts files.')
+    parser.add_argument('-o', '--output', default='aligned',
+                        help='Root name of the outputs: OUTPUT.counts (aligned '
+                             'sum) and OUTPUT.shifts (file, row, shift).')
+    parser.add_argument('--maxshift', type=float, default=8.,
+                        help='Largest shift searched (channels).')
+    args = parser.parse_args()
+
+    rows = []
+    spectra = []
+    for f in args.files:
+        if f.endswith('.mdz'):
+            import archive
+            ar = archive.Reader(f)
+            total, shifts = alignsum(ar, maxshift=args.maxshift)
+            rows += [(f, k, s) for k, s in enumerate(shifts)]
+            spectra.append(total)
+            ar.close()
+        else:
+            spectra.append(np.loadtxt(f))
+            rows.append((f, -1, 0.))
+    if len(spectra) > 1:
+        # Runs aligned with each other (the intervals of an archive were
+        # aligned with their own sum).
+        total, shifts = alignsum(np.array(spectra), maxshift=args.maxshift)
+        runshift = dict(zip(args.files, shifts))
+        rows = [(f, k, s + runshift[f]) for f, k, s in rows]
+    else:
+        total = spectra[0]
+    np.savetxt(args.output + '.counts', total, fmt='%.3f')
+    with open(args.output + '.shifts', 'w') as fid:
+        fid.write('# file row shift\n')
+        for f, k, s in rows:
+            fid.write('%s %d %.4f\n' % (f, k, s))
+    print('Aligned sum of %d files on %s.counts' % (len(args.files), args.output))
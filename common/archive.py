@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Compressed storage of interval spectra.
+
+Keeps every downloaded interval of a run in a compact file with random
+access by interval index. Each interval is stored as its difference with
+the running mean of the previous intervals (taken at the start of its
+block and stored with it), so the stored numbers are of the size of the
+Poisson fluctuations. The differences are zig-zag mapped
+to non negative integers, packed as varints (one byte for |d| < 64) and
+blocks of intervals are compressed with zlib, bz2 or lzma.
+
+Files::
+
+    name.mdz        header + blocks
+    name.mdz.idx    block index: (offset, first interval, intervals) per
+                    block. Rebuilt from name.mdz if missing.
+    name.mdz.psum   optional prefix-sum index (see prefix.py): window sums
+                    without decoding the blocks.
+
+Writing (acquisition loop)::
+
+    >>> ar = archive.Writer('run.00.mdz', 1024, prefix=True)
+    >>> ar.write(COUNTSnow, ti, tf)
+    >>> ar.close()
+
+Reading::
+
+    >>> ar = archive.Reader('run.00.mdz')
+    >>> len(ar), ar.shape
+    >>> ar[1234]              # one interval (numpy array)
+    >>> ar[100:200]           # 2D array, one interval per row
+    >>> ar.times(1234)        # (ti, tf)
+
+Class:
+    archive.Writer
+    archive.Reader
+"""
+
+import bz2
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import prefix as _prefix
+
+_MAGIC = b'MDQZ'
+_VERSION = 1
+_FILEHEADER = struct.Struct('<4sHHII')      # magic, version, codec, nchan, blocksize
+_BLOCKHEADER = struct.Struct('<III')        # intervals, weight of the reference, payload length
+_INDEX = np.dtype([('offset', '<u8'), ('first', '<u4'), ('n', '<u4')])
+
+_CODECS = {1: ('zlib', zlib.compress, zlib.decompress),
+           2: ('bz2', bz2.compress, bz2.decompress),
+           3: ('lzma', lambda b, level: lzma.compress(b, preset=level),
+               lzma.decompress)}
+_CODECNUM = {v[0]: k for k, v in _CODECS.items()}
+
+# Weight (in intervals) of the running mean carried to the next block. A
+# short memory lets the reference follow slow changes of the count rate.
+_MAXWEIGHT = 16
+
+
+# Zig-zag and varint helpers ---------------------------------------------------
+# ----------------------------------------------------------------------------
+
+def zigzag(r):
+    """ Signed to unsigned: 0,-1,1,-2,2... -> 0,1,2,3,4... """
+    r = np.asarray(r, np.int64)
+    return ((r << 1) ^ (r >> 63)).astype(np.uint64)
+
+
+def unzigzag(z):
+    """ Inverse of :func:`zigzag`. """
+    z = np.asarray(z, np.uint64)
+    return (z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64)
+
+
+def varint(z):
+    """ Pack unsigned integers as LEB128 varints (vectorized). Returns bytes. """
+    z = np.asarray(z, np.uint64)
+    nb = np.ones(z.size, np.int64)
+    k = 1
+    while True:
+        more = z >= np.uint64(1 << (7*k))
+        if not more.any():
+            break
+        nb += more
+        k += 1
+    if k == 1:
+        return z.astype(np.uint8).tobytes()
+    col = np.arange(k)
+    parts = (z[:, None] >> (7*col).astype(np.uint64)) & np.uint64(0x7F)
+    parts |= (col[None, :] < nb[:, None] - 1).astype(np.uint64) << np.uint64(7)
+    return parts[col[None, :] < nb[:, None]].astype(np.uint8).tobytes()
+
+
+def unvarint(b):
+    """ Inverse of :func:`varint`: bytes to numpy uint64 array. """
+    b = np.frombuffer(b, np.uint8)
+    if b.size == 0 or b.max() < 0x80:
+        return b.astype(np.uint64)
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lens = ends - starts + 1
+    low = (b & 0x7F).astype(np.uint64)
+    vals = low[starts]
+    for j in range(1, int(lens.max())):
+        m = np.flatnonzero(lens > j)
+        vals[m] |= low[starts[m] + j] << np.uint64(7*j)
+    return vals
+
+
+def _decodeblock(payload, nrec, nchan):
+    times = np.frombuffer(payload, np.float64, 2*nrec).reshape(nrec, 2)
+    vals = unzigzag(unvarint(payload[16*nrec:])).reshape(nrec + 1, nchan)
+    # First row: the reference (running mean when the block was written).
+    return vals[1:] + vals[0], times, vals[0]
+
+
+class Writer():
+    """ Writes interval spectra to a compressed archive.
+
+    Args:
+        fname: output file name (an existing archive is continued).
+        nchan: number of channels.
+        blocksize: intervals per compressed block.
+        codec: 'zlib' (default), 'bz2' or 'lzma'.
+        level: compression level.
+        prefix: if True the prefix-sum index name.psum is kept too.
+    """
+
+    def __init__(self, fname, nchan, blocksize=32, codec='zlib', level=6,
+                 prefix=False):
+        self.fname = fname
+        self.nchan = nchan
+        self.level = level
+        self._buf = []
+        self._times = []
+        if os.path.exists(fname) and os.path.getsize(fname) >= _FILEHEADER.size:
+            rd = Reader(fname)
+            if rd.nchan != nchan:
+                raise ValueError('%s has %d channels' % (fname, rd.nchan))
+            self.codec = rd.codec
+            self.blocksize = rd.blocksize
+            # Only the complete blocks are kept: appended after a block cut
+            # by a crash, the new ones would be lost to a header scan.
+            rd.index, end = rd._scan()
+            rd._first = rd.index['first'].astype(np.int64)
+            self.count = len(rd)
+            self._sum, self._weight = rd._state()
+            rd.close()
+            with open(fname, 'r+b') as fid:
+                fid.truncate(end)
+            rd.index.tofile(fname + '.idx')
+            self.fid = open(fname, 'ab')
+        else:
+            self.codec = _CODECNUM[codec]
+            self.blocksize = blocksize
+            self.count = 0
+            self._sum = np.zeros(nchan, np.int64)
+            self._weight = 0
+            self.fid = open(fname, 'wb')
+            self.fid.write(_FILEHEADER.pack(_MAGIC, _VERSION, self.codec,
+                                            nchan, blocksize))
+            open(fname + '.idx', 'wb').close()
+        self.idx = open(fname + '.idx', 'ab')
+        self.prefix = None
+        if prefix:
+            self.prefix = _prefix.Writer(fname + '.psum', nchan)
+            if self.prefix.count > self.count:
+                # Intervals still buffered when the writer crashed.
+                self.prefix.truncate(self.count)
+            elif self.prefix.count < self.count:
+                self.prefix.close()
+                _prefix.build(fname)
+                self.prefix = _prefix.Writer(fname + '.psum', nchan)
+
+    def write(self, counts, ti=0., tf=0.):
+        """ Add an interval. The block is written when it is full. """
+        c = np.asarray(counts)
+        if c.size != self.nchan:
+            raise ValueError('Expected %d channels, got %d' % (self.nchan, c.size))
+        self._buf.append(c.astype(np.int64))
+        self._times.append((ti, tf))
+        if self.prefix is not None:
+            self.prefix.write(c, ti, tf)
+        if len(self._buf) >= self.blocksize:
+            self.flush()
+
+    def flush(self):
+        """ Write the pending intervals as a (maybe short) block. """
+        if not self._buf:
+            return
+        block = np.array(self._buf)
+        n = block.shape[0]
+        weight = min(self._weight, _MAXWEIGHT)
+        base = self._sum//self._weight if self._weight else np.zeros(self.nchan, np.int64)
+        vals = np.vstack([base[None, :], block - base])
+        payload = (np.array(self._times, np.float64).tobytes() +
+                   varint(zigzag(vals.ravel())))
+        comp = _CODECS[self.codec][1](payload, self.level)
+        offset = self.fid.tell()
+        self.fid.write(_BLOCKHEADER.pack(n, weight, len(comp)))
+        self.fid.write(comp)
+        self.fid.flush()
+        entry = np.array([(offset, self.count, n)], _INDEX)
+        self.idx.write(entry.tobytes())
+        self.idx.flush()
+        if self.prefix is not None:
+            self.prefix.flush()
+        self.count += n
+        self._sum = base*weight + block.sum(axis=0)
+        self._weight = weight + n
+        self._buf = []
+        self._times = []
+
+    def close(self):
+        """ Write the pending intervals and close the files. """
+        self.flush()
+        self.fid.close()
+        self.idx.close()
+        if self.prefix is not None:
+            self.prefix.close()
+
+
+class Reader():
+    """ Random access to the intervals of a compressed archive.
+
+    Args:
+        fname: the archive file name.
+        cache: number of decoded blocks kept in memory.
+    """
+
+    def __init__(self, fname, cache=4):
+        self.fname = fname
+        self.fid = open(fname, 'rb')
+        magic, version, self.codec, self.nchan, self.blocksize = \
+            _FILEHEADER.unpack(self.fid.read(_FILEHEADER.size))
+        if magic != _MAGIC:
+            raise ValueError('%s is not an interval archive' % fname)
+        self.index = self._loadindex()
+        self._first = self.index['first'].astype(np.int64)
+        self._cache = {}
+        self._ncache = cache
+
+    def _loadindex(self):
+        size = os.path.getsize(self.fname)
+        try:
+            index = np.fromfile(self.fname + '.idx', _INDEX)
+            last = index[-1] if index.size else None
+            if last is None or last['offset'] < size:
+                return index
+        except (IOError, OSError):
+            pass
+        # Missing or inconsistent index.
+        return self._scan()[0]
+
+    def _scan(self):
+        """ Block index from the block headers.
+
+        Returns: (index, end), end is the offset after the last complete
+            block.
+        """
+        size = os.path.getsize(self.fname)
+        entries = []
+        off = _FILEHEADER.size
+        first = 0
+        while off + _BLOCKHEADER.size <= size:
+            self.fid.seek(off)
+            n, w, clen = _BLOCKHEADER.unpack(self.fid.read(_BLOCKHEADER.size))
+            if off + _BLOCKHEADER.size + clen > size:
+                break                       # block cut by a crash
+            entries.append((off, first, n))
+            first += n
+            off += _BLOCKHEADER.size + clen
+        return np.array(entries, _INDEX), off
+
+    def __len__(self):
+        if self.index.size == 0:
+            return 0
+        return int(self.index['first'][-1] + self.index['n'][-1])
+
+    @property
+    def shape(self):
+        return (len(self), self.nchan)
+
+    def block(self, b):
+        """ Decoded block b: (intervals, times) arrays. """
+        if b in self._cache:
+            return self._cache[b]
+        off, first, n = self.index[b]
+        self.fid.seek(int(off))
+        n, w, clen = _BLOCKHEADER.unpack(self.fid.read(_BLOCKHEADER.size))
+        payload = _CODECS[self.codec][2](self.fid.read(clen))
+        res = _decodeblock(payload, n, self.nchan)[:2]
+        if self._ncache > 0:
+            if len(self._cache) >= self._ncache:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[b] = res
+        return res
+
+    def _locate(self, k):
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('interval %d out of range' % k)
+        b = int(np.searchsorted(self._first, k, side='right')) - 1
+        return b, k - int(self._first[b])
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(len(self))
+            out = np.empty((len(range(start, stop, step)), self.nchan), np.int64)
+            if out.shape[0] == 0:
+                return out
+            # Block by block: each block is decoded once.
+            b0 = self._locate(start)[0]
+            b1 = self._locate(max(stop - 1, start))[0] if step > 0 else b0
+            if step == 1:
+                i = 0
+                for b in range(b0, b1 + 1):
+                    data = self.block(b)[0]
+                    f = int(self._first[b])
+                    a, z = max(start - f, 0), min(stop - f, data.shape[0])
+                    out[i:i + z - a] = data[a:z]
+                    i += z - a
+                return out
+            for i, j in enumerate(range(start, stop, step)):
+                out[i] = self[j]
+            return out
+        b, j = self._locate(k)
+        return self.block(b)[0][j]
+
+    def times(self, k):
+        """ (ti, tf) of the interval k. """
+        b, j = self._locate(k)
+        return tuple(self.block(b)[1][j])
+
+    def __iter__(self):
+        for b in range(self.index.size):
+            data, times = self.block(b)
+            for row in data:
+                yield row
+
+    def _state(self):
+        """ Running sum and weight after the last block (to append). """
+        if self.index.size == 0:
+            return np.zeros(self.nchan, np.int64), 0
+        off, first, n = self.index[-1]
+        self.fid.seek(int(off))
+        n, w, clen = _BLOCKHEADER.unpack(self.fid.read(_BLOCKHEADER.size))
+        payload = _CODECS[self.codec][2](self.fid.read(clen))
+        data, times, base = _decodeblock(payload, n, self.nchan)
+        return base*w + data.sum(axis=0), w + n
+
+    def close(self):
+        self.fid.close()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Batch reprocessing of archived runs on a process pool.
+
+Takes a directory with run outputs and, for every run, decodes the
+intervals, sums them over windows of W intervals, folds and calibrates the
+total spectrum and (optionally) fits it. The work is spread over a
+multiprocessing pool:
+
+    * binary archives (.npy with one interval per row, raw little endian
+      uint32 .bin, or compressed .mdz, see archive.py) are memory-mapped
+      (or block indexed) and split in chunks of windows, each chunk is a
+      task;
+    * text files (spectrum107 interval files, .counts, mvc0 logs) are
+      streamed line by line, one task per file.
+
+Memory use does not depend on the size of the data: a task holds one
+window and the total, window sums are written straight to a memory-mapped
+.npy output file. For each run the outputs are <run>.npz (total, folded
+spectrum and errors, fold point, velocity, fit) and <run>.windows.npy; the
+consolidated table of all runs is written to summary.txt.
+
+Recognized inputs::
+
+    name.NN          spectrum107 intervals: 'ti tf dt:hex hex hex ...'
+    name.NN.counts   spectrum107 accumulated spectrum (np.savetxt)
+    MM-DD_...        mvc0 log: 't:chan:HEXHEX...' (one line per channel step)
+    *.npy, *.bin     binary archives, one interval per row
+    *.mdz            compressed interval archives (archive.py)
+
+Command line::
+
+    python batch.py DIRECTORY OUTDIR [-j PROCESSES] [-w WINDOW] [--nofold]
+
+Func:
+    batch.scan
+    batch.iterintervals
+    batch.run
+"""
+
+import glob
+import os
+import re
+from multiprocessing import Pool
+
+import numpy as np
+
+from decode import hex2array, hexws2array
+import archive
+import fold
+import velocity
+
+_SPEC107 = re.compile(r'\.\d\d$')
+_MVC0 = re.compile(r'^\d\d-\d\d_\d\d:\d\d:\d\d_')
+BINCHANNELS = 1024            # channels of the raw .bin archives
+_BINARY = ('npy', 'bin', 'mdz')
+
+
+def _kind(path):
+    """ Format of a run file, or None if it is not a run file. """
+    base = os.path.basename(path)
+    if base.endswith('.counts'):
+        return 'counts'
+    if base.endswith('.npy'):
+        return 'npy'
+    if base.endswith('.bin'):
+        return 'bin'
+    if base.endswith('.mdz'):
+        return 'mdz'
+    if _MVC0.match(base):
+        return 'mvc0'
+    if _SPEC107.search(base):
+        return 'spec107'
+    return None
+
+
+def scan(directory):
+    """ List of (path, kind) of the run files found in directory. """
+    out = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if os.path.isfile(path):
+            kind = _kind(path)
+            if kind == 'counts' and (os.path.exists(path[:-len('.counts')]) or
+                                     os.path.exists(path[:-len('.counts')] + '.mdz')):
+                continue        # the intervals of the same run are used
+            if kind == 'spec107' and os.path.exists(path + '.mdz'):
+                continue        # same intervals, faster from the archive
+            if kind is not None:
+                out.append((path, kind))
+    return out
+
+
+def _binarray(path, kind):
+    """ Memory-mapped (nintervals, nchannels) view of a binary archive. """
+    if kind == 'mdz':
+        return archive.Reader(path)
+    if kind == 'npy':
+        a = np.load(path, mmap_mode='r')
+        return a.reshape(1, -1) if a.ndim == 1 else a
+    a = np.memmap(path, dtype='<u4', mode='r')
+    return a.reshape(-1, BINCHANNELS)
+
+
+def iterintervals(path, kind=None, start=0, stop=None):
+    """ Iterate over the intervals of a run file.
+
+    Yields (ti, tf, counts, tag): times (or None), counters as numpy array
+    and a tag (the velocity step for mvc0 logs, None otherwise). For binary
+    archives only the intervals start:stop are read.
+    """
+    kind = kind or _kind(path)
+    if kind in _BINARY:
+        a = _binarray(path, kind)
+        for row in a[start:stop]:
+            yield None, None, np.asarray(row), None
+    elif kind == 'counts':
+        yield None, None, np.loadtxt(path), None
+    elif kind == 'spec107':
+        with open(path) as fid:
+            for line in fid:
+                if line.startswith('#') or ':' not in line:
+                    continue
+                times, data = line.split(':', 1)
+                t = times.split()
+                yield float(t[0]), float(t[1]), hexws2array(data), None
+    elif kind == 'mvc0':
+        with open(path) as fid:
+            for line in fid:
+                if line.startswith('#'):
+                    continue
+                parts = line.split(':')
+                if len(parts) != 3:
+                    # The last line written at Ctrl+C has no velocity step.
+                    continue
+                t = float(parts[0])
+                yield t, t, hex2array(parts[2], 4), int(parts[1])
+    else:
+        raise ValueError('Unknown run file format: %s' % path)
+
+
+def _nintervals(path, kind):
+    if kind in _BINARY:
+        return _binarray(path, kind).shape[0]
+    return None
+
+
+def _outname(outdir, path):
+    return os.path.join(outdir, os.path.basename(path))
+
+
+def _sumtask(task):
+    """ Pool task: window sums and total of (a chunk of) one run file. """
+    path, kind, outdir, window, start, stop = task
+    total = None
+    nwin = start//window if window else 0
+    n = 0
+    windows = raw = None
+    tags = {}
+    npyname = _outname(outdir, path) + '.windows.npy'
+    if window and kind in _BINARY:
+        windows = np.load(npyname, mmap_mode='r+')
+    elif window:
+        # Unknown number of windows: rows go to a raw file, converted to
+        # .npy at the end.
+        raw = open(npyname + '.tmp', 'wb')
+    for ti, tf, c, tag in iterintervals(path, kind, start, stop):
+        if total is None:
+            total = np.zeros(c.size, np.float64)
+            wsum = np.zeros(c.size, np.float64)
+        total += c
+        if tag is not None:
+            tags[tag] = tags.get(tag, 0.) + float(c.sum())
+        if window:
+            wsum += c
+            n += 1
+            if n == window:
+                _putwindow(windows, raw, nwin, wsum)
+                nwin += 1
+                wsum[:] = 0.
+                n = 0
+    if window and n:
+        _putwindow(windows, raw, nwin, wsum)
+    if windows is not None:
+        windows.flush()
+        del windows
+    if raw is not None:
+        raw.close()
+        if total is not None:
+            _rawtonpy(npyname + '.tmp', npyname, total.size)
+        os.remove(npyname + '.tmp')
+    return path, kind, total, tags
+
+
+def _putwindow(windows, raw, k, wsum):
+    if windows is not None:
+        windows[k] = wsum
+    else:
+        raw.write(wsum.tobytes())
+
+
+def _rawtonpy(rawname, npyname, nchan, block=1 << 22):
+    """ Raw float64 rows to a .npy file, copying by blocks. """
+    nrows = os.path.getsize(rawname)//(8*nchan)
+    with open(npyname, 'wb') as out, open(rawname, 'rb') as src:
+        np.lib.format.write_array_header_1_0(
+            out, {'descr': '<f8', 'fortran_order': False,
+                  'shape': (nrows, nchan)})
+        while True:
+            b = src.read(block)
+            if not b:
+                break
+            out.write(b)
+
+
+def _analysis(task):
+    """ Pool task: fold, calibrate and fit the total spectrum of a run. """
+    path, kind, outdir, total, tags, opts = task
+    res = {'run': os.path.basename(path), 'kind': kind,
+           'counts': float(total.sum()), 'channels': total.size}
+    out = {'total': total}
+    if kind == 'mvc0':
+        steps = np.array(sorted(tags))
+        out['steps'] = steps
+        out['mvc'] = np.array([tags[k] for k in steps])
+        np.savez(_outname(outdir, path) + '.npz', **out)
+        return res
+
+    x = np.arange(total.size, dtype=float)
+    v = _velocity(path, opts.get('calib', (1., 0.)))
+    if v is not None and v.size == total.size:
+        x = v
+        out['velocity'] = v
+    y, dy = total, np.sqrt(total)
+    if opts.get('fold', True):
+        y, dy, s = fold.fold(total)
+        x = x[fold.channels(total.size, s)]
+        out['foldpoint'] = res['foldpoint'] = s
+    out['y'], out['dy'], out['x'] = y, dy, x
+
+    model = opts.get('model')
+    if model is not None:
+        import fit
+        r = fit.Fitter(model, x).fit(y)
+        out['p'], out['dp'] = r['p'], r['dp']
+        res['chi2'] = r['chi2']
+        for name, p, dp in zip(r['names'], r['p'], r['dp']):
+            res[name] = p
+            res['d' + name] = dp
+    np.savez(_outname(outdir, path) + '.npz', **out)
+    return res
+
+
+def _velocity(path, calib):
+    """ Velocity axis of a spectrum107 run, from its .wave and .log files. """
+    root = path
+    for ext in ('.counts', '.mdz'):
+        if path.endswith(ext):
+            root = path[:-len(ext)]
+    if not (os.path.exists(root + '.wave') and os.path.exists(root + '.log')):
+        return None
+    K = None
+    with open(root + '.log') as fid:
+        for line in fid:
+            if line.startswith('#Status:') and 'KKKK' not in line:
+                K = int(line.split()[1], 16)
+                break
+    if K is None:
+        return None
+    wave = np.loadtxt(root + '.wave').astype(int)
+    return velocity.axis(wave, K, calib=calib, firmware='MDAQ107-MAC')
+
+
+def run(directory, outdir, processes=None, window=None, chunk=64, **opts):
+    """ Reprocess all the runs of a directory.
+
+    Args:
+        directory: folder with the run files (see :func:`scan`).
+        outdir: folder for the results (created if needed).
+        processes: size of the process pool (None: all the cores).
+        window: number of intervals summed on each window (None: no
+            windows).
+        chunk: windows per task when a binary archive is split.
+        opts: fold (True), calib ((1,0), see velocity.axis) and model (a
+            fit.Model to fit the total spectrum).
+
+    Returns: the list of result rows (dicts), also written on summary.txt.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    tasks = []
+    for path, kind in scan(directory):
+        n = _nintervals(path, kind)
+        if n is not None and window:
+            nch = _binarray(path, kind).shape[1]
+            np.lib.format.open_memmap(_outname(outdir, path) + '.windows.npy',
+                                      mode='w+', dtype=np.float64,
+                                      shape=(-(-n//window), nch))
+            step = window*chunk
+            for a in range(0, n, step):
+                tasks.append((path, kind, outdir, window, a, min(a+step, n)))
+        else:
+            tasks.append((path, kind, outdir, window, 0, None))
+
+    totals = {}
+    with Pool(processes) as pool:
+        for path, kind, total, tags in pool.imap_unordered(_sumtask, tasks):
+            if total is None:
+                continue
+            if path in totals:
+                totals[path][1] += total
+                for k, val in tags.items():
+                    totals[path][2][k] = totals[path][2].get(k, 0.) + val
+            else:
+                totals[path] = [kind, total, tags]
+        jobs = [(path, kind, outdir, total, tags, opts)
+                for path, (kind, total, tags) in sorted(totals.items())]
+        rows = list(pool.imap(_analysis, jobs))
+
+    _summary(os.path.join(outdir, 'summary.txt'), rows)
+    return rows
+
+
+def _summary(fname, rows):
+    keys = []
+    for r in rows:
+        keys += [k for k in r if k not in keys]
+    with open(fname, 'w') as fid:
+        fid.write('# ' + ' '.join(keys) + '\n')
+        for r in rows:
+            fid.write(' '.join(_cell(r.get(k)) for k in keys) + '\n')
+
+
+def _cell(x):
+    if x is None:
+        return '-'
+    if isinstance(x, float):
+        return '%.6g' % x
+    return str(x)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Reprocess all the runs of a directory on a process pool.')
+    parser.add_argument('directory', help='Folder with the run files.')
+    parser.add_argument('outdir', help='Folder for the results.')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of processes (default: all the cores).')
+    parser.add_argument('-w', '--window', type=int, default=None,
+                        help='Intervals summed on each window.')
+    parser.add_argument('--nofold', action='store_true',
+                        help='Do not fold the spectra.')
+    args = parser.parse_args()
+
+    rows = run(args.directory, args.outdir, args.processes, args.window,
+               fold=not args.nofold)
+    print('%d runs processed, results on %s' % (len(rows), args.outdir))
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+SQLite catalog of the runs found in the acquisition folders.
+
+Walks run directories and keeps, for every run, the metadata of its
+headers and a summary of its data in a local SQLite file, so that finding
+the runs taken at a given time base or date is a query instead of a grep
+over every .log:
+
+    * spectrum107 runs (name.NN, with name.NN.log, .wave, .counts, .state
+      and .mdz beside): script version, status line (K Q N O U), init
+      time, fingerprint of the wave, configuration fingerprint of the
+      .state (see runstate.py), intervals, counts and duration;
+    * mvc0 logs (MM-DD_HH:MM:SS_name): firmware, mdaq.py version, status
+      line, wave file, channel steps and counts;
+    * compressed archives (.mdz) without their text intervals.
+
+The scan is incremental: a run is read again only when the size or the
+modification time of one of its files changed, and the runs whose files
+disappeared are dropped. The data files are not decoded when the summary
+can be had from the .counts file, the prefix-sum index or the last line::
+
+    >>> cat = catalog.Catalog('runs.db')
+    >>> cat.scan('/data/mossbauer')                # (added, updated, removed)
+    >>> cat.query(U=0x10, since='2024-01-01')      # list of dicts
+    >>> cat.query('counts > ? AND name LIKE ?', (1e7, '%hematite%'))
+
+Command line::
+
+    python catalog.py scan DIRECTORY [DIRECTORY ...] [--db runs.db]
+    python catalog.py query [--db runs.db] [--U 0x10] [--K 0x400]
+                            [--since 2024-01-01] [--until ...] [--name GLOB]
+                            [--where SQL]
+
+Class:
+    catalog.Catalog
+
+Func:
+    catalog.describe
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+import runstate
+
+_SPEC107 = re.compile(r'\.\d\d$')
+_MVC0 = re.compile(r'^(\d\d)-(\d\d)_(\d\d):(\d\d):(\d\d)_')
+_SIDES = ('.log', '.wave', '.counts', '.state', '.mdz', '.mdz.psum')
+
+_COLUMNS = (
+    ('path', 'TEXT PRIMARY KEY'),
+    ('directory', 'TEXT'),
+    ('name', 'TEXT'),
+    ('kind', 'TEXT'),            # spec107, mvc0 or mdz
+    ('stamp', 'TEXT'),           # sizes and mtimes of the files of the run
+    ('firmware', 'TEXT'),
+    ('script', 'TEXT'),
+    ('version', 'TEXT'),
+    ('status', 'TEXT'),
+    ('K', 'INTEGER'),
+    ('Q', 'INTEGER'),
+    ('N', 'INTEGER'),
+    ('O', 'INTEGER'),
+    ('U', 'INTEGER'),
+    ('started', 'REAL'),         # unix time
+    ('wave', 'TEXT'),            # fingerprint of the wave
+    ('config', 'TEXT'),          # fingerprint of the .state
+    ('finished', 'INTEGER'),
+    ('intervals', 'INTEGER'),
+    ('counts', 'REAL'),
+    ('duration', 'REAL'),        # seconds from the start to the last interval
+    ('scanned', 'REAL'),
+)
+_INDEXES = ('directory', 'name', 'started', 'U', 'K', 'firmware', 'wave')
+
+
+def _kind(path):
+    base = os.path.basename(path)
+    if _MVC0.match(base):
+        return 'mvc0'
+    if _SPEC107.search(base):
+        return 'spec107'
+    if base.endswith('.mdz') and not os.path.exists(path[:-len('.mdz')]):
+        return 'mdz'
+    return None
+
+
+def _root(path, kind):
+    return path[:-len('.mdz')] if kind == 'mdz' else path
+
+
+def _stamp(path, kind):
+    """ Sizes and modification times of the files of a run. """
+    root = _root(path, kind)
+    out = []
+    for f in (root,) + tuple(root + s for s in _SIDES):
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        out.append('%s:%d:%d' % (os.path.basename(f), st.st_size, st.st_mtime_ns))
+    return ' '.join(out)
+
+
+def _status(info, status):
+    info['status'] = status.strip()
+    words = status.split()
+    if len(words) == 5:
+        try:
+            info.update(zip('KQNOU', [int(w, 16) for w in words]))
+        except ValueError:
+            pass
+
+
+def _lastline(fname, nbytes=1 << 15):
+    """ Last complete line of a text file (None if empty). """
+    with open(fname, 'rb') as fid:
+        fid.seek(0, 2)
+        size = fid.tell()
+        fid.seek(max(size - nbytes, 0))
+        lines = fid.read().splitlines()
+    while lines:
+        line = lines.pop().decode('ascii', 'replace')
+        if line.strip() and not line.startswith('#'):
+            return line
+    return None
+
+
+def _countlines(fname, block=1 << 20):
+    n = 0
+    with open(fname, 'rb') as fid:
+        for b in iter(lambda: fid.read(block), b''):
+            n += b.count(b'\n')
+    return n
+
+
+def _wavefingerprint(fname):
+    """ Fingerprint of a wave saved by spectrum107 (one integer per line),
+    as runstate.fingerprint of the wave string of the module. """
+    w = np.loadtxt(fname, dtype=np.int64, ndmin=1)
+    return runstate.fingerprint(''.join('%04X' % (v & 0xFFFF) for v in w))
+
+
+def _spec107(path, info):
+    log = path + '.log'
+    if os.path.exists(log):
+        with open(log, encoding='utf8', errors='replace') as fid:
+            for line in fid:
+                m = re.match(r'#Hardware (\S+), script (\S+) \(ver (\S+)\)', line)
+                if m:
+                    info['firmware'], info['script'], info['version'] = m.groups()
+                elif line.startswith('#Status:') and 'KKKK' not in line:
+                    _status(info, line[len('#Status:'):])
+                elif line.startswith('#Init time:') and info['started'] is None:
+                    try:
+                        t = datetime.datetime.strptime(line[11:].strip(),
+                                                       '%b-%d-%Y %H:%M:%S')
+                        info['started'] = time.mktime(t.timetuple())
+                    except ValueError:
+                        pass
+    if os.path.exists(path + '.wave'):
+        info['wave'] = _wavefingerprint(path + '.wave')
+    st = runstate.load(path + '.state') if os.path.exists(path + '.state') else None
+    if st is not None:
+        info['config'] = st.fingerprint
+        info['finished'] = int(st.finished)
+        info['started'] = info['started'] or st.t0
+    if os.path.exists(path + '.mdz'):
+        _mdz(path + '.mdz', info)
+    else:
+        info['intervals'] = _countlines(path)
+        last = _lastline(path)
+        if last is not None:
+            info['duration'] = float(last.split(':', 1)[0].split()[1])
+    if info['counts'] is None and os.path.exists(path + '.counts'):
+        info['counts'] = float(np.loadtxt(path + '.counts').sum())
+
+
+def _mdz(path, info):
+    import archive
+    ar = archive.Reader(path)
+    info['intervals'] = len(ar)
+    if len(ar):
+        info['duration'] = float(ar.times(len(ar) - 1)[1])
+    ar.close()
+    if os.path.exists(path + '.psum'):
+        import prefix
+        ix = prefix.Index(path + '.psum')
+        info['counts'] = float(ix.window(0, len(ix)).sum())
+        ix.close()
+
+
+def _mvc0(path, info):
+    m = _MVC0.match(os.path.basename(path))
+    # The name has no year: the one of the file, or the previous one.
+    mt = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+    mon, day, hh, mm, ss = [int(g) for g in m.groups()]
+    try:
+        t = datetime.datetime(mt.year, mon, day, hh, mm, ss)
+        if t > mt:
+            t = t.replace(year=mt.year - 1)
+        info['started'] = time.mktime(t.timetuple())
+    except ValueError:
+        pass
+    counts = 0
+    steps = 0
+    last = 0.
+    with open(path, encoding='utf8', errors='replace') as fid:
+        for line in fid:
+            if line.startswith('#'):
+                # The first header line of mvc0 has no end of line.
+                for h in line.split('#')[1:]:
+                    h = h.strip()
+                    if h.startswith('Firmware:'):
+                        info['firmware'] = h[9:].strip()
+                    elif h.startswith('mdaq.py version:'):
+                        info['version'] = h[16:].strip()
+                    elif h.startswith('Hardware Status:'):
+                        _status(info, h[16:])
+                    elif h.endswith('.py'):
+                        info['script'] = os.path.basename(h)
+                    elif h.startswith('Velocity refrence wave from file'):
+                        w = h.split('"')[1] if '"' in h else ''
+                        wf = os.path.join(os.path.dirname(path), w)
+                        info['wave'] = w
+                        if w and os.path.exists(wf):
+                            with open(wf) as wfid:
+                                info['wave'] = runstate.fingerprint(wfid.read())
+                continue
+            parts = line.split(':')
+            if len(parts) != 3:
+                continue
+            steps += 1
+            last = float(parts[0])
+            data = parts[2].strip()
+            counts += sum(int(data[k:k + 4], 16) for k in range(0, len(data), 4))
+    info['intervals'] = steps
+    info['counts'] = float(counts)
+    info['duration'] = last
+
+
+def describe(path, kind=None):
+    """ Catalog row (dict) of the run whose main file is path. """
+    kind = kind or _kind(path)
+    info = dict.fromkeys(c for c, t in _COLUMNS)
+    info.update(path=os.path.abspath(path),
+                directory=os.path.dirname(os.path.abspath(path)),
+                name=os.path.basename(_root(path, kind)), kind=kind,
+                stamp=_stamp(path, kind), scanned=time.time())
+    if kind == 'spec107':
+        _spec107(path, info)
+    elif kind == 'mvc0':
+        _mvc0(path, info)
+    elif kind == 'mdz':
+        _mdz(path, info)
+    else:
+        raise ValueError('Not a run: %s' % path)
+    return info
+
+
+def _date(s):
+    """ Unix time of 'YYYY-MM-DD[ HH:MM[:SS]]' (or of a number). """
+    if isinstance(s, (int, float)):
+        return float(s)
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError('Unknown date: %s' % s)
+
+
+class Catalog():
+    """ The SQLite run catalog.
+
+    Args:
+        fname: database file (created if needed).
+    """
+
+    def __init__(self, fname='runs.db'):
+        self.fname = fname
+        self.db = sqlite3.connect(fname)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS runs (%s)' %
+                        ', '.join('%s %s' % c for c in _COLUMNS))
+        for c in _INDEXES:
+            self.db.execute('CREATE INDEX IF NOT EXISTS runs_%s ON runs (%s)' % (c, c))
+        self.db.commit()
+
+    def scan(self, directory, recursive=True, verbose=False):
+        """ Add or refresh the runs of directory and drop the vanished ones.
+
+        Returns: (added, updated, removed) numbers of runs.
+        """
+        directory = os.path.abspath(directory)
+        sub = os.path.join(directory, '')
+        known = dict(self.db.execute(
+            'SELECT path, stamp FROM runs WHERE directory = ? OR '
+            'substr(directory, 1, ?) = ?', (directory, len(sub), sub)))
+        added = updated = 0
+        seen = set()
+        for path, kind in self._walk(directory, recursive):
+            seen.add(path)
+            stamp = _stamp(path, kind)
+            if known.get(path) == stamp:
+                continue
+            try:
+                info = describe(path, kind)
+            except Exception as e:       # a damaged run must not stop the scan
+                if verbose:
+                    print('%s: %s' % (path, e))
+                continue
+            self.db.execute('INSERT OR REPLACE INTO runs VALUES (%s)' %
+                            ', '.join('?'*len(_COLUMNS)),
+                            [info[c] for c, t in _COLUMNS])
+            if path in known:
+                updated += 1
+            else:
+                added += 1
+            if verbose:
+                print(path)
+        gone = [p for p in known if p not in seen]
+        self.db.executemany('DELETE FROM runs WHERE path = ?', [(p,) for p in gone])
+        self.db.commit()
+        return added, updated, len(gone)
+
+    def _walk(self, directory, recursive):
+        for root, dirs, files in os.walk(directory):
+            for f in sorted(files):
+                kind = _kind(os.path.join(root, f))
+                if kind is not None:
+                    yield os.path.join(root, f), kind
+            if not recursive:
+                break
+
+    def query(self, where=None, args=(), since=None, until=None, name=None,
+              order='started', **params):
+        """ Runs matching the filters.
+
+        Args:
+            where: SQL condition on the columns, with ? placeholders.
+            args: values of the placeholders.
+            since, until: dates ('YYYY-MM-DD[ HH:MM[:SS]]' or unix time)
+                of the start of the run.
+            name: glob pattern on the run name.
+            order: column to sort by.
+            params: equality conditions on the columns (U=0x10, K=0x400,
+                firmware='MDAQ107-MAC', kind='mvc0' ...).
+
+        Returns: list of dicts.
+        """
+        cond, vals = [], []
+        if where:
+            cond.append('(%s)' % where)
+            vals += list(args)
+        if since is not None:
+            cond.append('started >= ?')
+            vals.append(_date(since))
+        if until is not None:
+            cond.append('started < ?')
+            vals.append(_date(until))
+        if name is not None:
+            cond.append('name GLOB ?')
+            vals.append(name)
+        cols = set(c for c, t in _COLUMNS)
+        for k, v in params.items():
+            if k not in cols:
+                raise ValueError('No column %s' % k)
+            cond.append('%s = ?' % k)
+            vals.append(v)
+        if order not in cols:
+            raise ValueError('No column %s' % order)
+        sql = 'SELECT * FROM runs'
+        if cond:
+            sql += ' WHERE ' + ' AND '.join(cond)
+        sql += ' ORDER BY %s' % order
+        return [dict(r) for r in self.db.execute(sql, vals)]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def _table(rows):
+    cols = ('started', 'name', 'kind', 'firmware', 'K', 'U', 'intervals',
+            'counts', 'duration', 'directory')
+    print(' '.join(cols))
+    for r in rows:
+        t = (time.strftime('%Y-%m-%d_%H:%M', time.localtime(r['started']))
+             if r['started'] else '-')
+        print('%s %s %s %s %s %s %s %s %s %s' % (
+            t, r['name'], r['kind'], r['firmware'] or '-',
+            '%X' % r['K'] if r['K'] is not None else '-',
+            '%X' % r['U'] if r['U'] is not None else '-',
+            r['intervals'], '%.0f' % r['counts'] if r['counts'] is not None else '-',
+            '%.0f' % r['duration'] if r['duration'] is not None else '-',
+            r['directory']))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SQLite catalog of the runs.')
+    parser.add_argument('--db', default='runs.db', help='Database file.')
+    sub = parser.add_subparsers(dest='command')
+    sc = sub.add_parser('scan', help='Add or refresh the runs of directories.')
+    sc.add_argument('directories', nargs='+')
+    sc.add_argument('-v', '--verbose', action='store_true')
+    qu = sub.add_parser('query', help='List runs.')
+    for col in ('K', 'U', 'O', 'Q'):
+        qu.add_argument('--' + col, type=lambda s: int(s, 0), default=None)
+    qu.add_argument('--firmware', default=None)
+    qu.add_argument('--kind', default=None)
+    qu.add_argument('--since', default=None, help='YYYY-MM-DD[ HH:MM[:SS]]')
+    qu.add_argument('--until', default=None, help='YYYY-MM-DD[ HH:MM[:SS]]')
+    qu.add_argument('--name', default=None, help='Glob pattern of the run name.')
+    qu.add_argument('--where', default=None, help='SQL condition on the columns.')
+    args = parser.parse_args()
+
+    cat = Catalog(args.db)
+    if args.command == 'scan':
+        for d in args.directories:
+            t = time.time()
+            a, u, r = cat.scan(d, verbose=args.verbose)
+            print('%s: %d added, %d updated, %d removed (%.2f s)' % (
+                  d, a, u, r, time.time() - t))
+    elif args.command == 'query':
+        params = dict((k, getattr(args, k)) for k in
+                      ('K', 'U', 'O', 'Q', 'firmware', 'kind')
+                      if getattr(args, k) is not None)
+        _table(cat.query(args.where, since=args.since, until=args.until,
+                         name=args.name, **params))
+    else:
+        parser.print_help()
+    cat.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Interval spectra from cumulative snapshots (continuous counting).
+
+In the continuous mode the module counts without interruption (N = 0, no
+Z between downloads). Each download is a snapshot of the cumulative
+counters and the intervals are the differences of consecutive snapshots,
+taken on the client with one vectorized subtraction. The counters and the
+cycle counter (M) roll over at the width of their download format, so the
+differences are taken modulo 2**bits::
+
+    >>> dif = cumulative.Differ(1024, bits=16)     # 4 hex digits (Y, mdaq107)
+    >>> dif.reset(counts0, M0)                     # first snapshot
+    >>> interval, cycles = dif.update(counts, M)   # next snapshots
+
+A channel (or the cycle counter) must not receive 2**bits counts (cycles)
+between two snapshots: choose the download interval accordingly (see
+:func:`maxinterval`).
+
+Class:
+    cumulative.Differ
+
+Func:
+    cumulative.maxinterval
+"""
+
+import numpy as np
+
+
+class Differ():
+    """ Differences between consecutive cumulative snapshots.
+
+    Args:
+        nchan: number of channels.
+        bits: width of the counters in the download format (16 for the Y
+            dump of mdaq107, 32 for the binary I dump or the Y dump of
+            mdaq209).
+        mbits: width of the cycle counter M (8 hex digits: 32).
+    """
+
+    def __init__(self, nchan, bits=32, mbits=32):
+        self.nchan = nchan
+        self.mask = (1 << bits) - 1
+        self.mmask = (1 << mbits) - 1
+        self.last = None
+        self.lastM = None
+        self.cycles = 0            # cycles since reset, without roll over
+        self.total = np.zeros(nchan, np.int64)
+
+    def reset(self, counts, M):
+        """ Take the first snapshot as origin. """
+        self.last = np.asarray(counts, np.int64).copy()
+        self.lastM = int(M)
+        self.cycles = 0
+        self.total[:] = 0
+
+    def update(self, counts, M):
+        """ New snapshot.
+
+        Returns: (interval, cycles): counters and cycles since the last
+            snapshot.
+        """
+        c = np.asarray(counts, np.int64)
+        if self.last is None:
+            self.reset(c, M)
+            return np.zeros(self.nchan, np.int64), 0
+        interval = (c - self.last) & self.mask
+        dM = (int(M) - self.lastM) & self.mmask
+        self.last = c.copy()
+        self.lastM = int(M)
+        self.cycles += dM
+        self.total += interval
+        return interval, dM
+
+
+def maxinterval(rate, nchan, bits, freq=None, mbits=32, margin=0.5):
+    """ Longest snapshot interval (seconds) without ambiguous roll over.
+
+    Args:
+        rate: expected total count rate (counts/s). The busiest channel
+            is taken as 4 times the mean rate per channel.
+        nchan: number of channels.
+        bits: width of the counters.
+        freq: drive frequency (Hz), to check the cycle counter too.
+        margin: fraction of the range to use.
+    """
+    t = margin*(1 << bits)/(4.*rate/nchan)
+    if freq:
+        t = min(t, margin*(1 << mbits)/freq)
+    return t
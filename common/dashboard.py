@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Local HTTP live dashboard of the running spectra.
+
+A small web server (standard library only, bound to localhost) that shows
+in a browser the accumulated spectrum, the count rate and the cycles of
+each acquisition publishing on a livespec segment (spectrum107.py --shm
+NAME). It runs in its own process (started by hand, or by spectrum107.py
+--http PORT) and only reads the shared memory, once per new interval,
+whatever the number of viewers: the acquisition does not serve anything.
+
+The browser long-polls the spectrum: it sends the ETag of the snapshot it
+has (start time of the run and seqlock sequence number) and the request is held until a newer
+one is published. The reply is a compact binary frame with only the
+channels that changed since the client's snapshot (or the full spectrum
+when the client has none, or it is too old)::
+
+    python dashboard.py mdaq107 [mdaq209 ...] [--port 8107]
+
+then open http://localhost:8107/ on the lab PC (or through an SSH tunnel).
+
+Routes:
+    /                      the page
+    /instruments           JSON list of the segments
+    /NAME/spectrum         binary frame (ETag, If-None-Match, ?wait=seconds)
+    /NAME/state            JSON with cycles, intervals, times and rate
+    /NAME/counts           the accumulated spectrum as text (like .counts)
+
+Frame (little endian)::
+
+    header  magic 'MDQF', kind (0 full, 1 delta), n, base seq, seq,
+            cycles, intervals, tstart, ti, tf, last interval counts
+    full    n float64: the accumulated spectrum
+    delta   n uint32 channels, then n int32 increments since "base seq"
+
+Class:
+    dashboard.Feed
+    dashboard.Server
+"""
+
+import collections
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+import livespec
+
+_MAGIC = b'MDQF'
+_FRAME = struct.Struct('<4sBxxxIQQQQdddd')
+_FULL, _DELTA = 0, 1
+HISTORY = 16              # snapshots kept as bases of the deltas
+MAXWAIT = 30.             # longest hold of a long-poll (seconds)
+
+
+class Feed():
+    """ Snapshots of one livespec segment and their encoded frames.
+
+    A thread waits on the segment and wakes the held requests when a new
+    snapshot arrives. The segment is looked for again when it disappears
+    or is replaced (next run of the acquisition).
+
+    Args:
+        name: name of the livespec segment.
+        retry: seconds between attempts to (re)attach the segment.
+    """
+
+    def __init__(self, name, retry=2.):
+        self.name = name
+        self.retry = retry
+        self.reader = None
+        self.snap = None
+        self.etag = None
+        self.nchan = 0
+        self.history = collections.OrderedDict()   # etag -> snapshot
+        self._frames = {}                          # (base, etag) -> bytes
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _attach(self):
+        try:
+            rd = livespec.Reader(self.name)
+        except (FileNotFoundError, ValueError):
+            return False
+        snap = rd.snapshot()
+        if (self.snap is not None and self.reader is not None and
+                snap['tstart'] == self.snap['tstart']):
+            rd.close()                             # the same segment
+            return False
+        if self.reader is not None:
+            self.reader.close()
+        self.reader = rd
+        with self.cond:
+            self.history.clear()
+            self._frames.clear()
+            self.nchan = rd.nchan
+            self._store(snap)
+        return True
+
+    def _store(self, snap):
+        """ New snapshot (with self.cond held). """
+        if self.snap is not None and snap['tstart'] != self.snap['tstart']:
+            self.history.clear()
+            self._frames.clear()
+        self.snap = snap
+        self.etag = '"%d.%d"' % (int(snap['tstart']*1000), snap['seq'])
+        self.history[self.etag] = snap
+        while len(self.history) > HISTORY:
+            old = self.history.popitem(last=False)[0]
+            for key in [k for k in self._frames if old in k]:
+                del self._frames[key]
+        self.cond.notify_all()
+
+    def _run(self):
+        tlast = 0.
+        while self.running:
+            if self.reader is None or time.time() - tlast > self.retry:
+                tlast = time.time()
+                if not self._attach() and self.reader is None:
+                    time.sleep(self.retry)
+                    continue
+            snap = self.reader.wait(self.snap['seq'], timeout=self.retry)
+            if snap is not None:
+                tlast = time.time()
+                with self.cond:
+                    self._store(snap)
+
+    def wait(self, etag, timeout):
+        """ Wait (at most timeout seconds) for a snapshot with an ETag
+        other than etag.
+
+        Returns: (snapshot, its ETag), or (None, None) if the segment was
+            never seen.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.snap is not None and
+                               self.etag != etag, timeout)
+            return self.snap, self.etag
+
+    def frame(self, base=None):
+        """ Binary frame of the current snapshot, as a delta from the
+        snapshot with ETag "base" when it is still kept. """
+        with self.cond:
+            if base not in self.history or base == self.etag:
+                base = None
+            key = (base, self.etag)
+            if key not in self._frames:
+                self._frames[key] = self._encode(self.snap, base)
+            return self._frames[key]
+
+    def _encode(self, snap, base):
+        last = float(snap['last'].sum())
+        total = snap['total']
+        if base is not None:
+            old = self.history[base]
+            d = total - old['total']
+            idx = np.flatnonzero(d)
+            # A delta is worth it if it is shorter than the full spectrum.
+            if idx.size < self.nchan and np.abs(d).max(initial=0) < 2**31:
+                head = _FRAME.pack(_MAGIC, _DELTA, idx.size, old['seq'], snap['seq'],
+                                   snap['cycles'], snap['nintervals'],
+                                   snap['tstart'], snap['ti'], snap['tf'], last)
+                return (head + idx.astype('<u4').tobytes() +
+                        np.rint(d[idx]).astype('<i4').tobytes())
+        head = _FRAME.pack(_MAGIC, _FULL, total.size, 0, snap['seq'],
+                           snap['cycles'], snap['nintervals'],
+                           snap['tstart'], snap['ti'], snap['tf'], last)
+        return head + total.astype('<f8').tobytes()
+
+    def state(self):
+        """ JSON-able summary of the current snapshot. """
+        s = self.snap
+        if s is None:
+            return {'name': self.name, 'attached': False}
+        last = float(s['last'].sum())
+        dt = s['tf'] - s['ti']
+        return {'name': self.name, 'attached': True, 'nchan': self.nchan,
+                'seq': s['seq'], 'cycles': s['cycles'],
+                'intervals': s['nintervals'], 'tstart': s['tstart'],
+                'ti': s['ti'], 'tf': s['tf'], 'counts': float(s['total'].sum()),
+                'last': last, 'rate': last/dt if dt > 0 else 0.}
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        if self.reader is not None:
+            self.reader.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server_version = 'mdaq-dashboard'
+
+    def log_message(self, format, *args):
+        pass                                   # quiet: it runs beside the acquisition
+
+    def _send(self, code, body=b'', ctype='text/plain', headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        feeds = self.server.feeds
+        if not parts:
+            return self._send(200, _PAGE.encode('utf8'), 'text/html; charset=utf-8')
+        if parts == ['instruments']:
+            body = json.dumps([f.state() for f in feeds.values()])
+            return self._send(200, body.encode(), 'application/json')
+        if len(parts) != 2 or parts[0] not in feeds:
+            return self._send(404, b'Not found\n')
+        feed = feeds[parts[0]]
+        if parts[1] == 'state':
+            return self._send(200, json.dumps(feed.state()).encode(),
+                              'application/json')
+        if parts[1] == 'counts':
+            if feed.snap is None:
+                return self._send(503, b'Not attached\n')
+            body = '\n'.join('%d' % c for c in feed.snap['total']) + '\n'
+            return self._send(200, body.encode())
+        if parts[1] != 'spectrum':
+            return self._send(404, b'Not found\n')
+        base = self.headers.get('If-None-Match')
+        try:
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+        except ValueError:
+            return self._send(400, b'Bad wait\n')
+        snap, etag = feed.wait(base, min(max(wait, 0.), MAXWAIT))
+        if snap is None:
+            return self._send(503, b'Not attached\n')
+        if etag == base:
+            return self._send(304, headers=[('ETag', etag)])
+        self._send(200, feed.frame(base), 'application/octet-stream',
+                   [('ETag', etag)])
+
+
+class Server():
+    """ The dashboard web server.
+
+    Args:
+        names: names of the livespec segments shown.
+        port: TCP port.
+        host: address to bind (localhost only by default).
+    """
+
+    def __init__(self, names, port=8107, host='127.0.0.1'):
+        self.feeds = collections.OrderedDict((n, Feed(n)) for n in names)
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.feeds = self.feeds
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def start(self):
+        """ Serve from a background thread. """
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for f in self.feeds.values():
+            f.close()
+
+
+_PAGE = r"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>mdaq live</title>
+<style>
+body{font-family:sans-serif;margin:1em;background:#fafafa}
+.inst{margin-bottom:1.5em}canvas{background:#fff;border:1px solid #ccc;width:100%;height:320px}
+.info{font-family:monospace;margin:.3em 0}
+</style></head><body>
+<div id="all"></div>
+<script>
+const MAXWAIT = 25;
+function draw(cv, y) {
+  const w = cv.width = cv.clientWidth, h = cv.height = cv.clientHeight;
+  const g = cv.getContext('2d');
+  let lo = Infinity, hi = -Infinity;
+  for (const v of y) { if (v < lo) lo = v; if (v > hi) hi = v; }
+  if (hi <= lo) hi = lo + 1;
+  g.clearRect(0, 0, w, h); g.beginPath();
+  for (let i = 0; i < y.length; i++) {
+    const px = i*(w - 1)/(y.length - 1), py = h - 4 - (y[i] - lo)*(h - 8)/(hi - lo);
+    i ? g.lineTo(px, py) : g.moveTo(px, py);
+  }
+  g.strokeStyle = '#036'; g.stroke();
+}
+async function follow(name) {
+  const div = document.createElement('div'); div.className = 'inst';
+  div.innerHTML = '<h3>' + name + '</h3><div class="info"></div><canvas></canvas>';
+  document.getElementById('all').appendChild(div);
+  const info = div.querySelector('.info'), cv = div.querySelector('canvas');
+  let etag = null, y = null;
+  for (;;) {
+    let r;
+    try {
+      r = await fetch(name + '/spectrum?wait=' + MAXWAIT,
+                      {headers: etag ? {'If-None-Match': etag} : {}});
+    } catch (e) { await new Promise(ok => setTimeout(ok, 2000)); continue; }
+    if (r.status == 304) continue;
+    if (r.status != 200) { info.textContent = 'waiting for the acquisition';
+                           await new Promise(ok => setTimeout(ok, 2000)); continue; }
+    const b = new DataView(await r.arrayBuffer());
+    const kind = b.getUint8(4), n = b.getUint32(8, true);
+    const cycles = Number(b.getBigUint64(28, true)), nint = Number(b.getBigUint64(36, true));
+    const ti = b.getFloat64(52, true), tf = b.getFloat64(60, true), last = b.getFloat64(68, true);
+    const H = 76;
+    if (kind == 0) {
+      y = new Float64Array(n);
+      for (let i = 0; i < n; i++) y[i] = b.getFloat64(H + 8*i, true);
+    } else {
+      for (let i = 0; i < n; i++)
+        y[b.getUint32(H + 4*i, true)] += b.getInt32(H + 4*n + 4*i, true);
+    }
+    etag = r.headers.get('ETag');
+    let total = 0; for (const v of y) total += v;
+    info.textContent = nint + ' intervals, ' + cycles + ' cycles, ' + total + ' counts, ' +
+                       (tf > ti ? (last/(tf - ti)).toFixed(1) : '-') + ' cps';
+    draw(cv, y);
+  }
+}
+fetch('instruments').then(r => r.json()).then(l => l.forEach(s => follow(s.name)));
+</script></body></html>
+"""
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Live spectra of the acquisitions publishing on livespec '
+                    'segments, served on http://localhost:PORT/.')
+    parser.add_argument('names', nargs='+', help='Names of the livespec segments.')
+    parser.add_argument('--port', type=int, default=8107, help='TCP port.')
+    args = parser.parse_args()
+
+    srv = Server(args.names, args.port)
+    print('Dashboard on http://localhost:%d/ (Ctrl + C to quit)' % srv.port)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Vectorized decoding of the MDAQ hexadecimal strings.
+
+Same job as mdaq.hes2numlist and mdaq.heswis2numlist, but the result is a
+numpy array and the conversion is done without a python loop, so a full
+spectrum (getCounters) or a wave (getWave) is decoded in a few microseconds.
+
+Func:
+    decode.hex2array
+    decode.hexws2array
+"""
+
+import numpy as np
+
+# ASCII code -> value of the hexadecimal digit (upper or lower case).
+_HEXVAL = np.zeros(256, dtype=np.uint32)
+_HEXVAL[np.frombuffer(b'0123456789', np.uint8)] = np.arange(10)
+_HEXVAL[np.frombuffer(b'ABCDEF', np.uint8)] = np.arange(10, 16)
+_HEXVAL[np.frombuffer(b'abcdef', np.uint8)] = np.arange(10, 16)
+
+
+def hex2array(string, bn):
+    """ Hexadecimal string to numpy array of integers.
+
+    Args:
+        string: str or bytes with hexadecimal integers of the same char
+            length without separation character. A trailing terminator
+            (\\r\\n) is ignored.
+        bn: integer. Number of characters per hexadecimal number (4 or 8).
+
+    Returns: numpy array (uint32 for bn <= 8, else uint64).
+
+    Example:
+        hex2array('0001000A000D\\r\\n',4) returns array([1,10,13]).
+    """
+    if isinstance(string, str):
+        string = string.encode('ascii')
+    string = string.rstrip(b'\r\n')
+    n = len(string)//bn
+    d = _HEXVAL[np.frombuffer(string, np.uint8, count=n*bn)].reshape(n, bn)
+    dtype = np.uint32 if bn <= 8 else np.uint64
+    d = d.astype(dtype)
+    w = (np.ones(bn, dtype) << (4*np.arange(bn-1, -1, -1)).astype(dtype))
+    return d @ w
+
+
+def hexws2array(string):
+    """ Hexadecimal string with space separated numbers to numpy array.
+
+    Counterpart of mdaq.heswis2numlist: '0001 000A 000D' returns
+    array([1,10,13]). When all the numbers have the same number of digits
+    the conversion is vectorized; otherwise (as in the '%x' interval lines
+    of spectrum107 logs) each number is converted on its own.
+
+    Returns: numpy array of uint64, whatever the widths of the numbers.
+    """
+    a = string.split()
+    if not a:
+        return np.zeros(0, np.uint64)
+    bn = len(a[0])
+    joined = ''.join(a)
+    if len(joined) == bn*len(a) and all(len(k) == bn for k in a):
+        return hex2array(joined, bn).astype(np.uint64)
+    return np.fromiter((int(k, 16) for k in a), np.uint64, len(a))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Duty cycle and dead time accounting of an acquisition.
+
+The run is seen as a sequence of counting windows (the module is counting)
+separated by gaps (the module waits for the computer). For every interval
+the ledger keeps when the counting really started and ended, and how the
+gap after it was spent::
+
+    overshoot   from the real end of the counting to its detection (M
+                query or RK notice, see schedule.py)
+    download    reading the counters
+    setup       clear, N and START of the next interval
+    idle        the rest of the gap (not accounted by any stage)
+
+Parsing and writing the intervals is also timed ('parse' and 'write'), but
+in spectrum107 it is done while the module counts the next interval, so it
+only adds dead time when it does not fit in the counting (it shows up as
+idle).
+
+    >>> led = duty.Ledger('run.00.duty')
+    >>> with led.stage('setup'):
+    ...     hw.clear(); hw.setCycleNumber(N); hw.start()
+    >>> ...
+    >>> led.counting(start, stop, err)       # when the end is confirmed
+    >>> with led.stage('download'):
+    ...     hw.getCounters()
+    >>> led.close()
+    >>> print(led.report())                  # duty cycle of the run
+
+The .duty file has one row per interval: start and stop of the counting
+(seconds from the creation of the ledger), uncertainty of the start, gap
+after it and the time of each stage.
+
+Class:
+    duty.Ledger
+"""
+
+import os
+import time
+
+STAGES = ('overshoot', 'download', 'setup', 'parse', 'write')
+DEAD = ('overshoot', 'download', 'setup')     # stages done in the gap
+
+
+class _Span():
+    """ Context manager adding the elapsed time to a stage. """
+
+    def __init__(self, ledger, name):
+        self.ledger = ledger
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.ledger.add(self.name, time.time() - self.t)
+        return False
+
+
+class Ledger():
+    """ Per interval accounting of counting and dead times.
+
+    Args:
+        fname: None or the file where the rows are written as the
+            intervals end (the .duty file of the run).
+        append: if True the rows are added to an existing fname (a resumed
+            run; the times of the new rows start from the new ledger).
+        profiler: None or a profiling.Profiler, where the stages are also
+            added as spans 'stage:name'.
+    """
+
+    def __init__(self, fname=None, append=False, profiler=None):
+        self.t0 = time.time()
+        self.profiler = profiler
+        self.rows = []
+        self.lead = dict.fromkeys(STAGES, 0.)   # stages before the first start
+        self._open = None                        # interval waiting for its gap
+        self._stages = self.lead
+        self.tclose = None
+        self.fid = None
+        if fname is not None:
+            new = not (append and os.path.exists(fname))
+            self.fid = open(fname, 'w' if new else 'a')
+            if new:
+                self.fid.write('# start stop err gap idle ' + ' '.join(STAGES) + '\n')
+
+    def stage(self, name):
+        """ Context manager timing a stage (one of STAGES). """
+        return _Span(self, name)
+
+    def add(self, name, dt):
+        """ Add dt seconds to the stage name of the current gap. """
+        self._stages[name] += dt
+        if self.profiler is not None:
+            self.profiler.add('stage:' + name, dt)
+
+    def counting(self, start, stop, err=0.):
+        """ Register a counting window (absolute times, as time.time()).
+
+        Args:
+            start: best estimate of the start (e.g. the middle of the START
+                command round trip).
+            stop: best estimate of the end (see schedule.Completion.end).
+            err: uncertainty of start.
+        """
+        if self._open is not None:
+            self._finish(start)
+        self._open = {'start': start, 'stop': stop, 'err': err}
+        self._stages = dict.fromkeys(STAGES, 0.)
+        self._open['stages'] = self._stages
+
+    def _finish(self, tnext):
+        row = self._open
+        row['gap'] = max(tnext - row['stop'], 0.)
+        row['idle'] = max(row['gap'] - sum(row['stages'][k] for k in DEAD), 0.)
+        self.rows.append(row)
+        self._open = None
+        if self.fid is not None:
+            vals = [row['start'] - self.t0, row['stop'] - self.t0, row['err'],
+                    row['gap'], row['idle']] + [row['stages'][k] for k in STAGES]
+            self.fid.write(' '.join('%.6f' % v for v in vals) + '\n')
+            self.fid.flush()
+
+    def close(self):
+        """ End the run: the gap of the last interval ends now. """
+        if self.tclose is not None:
+            return
+        self.tclose = time.time()
+        if self._open is not None:
+            self._finish(self.tclose)
+        if self.fid is not None:
+            self.fid.close()
+
+    def summary(self):
+        """ Totals of the run as a dict (seconds and fractions). """
+        tend = self.tclose if self.tclose is not None else time.time()
+        live = sum(r['stop'] - r['start'] for r in self.rows)
+        res = {'intervals': len(self.rows), 'live': live,
+               'wall': tend - self.t0,
+               'gaps': sum(r['gap'] for r in self.rows),
+               'idle': sum(r['idle'] for r in self.rows),
+               'err': max([r['err'] for r in self.rows] or [0.])}
+        for k in STAGES:
+            res[k] = sum(r['stages'][k] for r in self.rows)
+        # Source time seen by the run: from the first start to the end.
+        res['span'] = tend - self.rows[0]['start'] if self.rows else 0.
+        res['duty'] = live/res['span'] if res['span'] > 0 else 0.
+        res['lead'] = self.rows[0]['start'] - self.t0 if self.rows else 0.
+        return res
+
+    def report(self):
+        """ Text report of the duty cycle of the run. """
+        s = self.summary()
+        n = max(s['intervals'], 1)
+        lines = ['Duty cycle: %.4f%% (%d intervals)' % (100*s['duty'], s['intervals']),
+                 '  counting %.3f s of %.3f s (from the first start; %.3f s before it)'
+                 % (s['live'], s['span'], s['lead']),
+                 '  start uncertainty <= %.4f s' % s['err'],
+                 '  dead time per interval %.4f s:' % (s['gaps']/n)]
+        for k in DEAD:
+            lines.append('    %-10s %.4f s' % (k, s[k]/n))
+        lines.append('    %-10s %.4f s' % ('idle', s['idle']/n))
+        lines.append('  overlapped with the counting: parse %.4f s, write %.4f s'
+                     % (s['parse']/n, s['write']/n))
+        return '\n'.join(lines)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Incremental fitting of Mössbauer spectra with Lorentzian lines.
+
+The transmission model is::
+
+    y(v) = B * (1 - sum_c A_c * sum_i r_i * L(v; x_ci, w_c))
+    L(v; x, w) = (w/2)**2 / ((v-x)**2 + (w/2)**2)
+
+with a baseline B and components made of lines with relative intensities
+r_i, depth A_c, width w_c and positions x_ci linear in the component
+parameters (centre, quadrupole splitting, hyperfine field). Model and
+Jacobian are evaluated with numpy for all the channels at once, and the
+fit is a Levenberg-Marquardt with Poisson weights.
+
+A Fitter keeps the last solution, so each refit during an acquisition
+starts from it and converges in a couple of iterations. A Worker runs the
+refits on a thread, the acquisition loop only hands it the spectrum::
+
+    >>> model = fit.Model([fit.Sextet(A=0.05, d=0., e=0., B=33., w=0.3)])
+    >>> worker = fit.Worker(fit.Fitter(model, v))
+    >>> worker.submit(y)           # in the acquisition loop, never blocks
+    >>> worker.result              # last result, or None
+
+Class:
+    fit.Singlet, fit.Doublet, fit.Sextet: components.
+    fit.Model: sum of components over a baseline.
+    fit.Fitter: warm started Levenberg-Marquardt.
+    fit.Worker: runs a Fitter on a thread.
+
+Func:
+    fit.parse: components from a text such as 'sextet(B=33)+doublet(q=0.6)'.
+"""
+
+import re
+import threading
+import time
+
+import numpy as np
+
+
+# Line positions of a magnetic sextet per Tesla of hyperfine field (mm/s/T)
+# from alpha-Fe at 33.0 T: +-5.312, +-3.076, +-0.840 mm/s.
+_SEXTETFACTOR = np.array([-5.312, -3.076, -0.840, 0.840, 3.076, 5.312])/33.0
+_SEXTETSHIFT = np.array([1., -1., -1., -1., -1., 1.])
+
+
+class _Component():
+    """ Group of Lorentzian lines sharing depth A and width w.
+
+    Parameters are [A, <position parameters>, w]. The line positions are
+    self.matrix @ <position parameters>.
+    """
+    kind = ''
+    posnames = []
+    matrix = np.zeros((0, 0))
+    ratios = np.zeros(0)
+
+    def __init__(self, A=0.05, w=0.3, **pos):
+        self.p0 = [A] + [pos.get(k, 0.) for k in self.posnames] + [w]
+
+    @property
+    def names(self):
+        return ['A'] + list(self.posnames) + ['w']
+
+    def __repr__(self):
+        pars = ', '.join('%s=%g' % (k, v) for k, v in zip(self.names, self.p0))
+        return '%s(%s)' % (self.__class__.__name__, pars)
+
+
+class Singlet(_Component):
+    """ Single line. Parameters: A (depth), d (centre), w (width). """
+    kind = 'singlet'
+    posnames = ['d']
+    matrix = np.array([[1.]])
+    ratios = np.array([1.])
+
+
+class Doublet(_Component):
+    """ Quadrupole doublet. Parameters: A, d (centre), q (splitting), w. """
+    kind = 'doublet'
+    posnames = ['d', 'q']
+    matrix = np.array([[1., -0.5], [1., 0.5]])
+    ratios = np.array([1., 1.])
+
+
+class Sextet(_Component):
+    """ Magnetic sextet with 3:2:1:1:2:3 intensities.
+
+    Parameters: A, d (centre), e (quadrupole shift), B (field, T), w.
+    """
+    kind = 'sextet'
+    posnames = ['d', 'e', 'B']
+    matrix = np.column_stack([np.ones(6), _SEXTETSHIFT, _SEXTETFACTOR])
+    ratios = np.array([3., 2., 1., 1., 2., 3.])/3.
+
+
+_KINDS = dict((c.kind, c) for c in (Singlet, Doublet, Sextet))
+_TERM = re.compile(r'\s*(\w+)\s*(?:\((.*?)\))?\s*$')
+
+
+def parse(text):
+    """ Components from a text, for command line options.
+
+    The components are joined with '+', each one with the initial values
+    of its parameters (the rest keep the defaults)::
+
+        >>> fit.parse('sextet(B=33, w=0.3) + doublet(d=0.3, q=0.6)')
+        [Sextet(A=0.05, d=0, e=0, B=33, w=0.3), Doublet(A=0.05, d=0.3, q=0.6, w=0.3)]
+
+    Raises: ValueError on an unknown component or parameter.
+    """
+    comps = []
+    for term in text.split('+'):
+        m = _TERM.match(term)
+        if m is None or m.group(1).lower() not in _KINDS:
+            raise ValueError('Unknown component "%s" (%s)' % (
+                             term.strip(), ', '.join(sorted(_KINDS))))
+        cls = _KINDS[m.group(1).lower()]
+        pars = {}
+        for item in (m.group(2) or '').split(','):
+            if not item.strip():
+                continue
+            try:
+                k, v = item.split('=')
+                k = k.strip()
+                pars[k] = float(v)
+            except ValueError:
+                raise ValueError('Bad parameter "%s" in "%s"' % (item.strip(),
+                                                                 term.strip()))
+            if k not in ['A'] + cls.posnames + ['w']:
+                raise ValueError('%s has no parameter %s' % (cls.kind, k))
+        comps.append(cls(**pars))
+    return comps
+
+
+class Model():
+    """ Baseline times one minus the absorption of the components.
+
+    The parameter vector is [B0, comp0 pars..., comp1 pars..., ...] where B0
+    is the baseline (counts per channel).
+    """
+
+    def __init__(self, components, baseline=None):
+        self.components = list(components)
+        self.baseline = baseline
+        self.names = ['baseline']
+        self._slices = []
+        k = 1
+        for i, c in enumerate(self.components):
+            n = len(c.names)
+            self._slices.append(slice(k, k+n))
+            self.names += ['%s%d.%s' % (c.kind, i, name) for name in c.names]
+            k += n
+        self.npars = k
+
+    def p0(self, y=None):
+        """ Initial parameter vector. Baseline from y if not given. """
+        b = self.baseline
+        if b is None:
+            b = 1. if y is None else float(np.percentile(y, 90))
+        p = [b]
+        for c in self.components:
+            p += c.p0
+        return np.array(p, dtype=float)
+
+    def evaluate(self, x, p, jacobian=False):
+        """ Model on the points x. With jacobian=True returns (y, J). """
+        x = np.asarray(x, dtype=float)
+        B = p[0]
+        S = np.zeros_like(x)
+        if jacobian:
+            J = np.empty((x.size, self.npars))
+        for c, sl in zip(self.components, self._slices):
+            q = p[sl]
+            A, w = q[0], q[-1]
+            h = 0.5*w
+            pos = c.matrix @ q[1:-1]                 # (m,)
+            d = x[None, :] - pos[:, None]            # (m,n)
+            D = d*d + h*h
+            L = h*h/D
+            rL = c.ratios[:, None]*L
+            S += A*rL.sum(axis=0)
+            if jacobian:
+                J[:, sl.start] = -B*rL.sum(axis=0)
+                dLdx = 2.*d*L/D                      # d L / d position
+                g = -B*A*c.ratios[:, None]*dLdx      # (m,n)
+                J[:, sl.start+1:sl.stop-1] = g.T @ c.matrix
+                dLdw = h*d*d/(D*D)
+                J[:, sl.stop-1] = -B*A*(c.ratios[:, None]*dLdw).sum(axis=0)
+        y = B*(1. - S)
+        if jacobian:
+            J[:, 0] = 1. - S
+            return y, J
+        return y
+
+
+class Fitter():
+    """ Levenberg-Marquardt fit of a Model, warm started from the last fit.
+
+    Args:
+        model: a Model.
+        x: the abscissa (channels or velocities, see velocity.axis).
+        p0: initial parameters. If None, Model.p0() on the first spectrum.
+        fixed: names (Model.names) of parameters kept fixed.
+    """
+    MAXITER = 20
+    TOL = 1e-6
+
+    def __init__(self, model, x, p0=None, fixed=()):
+        self.model = model
+        self.x = np.asarray(x, dtype=float)
+        self.p = None if p0 is None else np.array(p0, dtype=float)
+        self.free = np.array([k not in fixed for k in model.names])
+        self.lam = 1e-3
+        self.result = None
+
+    def reset(self, p0=None):
+        """ Forget the last solution (next fit is a cold start). """
+        self.p = None if p0 is None else np.array(p0, dtype=float)
+        self.lam = 1e-3
+
+    def fit(self, y, maxiter=None):
+        """ Fit the spectrum y (counts per channel, same length as x).
+
+        Returns: dict with 'p' (parameters), 'dp' (errors), 'names',
+            'chi2' (reduced), 'niter' and 'time' (seconds of the fit).
+        """
+        t0 = time.time()
+        y = np.asarray(y, dtype=float)
+        wgt = 1./np.maximum(y, 1.)
+        p = self.model.p0(y) if self.p is None else self.p.copy()
+        free = self.free
+        lam = self.lam
+        f, J = self.model.evaluate(self.x, p, jacobian=True)
+        r = y - f
+        chi2 = np.dot(wgt*r, r)
+        niter = 0
+        for niter in range(1, (maxiter or self.MAXITER) + 1):
+            Jf = J[:, free]
+            A = Jf.T @ (wgt[:, None]*Jf)
+            g = Jf.T @ (wgt*r)
+            while True:
+                step = np.linalg.solve(A + lam*np.diag(np.diag(A)), g)
+                pn = p.copy()
+                pn[free] += step
+                fn, Jn = self.model.evaluate(self.x, pn, jacobian=True)
+                rn = y - fn
+                chi2n = np.dot(wgt*rn, rn)
+                if chi2n <= chi2 or lam > 1e10:
+                    break
+                lam *= 10.
+            improvement = chi2 - chi2n
+            if chi2n <= chi2:
+                p, f, J, r, chi2 = pn, fn, Jn, rn, chi2n
+                lam = max(lam/10., 1e-7)
+            if improvement < self.TOL*chi2 or lam > 1e10:
+                break
+
+        Jf = J[:, free]
+        dp = np.zeros_like(p)
+        try:
+            cov = np.linalg.inv(Jf.T @ (wgt[:, None]*Jf))
+            dp[free] = np.sqrt(np.abs(np.diag(cov)))
+        except np.linalg.LinAlgError:
+            dp[free] = np.nan
+        self.p, self.lam = p, lam
+        dof = max(y.size - int(free.sum()), 1)
+        self.result = {'p': p, 'dp': dp, 'names': self.model.names,
+                       'chi2': chi2/dof, 'niter': niter,
+                       'time': time.time() - t0}
+        return self.result
+
+
+class Worker():
+    """ Runs Fitter.fit on a daemon thread.
+
+    submit() only stores the spectrum and returns. If spectra arrive faster
+    than they are fitted, the older pending one is dropped: the fit always
+    goes on the latest accumulated spectrum.
+
+    Args:
+        fitter: a Fitter.
+        callback: None or function called with each result (from the
+            worker thread).
+    """
+
+    def __init__(self, fitter, callback=None):
+        self.fitter = fitter
+        self.callback = callback
+        self.result = None
+        self.nfits = 0
+        self._pending = None
+        self._cond = threading.Condition()
+        self._alive = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, y):
+        """ Queue the spectrum y to be fitted (a copy is taken). """
+        y = np.array(y, dtype=float)
+        with self._cond:
+            self._pending = y
+            self._cond.notify()
+
+    def wait(self, timeout=None):
+        """ Wait until there is no pending spectrum. Returns the result. """
+        t0 = time.time()
+        with self._cond:
+            while self._pending is not None or self._busy:
+                left = None if timeout is None else timeout - (time.time()-t0)
+                if left is not None and left <= 0:
+                    break
+                self._cond.wait(left)
+        return self.result
+
+    def stop(self):
+        """ Stop the worker thread. """
+        with self._cond:
+            self._alive = False
+            self._cond.notify_all()
+        self._thread.join()
+
+    _busy = False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and self._alive:
+                    self._cond.wait()
+                if not self._alive:
+                    return
+                y, self._pending = self._pending, None
+                self._busy = True
+            try:
+                res = self.fitter.fit(y)
+            except (np.linalg.LinAlgError, FloatingPointError, ValueError):
+                # A singular spectrum (for example the first empty interval)
+                # must not kill the worker: restart cold on the next one.
+                self.fitter.reset()
+                res = None
+            with self._cond:
+                self._busy = False
+                if res is not None:
+                    self.result = res
+                    self.nfits += 1
+                self._cond.notify_all()
+            if res is not None and self.callback is not None:
+                self.callback(res)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Folding of constant-acceleration (MAC) spectra.
+
+With the triangular and Veiga's (smooth triangular) reference waves every MAC
+spectrum holds the velocity range twice: channel i and channel s-i (modulo the
+number of channels) see the same velocity. The number s is the FOLD POINT. This
+module finds s from the spectrum itself and returns the folded spectrum.
+
+Works with the counters of any MDAQ generation (1024 channels from mdaq107,
+2048/P from mdaq209) given as a list, a tuple or a numpy array, for example the
+output of Instrument.getBinCounters() or mdaq.hes2numlist(getCounters()[:-2],n).
+
+    >>> s = fold.foldpoint(counts)
+    >>> y, dy, s = fold.fold(counts, s)
+
+Func:
+    fold.foldpoint
+    fold.fold
+    fold.mirror
+    fold.channels
+"""
+
+import numpy as np
+
+
+def foldpoint(counts, window=None):
+    """ Find the fold point of a MAC spectrum.
+
+    The fold point s is the maximum of the cross-correlation between the
+    spectrum and its mirror image, i.e. of the circular self-convolution
+    R(s) = sum_i c[i]*c[s-i] of the baseline subtracted spectrum, computed
+    with FFT. Sub-channel precision is obtained with a parabolic
+    interpolation around the maximum.
+
+    Args:
+        counts: 1D array-like with the counters. If it is 2D (one interval
+            per row) the rows are summed before the search.
+        window: None or (smin,smax). Search s only between smin and smax
+            (channels, modulo the number of channels).
+
+    Returns: the fold point s (float, 0 <= s < number of channels).
+    """
+    c = np.asarray(counts, dtype=float)
+    if c.ndim == 2:
+        c = c.sum(axis=0)
+    n = c.size
+    x = c - c.mean()
+    f = np.fft.rfft(x)
+    r = np.fft.irfft(f*f, n)
+
+    if window is None:
+        k = int(np.argmax(r))
+    else:
+        cand = np.arange(int(np.floor(window[0])), int(np.ceil(window[1]))+1) % n
+        k = int(cand[np.argmax(r[cand])])
+
+    r0, r1, r2 = r[(k-1) % n], r[k], r[(k+1) % n]
+    den = r0 - 2*r1 + r2
+    delta = 0.5*(r0 - r2)/den if den != 0 else 0.
+    return float((k + delta) % n)
+
+
+def mirror(counts, s):
+    """ Mirror image of the spectrum around the fold point s.
+
+    Returns m such that m[i] is the content of the (non integer) channel
+    s-i, obtained by distributing linearly between the two neighbour
+    channels. The weights of each original channel add to one, so counts
+    are conserved.
+
+    Args:
+        counts: array-like, the counters on the last axis.
+        s: fold point (float).
+
+    Returns: (m, w0, w1, j0, j1) the mirrored counters, the weights and the
+        index arrays of the two channels used for each i.
+    """
+    c = np.asarray(counts, dtype=float)
+    n = c.shape[-1]
+    sf = np.floor(s)
+    frac = s - sf
+    i = np.arange(n)
+    j0 = (int(sf) - i) % n
+    j1 = (j0 + 1) % n
+    w0, w1 = 1. - frac, frac
+    m = w0*c[..., j0] + w1*c[..., j1]
+    return m, w0, w1, j0, j1
+
+
+def channels(n, s):
+    """ Original channels of the folded spectrum.
+
+    Returns the n//2 indexes i such that fold(...)[0][k] = c[i[k]] + c(s-i[k]).
+    Useful to pick the velocity of each folded channel from velocity.axis.
+    """
+    return (int(np.ceil(s/2.)) + np.arange(n//2)) % n
+
+
+def fold(counts, s=None, window=None):
+    """ Fold a MAC spectrum.
+
+    Args:
+        counts: array-like with the counters. Folding is done along the last
+            axis, so a 2D array (one interval per row) folds every row at
+            once with the same fold point.
+        s: fold point. If None it is calculated with :func:`foldpoint`.
+        window: passed to :func:`foldpoint` when s is None.
+
+    Returns: (y, dy, s)
+        y: folded spectrum, n//2 channels starting at the channel next to
+           the s/2 axis.
+        dy: Poisson errors of y propagated through the interpolation
+           (correlation between neighbour channels is neglected).
+        s: the used fold point.
+    """
+    c = np.asarray(counts, dtype=float)
+    if s is None:
+        s = foldpoint(c, window)
+    n = c.shape[-1]
+    m, w0, w1, j0, j1 = mirror(c, s)
+    var = c + w0*w0*c[..., j0] + w1*w1*c[..., j1]
+
+    idx = channels(n, s)
+    y = c[..., idx] + m[..., idx]
+    dy = np.sqrt(var[..., idx])
+    return y, dy, s
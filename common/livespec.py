@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Live spectrum publication through POSIX shared memory.
+
+The acquisition loop publishes the accumulated spectrum, the spectrum of the
+last interval, the number of cycles and the interval timestamps on a shared
+memory segment. Any number of viewer, plotting or fitting processes attach
+to the segment by its name and read consistent snapshots. Nothing goes
+through the filesystem and the readers never make the writer wait.
+
+Consistency is given by a seqlock: the writer makes the sequence number odd
+before writing and even after. A reader copies the data and retries if the
+sequence number was odd or changed meanwhile.
+
+Writer (acquisition loop)::
+
+    >>> pub = livespec.Publisher('mdaq107', 1024)
+    >>> pub.publish(COUNTS, COUNTSnow, cycles, ti, tf)
+    >>> pub.close()                  # at the end of the run
+
+Reader (any other process)::
+
+    >>> rd = livespec.Reader('mdaq107')
+    >>> snap = rd.snapshot()         # dict with copies of the data
+    >>> snap = rd.wait(snap['seq'])  # blocks until a newer one is published
+
+Class:
+    livespec.Publisher
+    livespec.Reader
+"""
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_MAGIC = b'MDQS'
+# magic, nchan, seq, cycles, nintervals, tstart, ti, tf
+_HEADER = struct.Struct('<4sIQQQddd')
+_HEADERSIZE = 64                       # header padded to keep data aligned
+_SEQOFFSET = 8
+
+
+def _size(nchan):
+    return _HEADERSIZE + 2*8*nchan
+
+
+class Publisher():
+    """ Writer side of a live spectrum segment.
+
+    Args:
+        name: name of the segment (readers use the same name).
+        nchan: number of channels of the spectra.
+    """
+
+    def __init__(self, name, nchan):
+        self.name = name
+        self.nchan = nchan
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True,
+                                                  size=_size(nchan))
+        except FileExistsError:
+            # Left over by a crashed acquisition: take it again.
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True,
+                                                  size=_size(nchan))
+        self.buf = self.shm.buf
+        self._seq = np.ndarray(1, np.uint64, self.buf, _SEQOFFSET)
+        self._total = np.ndarray(nchan, np.float64, self.buf, _HEADERSIZE)
+        self._last = np.ndarray(nchan, np.float64, self.buf,
+                                _HEADERSIZE + 8*nchan)
+        self.tstart = time.time()
+        self.nintervals = 0
+        _HEADER.pack_into(self.buf, 0, _MAGIC, nchan, 0, 0, 0,
+                          self.tstart, 0., 0.)
+
+    def publish(self, total, last, cycles, ti, tf):
+        """ Publish a new snapshot.
+
+        Args:
+            total: accumulated spectrum.
+            last: spectrum of the last interval.
+            cycles: accumulated number of cycles.
+            ti, tf: start and end of the last interval (seconds).
+        """
+        self.nintervals += 1
+        seq = int(self._seq[0])
+        self._seq[0] = seq + 1                     # odd: writing
+        self._total[:] = total
+        self._last[:] = last
+        struct.pack_into('<QQddd', self.buf, 16, int(cycles),
+                         self.nintervals, self.tstart, ti, tf)
+        self._seq[0] = seq + 2                     # even: consistent
+
+    def close(self):
+        """ Close and remove the segment. """
+        del self._seq, self._total, self._last
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class Reader():
+    """ Reader side of a live spectrum segment.
+
+    Args:
+        name: name given to the Publisher.
+    """
+
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # python < 3.13: keep the resource tracker of this process from
+            # removing the segment of the acquisition when the viewer exits.
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.buf = self.shm.buf
+        magic, self.nchan = struct.unpack_from('<4sI', self.buf, 0)
+        if magic != _MAGIC:
+            self.shm.close()
+            raise ValueError('%s is not a live spectrum segment' % name)
+        self._seq = np.ndarray(1, np.uint64, self.buf, _SEQOFFSET)
+        self._data = np.ndarray(2*self.nchan, np.float64, self.buf,
+                                _HEADERSIZE)
+
+    def seq(self):
+        """ Current sequence number (even when consistent). """
+        return int(self._seq[0])
+
+    def snapshot(self, tries=1000):
+        """ Consistent copy of the published data.
+
+        Returns: dict with 'total', 'last' (numpy arrays), 'cycles',
+            'nintervals', 'tstart', 'ti', 'tf' and 'seq'.
+        """
+        for k in range(tries):
+            s1 = int(self._seq[0])
+            if s1 & 1:
+                time.sleep(0)
+                continue
+            data = self._data.copy()
+            hdr = struct.unpack_from('<QQddd', self.buf, 16)
+            if int(self._seq[0]) == s1:
+                n = self.nchan
+                return {'total': data[:n], 'last': data[n:],
+                        'cycles': hdr[0], 'nintervals': hdr[1],
+                        'tstart': hdr[2], 'ti': hdr[3], 'tf': hdr[4],
+                        'seq': s1}
+        raise RuntimeError('Could not get a consistent snapshot')
+
+    def wait(self, seq=None, timeout=None, poll=0.05):
+        """ Wait for a snapshot newer than seq (None: the current one).
+
+        Returns: the new snapshot, or None on timeout.
+        """
+        if seq is None:
+            seq = self.seq()
+        t0 = time.time()
+        while self.seq() <= seq:
+            if timeout is not None and time.time() - t0 > timeout:
+                return None
+            time.sleep(poll)
+        return self.snapshot()
+
+    def close(self):
+        """ Detach from the segment (the segment is not removed). """
+        del self._seq, self._data
+        self.buf = None
+        self.shm.close()
+
+
+if __name__ == "__main__":
+    # Minimal text viewer: python livespec.py NAME
+    import sys
+    rd = Reader(sys.argv[1])
+    snap = rd.snapshot()
+    try:
+        while True:
+            print('%5d intervals %10d cycles %12d counts  last %10d (%.1f cps)'%(
+                  snap['nintervals'], snap['cycles'], snap['total'].sum(),
+                  snap['last'].sum(),
+                  snap['last'].sum()/max(snap['tf']-snap['ti'], 1e-9)))
+            snap = rd.wait(snap['seq'])
+    except KeyboardInterrupt:
+        rd.close()
@@ -0,0 +1,824 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Driver core for all the MDAQ-UNLP generations, driven by firmware profiles.
+
+The modules speak the same serial protocol and differ only in constants:
+channels, clock, hex digits of the counters dump, status command and
+layout, limits of the parameters, commands available (step, gate sum,
+wave selection) and START semantics (the mdaq209 sends RK when N cycles
+are done). Here those differences are data (PROFILES) and there is one
+implementation of every command, so the fast paths (binary downloads,
+vectorized decoding, pipelined configuration) serve every generation.
+
+The profile is chosen from the banner the module sends on RESET::
+
+    >>> hw = mdaqcore.Instrument('/dev/ttyUSB0')     # resets and detects
+    >>> hw.firmware
+    'MDAQ209'
+    >>> hw.configure(P=2, U=0x800, K=0x1900, N=100)  # one write, one read
+    >>> counts = hw.getCountsArray(2)                # 'J' dump, numpy array
+
+or given, to attach without reset (a run in progress)::
+
+    >>> hw = mdaqcore.Instrument('/dev/ttyUSB0', firmware='MDAQ107-MAC')
+
+mdaq107/mdaq.py and mdaq209/mdaq.py keep their names (Instrument,
+frequency, hes2numlist ...) on top of this core; they add common/ to
+sys.path, as the scripts do.
+
+Class:
+    mdaqcore.Instrument
+
+Func:
+    mdaqcore.detect
+    mdaqcore.frequency
+    mdaqcore.nchannels
+    mdaqcore.hes2numlist
+    mdaqcore.heswis2numlist
+    mdaqcore.wavefromfile
+    mdaqcore.wavesonfile
+"""
+
+import struct
+from time import sleep, time
+
+import numpy as np
+
+from decode import hex2array
+
+__version__ = '0.5.261019'
+__author__ = 'Gustavo A. Pasquevich'
+
+_CODE = 'ascii'
+_TERMINATOR = '\r\n'   #CR+LF
+
+# Firmware profiles. CLOCK, CANALES, STEP, HEXDIGITS, UMIN and ULOCK are also
+# the firmware constants of planner.py.
+#   BANNER     answer to RESET (without terminator)
+#   STATUS     (command, reply length with terminator, fields)
+#   LIMITS     (min, max) of each parameter the firmware has (the 209
+#              accepts P=0, but then the channels are not defined)
+#   COMMANDS   commands the firmware knows
+#   RK         START with N != 0 sends RK when the N cycles are done
+#   STARTCLEARS  START resets the cycle counter
+#   GATEORDER  the gate start must not be after its stop
+#   PIPELINE   accepts command and value in one write (see configure)
+#   TIMEOUT, BINTIMEOUT  serial timeouts (s): default and binary dumps
+PROFILES = {
+    'MDAQ107-MAC': {
+        'BANNER': 'MDAQ107-MAC', 'CLOCK': 41.78e6, 'CANALES': 1024,
+        'STEP': False, 'HEXDIGITS': 4, 'UMIN': 0x500, 'ULOCK': 0x200,
+        'STATUS': ('P', 26, ('K', 'Q', 'N', 'O', 'U')),
+        'LIMITS': {'K': (0, 0xFFF), 'Q': (0, 0xFFF), 'N': (0, 0xFFFF),
+                   'O': (0, 0xFFF), 'U': (0x500, 0xFFFF), 'G': (0, 0x3FF),
+                   'g': (0, 0x3FF)},
+        'COMMANDS': 'KQNOUGgPYIJVMZXWSTR',
+        'RK': False, 'STARTCLEARS': True, 'GATEORDER': True,
+        'PIPELINE': False,       # not verified on the 107 yet
+        'TIMEOUT': 2, 'BINTIMEOUT': 2},
+    'MDAQ209': {
+        'BANNER': 'MDAQ209', 'CLOCK': 120e6, 'CANALES': 2048,
+        'STEP': True, 'HEXDIGITS': 8, 'UMIN': 0x200, 'ULOCK': 0x200,
+        'STATUS': ('h', 61, ('C', 'U', 'P', 'N', 'M', 'K', 'G', 'g')),
+        'LIMITS': {'K': (0, 0x3FFF), 'N': (0, 0xFFFF), 'U': (0x200, 0xFFFF),
+                   'P': (1, 0x200), 'O': (0, 0xFFF), 'G': (0, 0x800),
+                   'g': (0, 0x800)},
+        'COMMANDS': 'KNUPOGghYIJVMmZXWLSTR',
+        'RK': True, 'STARTCLEARS': False, 'GATEORDER': False,
+        'PIPELINE': True,        # see the raw() example of the 209 driver
+        'TIMEOUT': 4, 'BINTIMEOUT': 10},    # 209A: low baudrate
+}
+
+# Order in which configure() sends the parameters.
+_ORDER = ('P', 'U', 'K', 'Q', 'O', 'G', 'g', 'N')
+_NAMES = {'K': 'Amplitude', 'Q': 'Central Channel', 'N': 'Cycle Number',
+          'O': 'Offset', 'U': 'TimeBase', 'P': 'Step', 'G': 'Gate start',
+          'g': 'Gate stop', 'C': 'Channels', 'M': 'Cycle Counter'}
+# Binary dumps: nbytes -> (command, struct format, numpy dtype)
+_BINARY = {4: ('I', 'I', '<u4'), 2: ('J', 'H', '<u2'), 1: ('V', 'B', 'u1')}
+
+
+class _UnexpectedProtocol(Exception):
+    def __init__(self, value, tipo=0, string=''):
+        if tipo == 0:
+            self.value = value
+        elif tipo == 1:
+            self.value = 'Unexpected response to the command %s. Response: "%s"'%(value,string)
+        elif tipo == 2:
+            self.value = 'Expected %s. Response: "%s"'%(value,string)
+        elif tipo == 'EchoFail':
+            self.value = 'Fallo en el echo del comando %s'%(value)
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def nchannels(firmware, P=1):
+    """ Channels of the counters for the step P (with the remainder channel
+    when P does not divide the channels of the firmware). """
+    C = PROFILES[firmware]['CANALES']
+    return C//P + (C % P != 0) if PROFILES[firmware]['STEP'] else C
+
+
+def frequency(firmware, U, P=1):
+    """ Frequency of the wave (Hz): f = CLOCK * STEP / CHANNELS / BASE. """
+    fw = PROFILES[firmware]
+    return fw['CLOCK']*(P if fw['STEP'] else 1)/fw['CANALES']/U
+
+
+def detect(banner):
+    """ Firmware of a RESET banner (None if unknown). """
+    banner = banner.strip()
+    for name, fw in PROFILES.items():
+        if banner == fw['BANNER']:
+            return name
+    return None
+
+
+class Instrument():
+    """ Intermediary between the MDAQ-UNLP Hardware and the python user.
+
+    Args:
+        port: serial port, for example '/dev/ttyS0' or '/dev/ttyUSB0'.
+        firmware: key of PROFILES. If None the module is reset and the
+            firmware is taken from its banner.
+        baudrate: of the serial port.
+
+    Attributes:
+        HWPARS: last known value of each parameter (from the status line
+            or the echo of the commands; None if unknown).
+        wanted: last value requested for each parameter (see recover).
+        counts: internal counter, updated by getBinCounters.
+    """
+    VERBOSE = True
+    COMMVERBOSE = False
+    PRETTY = False
+
+    def __init__(self, port, firmware=None, baudrate=115200):
+        # pyserial only where a port is opened: the profiles and helpers
+        # of this module are usable without it.
+        import serial
+        self.version = __version__
+        self.port = port
+        self.wanted = {}
+        self.firmware = None
+        self.ser = serial.Serial(port, baudrate, timeout=4)
+        if firmware is None:
+            self.reset()
+        else:
+            self._setprofile(firmware)
+
+    def _setprofile(self, firmware):
+        if firmware not in PROFILES:
+            raise ValueError('Unknown firmware %s (known: %s)'%(
+                             firmware, ', '.join(PROFILES)))
+        self.firmware = firmware
+        self.profile = PROFILES[firmware]
+        self.ser.timeout = self.profile['TIMEOUT']
+        self.HWPARS = dict.fromkeys(self.profile['STATUS'][2] + ('M',))
+        if not self.profile['STEP']:
+            self.HWPARS['P'] = 1
+        self.counts = np.zeros(self.nchan(), 'int')
+
+    def __repr__(self):
+        text = 'Intermediary serial object connected to MDAQ-UNLP hardware through\n'
+        text += 'port %s (%s)\n'%(self.port, self.firmware)
+        return text
+
+    # Low level ----------------------------------------------------------------
+
+    def _write(self, string):
+        if self.COMMVERBOSE:
+            print('>>', string)
+        self.ser.write(string.encode(_CODE))
+
+    def _read(self, n):
+        instr = self.ser.read(n).decode(_CODE)
+        if self.COMMVERBOSE:
+            print('<<', instr)
+        return instr
+
+    def _readline(self):
+        instr = self.ser.readline().decode(_CODE)
+        if self.COMMVERBOSE:
+            print('<<', instr)
+        return instr
+
+    def _require(self, com):
+        if com not in self.profile['COMMANDS']:
+            raise NotImplementedError('%s has no command %s'%(self.firmware, com))
+
+    def _check(self, com, value):
+        # LIMITS lists the parameters of the firmware ('P' is the status
+        # command on mdaq107, not its step).
+        if com not in self.profile['LIMITS']:
+            raise NotImplementedError('%s has no parameter %s'%(self.firmware, com))
+        lo, hi = self.profile['LIMITS'][com]
+        if value > hi:
+            raise ValueError('Maximum %s 0x%X'%(com, hi))
+        if value < lo:
+            raise ValueError('Minimum %s 0x%X'%(com, lo))
+
+    def _command_with_echo(self, com, value):
+        """ Auxiliar function for standar setting parameters comunication.
+
+        Send the "com" command, then read the next 7 chars: "com":XXXX?. Then
+        send the wanted value and read the echo.
+
+        If all works right the corresponding self.HWPARS is updated. On the
+        contrary all the HWPARS are set to None, indicating the unknown
+        situation. The requested value is always kept on self.wanted, so
+        :meth:`recover` knows what to re-apply.
+        """
+        self.wanted[com] = value
+        self._write(com)
+        instr = self._read(7)
+        if instr[0:2] != com+':' or instr[6:7] != '?':
+            raise _UnexpectedProtocol(com, tipo=1, string=instr)
+        numstr = '{:04X}'.format(value)
+        self._write(numstr)
+        self._echo(com, numstr)
+
+    def _echo(self, com, numstr):
+        instr = self._read(6)
+        if instr != numstr + _TERMINATOR:          # something wrong!!!
+            for k in self.HWPARS:
+                self.HWPARS[k] = None
+            raise _UnexpectedProtocol(com, tipo='EchoFail')
+        self.HWPARS[com] = int(numstr, 16)
+
+    def _set(self, com, value):
+        self._check(com, value)
+        self._command_with_echo(com, value)
+        if self.VERBOSE:
+            print('%s %d OK'%(_NAMES[com], value))
+
+    #===========================================================================
+    # Parameters ===============================================================
+    #===========================================================================
+
+    #K) Set Amplitude -> 'K:kkkk?'[4xHEX] + EOL (kkkk is actual value)
+    def setAmplitude(self, K):
+        """ SET the AMPLITUDE of the wave. Send "K" command to the Instrument.
+
+            Args:
+                K: an integer between 0 and the maximum of the firmware
+                   (0xFFF on mdaq107, 0x3FFF on mdaq209). """
+        self._set('K', K)
+
+    #Q) Set Central Channel -> 'Q:qqqq?'[4xHEX] + EOL (mdaq107)
+    def setCentralChannel(self, Q):
+        """ Set the CENTRAL CHANNEL. Send "Q" command to the instrument.
+
+            Args:
+                Q: an integer betwenn 0 and 4095. """
+        self._set('Q', Q)
+
+    #N) Set Number of cycles -> 'N:nnnn?'[4xHEX] + EOL
+    def setCycleNumber(self, N):
+        """ SET the NUMBER of CYCLES to be adquired. Send "N" command to Hardware.
+
+            Args:
+                N: an integer between 0 and 0xFFFF."""
+        self._set('N', N)
+
+    #O) Set Offset -> 'O:oooo?'[4xHEX] + EOL
+    def setOffset(self, Offset):
+        """ SET the OFFSET. Send "O" command to the Instrument.
+
+            Args:
+                Offset: an integer between 0 and 0xFFF."""
+        self._set('O', Offset)
+
+    #U) Set Time Base -> 'U:uuuu?'[4xHEX] + EOL
+    def setTimeBase(self, U):
+        """ SET the TIMEBASE on the instrument. Send "U" command to Hardware.
+
+            Args:
+                U: an integer between the minimum of the firmware (0x500 on
+                   mdaq107, 0x200 on mdaq209) and 0xFFFF."""
+        self._set('U', U)
+
+    #P) Set step -> 'P:pppp?'[4xHEX] + EOL (mdaq209)
+    def setStep(self, P):
+        """ SET the STEP on the instrument. Send "P" command to Hardware.
+
+            Args:
+                P: an integer between 0x0001 (1) and 0x0200 (512)."""
+        self._set('P', P)
+
+    #G) Set start gate channel -> 'G:gggg?'[4xHEX] + EOL
+    #g) Set stop gate channel -> 'g:gggg?'[4xHEX] + EOL
+    def setGate(self, ch0, ch1):
+        """ SET the GATE wave. Send G and g to the instrument.
+
+            Args:
+                 ch0: Start-channel of the GATE signal.
+
+                 ch1: End-channel of the GATE signal. """
+        self._check('G', ch0)
+        self._check('g', ch1)
+        if self.profile['GATEORDER'] and ch0 > ch1:
+            raise ValueError('ch0 must be lower than ch1')
+        self._command_with_echo('G', ch0)
+        self._command_with_echo('g', ch1)
+        if self.VERBOSE:
+            print('Gate set between channels %d and %d'%(ch0, ch1) + ' OK')
+
+    def configure(self, **params):
+        """ Set several parameters at once.
+
+        On firmwares that accept it (PIPELINE) every command is written with
+        its value in a single write ('P0002U0800K1900...') and the echoes
+        are read afterwards, so the whole configuration costs one round
+        trip instead of two per parameter. Elsewhere the parameters are
+        sent one by one.
+
+        Args:
+            params: K, Q, N, O, U, P, G, g (sent in the order P U K Q O G g N).
+
+        Returns: list of the parameters sent.
+        """
+        keys = [k for k in _ORDER if k in params]
+        unknown = set(params) - set(_ORDER)
+        if unknown:
+            raise ValueError('Unknown parameters %s'%' '.join(sorted(unknown)))
+        for k in keys:
+            self._check(k, params[k])
+        if 'G' in params and 'g' in params and self.profile['GATEORDER'] \
+                and params['G'] > params['g']:
+            raise ValueError('ch0 must be lower than ch1')
+        if not self.profile['PIPELINE']:
+            for k in keys:
+                self._command_with_echo(k, params[k])
+            return keys
+        nums = ['{:04X}'.format(params[k]) for k in keys]
+        self.wanted.update((k, params[k]) for k in keys)
+        self._write(''.join(k + n for k, n in zip(keys, nums)))
+        for k, n in zip(keys, nums):
+            instr = self._read(7)
+            if instr[0:2] != k+':' or instr[6:7] != '?':
+                for p in self.HWPARS:
+                    self.HWPARS[p] = None
+                raise _UnexpectedProtocol(k, tipo=1, string=instr)
+            self._echo(k, n)
+        if self.VERBOSE:
+            print('Configured %s OK'%' '.join('%s=%d'%(k, params[k]) for k in keys))
+        return keys
+
+    #===========================================================================
+    # Status ===================================================================
+    #===========================================================================
+
+    # P) Status (mdaq107) -> 'kkkk qqqq nnnn oooo uuuu' + EOL
+    # h) Status (mdaq209) -> 'cccc uuuu pppp nnnnnnnn mmmmmmmm kkkkkkkk gggggggg gggggggg' + EOL
+    def getStatus(self, pretty=False):
+        """ GET instrument STATUS. Send the status command of the firmware
+        ("P" on mdaq107, "h" on mdaq209).
+
+        Returns:
+            The status string given by the Hardware (without terminator):
+            K Q N O U on mdaq107; C U P N M K G g on mdaq209. HWPARS is
+            updated.
+
+        kwarg pretty: True or {False}. Prints status in a pretty format.
+        """
+        com, length, fields = self.profile['STATUS']
+        self._write(com)
+        instr = self._readline()
+        if len(instr) != length:
+            raise _UnexpectedProtocol(com, tipo=1, string=instr)
+        words = instr.split()
+        for k, w in zip(fields, words):
+            self.HWPARS[k] = int(w, 16)
+        if pretty or self.PRETTY:
+            print('Parameter         HEX       DECIMAL')
+            for k, w in zip(fields, words):
+                print('{:<16}: {:>8} {:>8}'.format(_NAMES.get(k, k), w, int(w, 16)))
+            if self.HWPARS.get('U'):
+                print('Frequency ......: {:.2f} Hz'.format(self.frequency()))
+        return instr[:-2]   # the -2 removes the TERMINATOR \r\n
+
+    def nchan(self, P=None):
+        """ Channels of the counters (for the actual step, or P). """
+        if not self.profile['STEP']:
+            return self.profile['CANALES']
+        if P is None:
+            P = self.HWPARS.get('P') or 1
+        return nchannels(self.firmware, P)
+
+    def _step(self):
+        """ Actual step (read from the module if unknown). """
+        if not self.profile['STEP']:
+            return 1
+        if self.HWPARS.get('P') is None:
+            self.getStatus()
+        P = self.HWPARS['P']
+        if P == 0:
+            raise NotImplementedError('%s at step P=0 has no defined channels: '
+                                      'set the step first (setStep)'%self.firmware)
+        return P
+
+    def frequency(self, P=None, U=None):
+        """ Actual work frequency (in Herz), from HWPARS unless given. """
+        if P is None:
+            P = self.HWPARS.get('P') or 1
+        if U is None:
+            U = self.HWPARS['U']
+        return frequency(self.firmware, U, P)
+
+    #===========================================================================
+    # Data =====================================================================
+    #===========================================================================
+
+    #Y) Dump hex Spectrum -> HEXDIGITS x channels + EOL
+    def getCounters(self):
+        """ GET the COUNTERS in Hexadecimal ASCII representation.
+
+        Send "Y" command to Hardware and return the response.
+
+        Returns:
+            The complete string returned by the instrument: HEXDIGITS chars
+            per channel + 2 chars for TERMINATOR.
+        """
+        n = nchannels(self.firmware, self._step())
+        self._write('Y')
+        instr = self._readline()
+        if len(instr) != self.profile['HEXDIGITS']*n + 2:
+            raise _UnexpectedProtocol('Y', tipo=1, string=instr)
+        return instr
+
+    #I) Dump bin Spectrum -> 4 x channels (LSB first, uint32) Warning! No EOL
+    #J) Dump short bin Spectrum -> 2 x channels (LSB first, uint16) Warning! No EOL
+    #V) Dump char bin Spectrum -> 1 x channels (uint8) Warning! No EOL
+    def _binary(self, nbytes):
+        com, fmt, dtype = _BINARY[nbytes]
+        n = nchannels(self.firmware, self._step())
+        self._write(com)
+        self.ser.timeout = self.profile['BINTIMEOUT']
+        try:
+            instr = self.ser.read(nbytes*n)
+        finally:
+            self.ser.timeout = self.profile['TIMEOUT']
+        if len(instr) != nbytes*n:
+            raise _UnexpectedProtocol(com, tipo=1, string='%d bytes'%len(instr))
+        return instr, n
+
+    def getBinCounters(self, nbytes=4):
+        """ GET de COUNTERS in Binary format.
+
+        Send "I","J" or "V" commands to the Hardware.
+
+        Args:
+            nbytes: bytes per channel: 4 (I, uint32, default), 2 (J, uint16)
+                or 1 (V, uint8).
+
+        Returns: tuple with the counters. The internal counter is updated.
+        """
+        instr, n = self._binary(nbytes)
+        ctemp = struct.unpack('<%d'%n + _BINARY[nbytes][1], instr)
+        if len(self.counts) != n:
+            self.counts = np.zeros(n, 'int')
+        self.counts += ctemp
+        if self.VERBOSE:
+            print('internal counter updated')
+        return ctemp
+
+    def getCountsArray(self, nbytes=None):
+        """ GET the COUNTERS as a numpy array, by the fastest path.
+
+        Args:
+            nbytes: None for the hexadecimal dump (Y), decoded without a
+                python loop; 4, 2 or 1 for a binary dump, read straight into
+                the array (the internal counter is not updated).
+
+        Returns: numpy array of the counters.
+        """
+        if nbytes is None:
+            return hex2array(self.getCounters(), self.profile['HEXDIGITS'])
+        instr, n = self._binary(nbytes)
+        return np.frombuffer(instr, _BINARY[nbytes][2])
+
+    #M) Dump Cycle Counter -> MMMMMMMM + EOL
+    def getCycleNumber(self):
+        """ GET the NUMBER of CYCLES being adquiring. Send "M" command.
+
+        Returns: An int number."""
+        self._write('M')
+        instr = self._readline()
+        if len(instr) != 10:
+            raise _UnexpectedProtocol('M', tipo=1, string=instr)
+        return int(instr, 16)
+
+    #m) Dump Sum(Spectrum(GGGG:gggg)) -> mmmmmmmm + EOL (mdaq209)
+    def getSumInGate(self):
+        """ GET the sum of counts in the channels between G and g.
+
+        Send "m" command to Hardware.
+
+        Returns: An int number."""
+        self._require('m')
+        self._write('m')
+        instr = self._readline()
+        if len(instr) != 10:
+            raise _UnexpectedProtocol('m', tipo=1, string=instr)
+        return int(instr, 16)
+
+    #Z) Reset Spectrum (resets cycle counter) -> 'OK' + EOL
+    def clear(self, soft=False):
+        """ CLEAR the counters.
+
+        Send "Z" command to the instrument. Put the cycle counter and the
+        memories on zero.
+
+        Args:
+            soft: {False} or True. If True it clears also the internal
+                counter (Instrument.counts). """
+        self._write('Z')
+        instr = self._readline()
+        if len(instr) != 4:
+            raise _UnexpectedProtocol('Z', tipo=1, string=instr)
+        if self.VERBOSE:
+            print('Counters Cleared')
+        if soft:
+            self.counts = np.zeros(self.nchan(), 'int')
+            if self.VERBOSE:
+                print('Internal Counter cleared')
+
+    #===========================================================================
+    # Wave =====================================================================
+    #===========================================================================
+
+    # X) Dump Waveform -> 4xHEX x CANALES + EOL
+    def getWave(self):
+        """ GET WAVE from hardware. Send "X" command to Hardware.
+
+        Returns: 4*CANALES + 2 length string (Wave + EOL).
+        """
+        self._write('X')
+        instr = self._readline()
+        if len(instr) != 4*self.profile['CANALES'] + 2:
+            raise _UnexpectedProtocol('Wave string not expected lenght')
+        return instr
+
+    # W) Upload Waveform -> 'OK' + EOL
+    def setWave(self, wavestr):
+        """ SET WAVE on hardware. Send "W" command to Hardware.
+
+        Args:
+            wavestr: string with the WAVE values one after the other in 4
+                hexadecimal digits, without spaces and without end of line
+                (4*CANALES chars).
+
+        Example:
+            wavestr='00000001000200030004......03FD03FE03FF'
+            correspond to a wave that start with the numbers 0,1,2,3,4 and
+            end with the numbers 0x3FD,0x3FE and 0x3FF.
+        """
+        self.ser.write(('W'+wavestr).encode(_CODE))
+        instr = self._readline()
+        if len(instr) != 4:
+            raise _UnexpectedProtocol('W', tipo=1, string=instr)
+
+    #L) Select waveform (+A:MAC DEFAULT, +V:MVC or +P:PROG) (mdaq209)
+    def selectWave(self, which):
+        """ SELECT from the stored waves on hardware. Send "L" command.
+
+        Args:
+            which: 'MAC' (or 'CA'), 'MVC' (or 'CV') or 'PROG'.
+        """
+        self._require('L')
+        dic = {'MAC': 'A', 'MVC': 'V', 'PROG': 'P', 'CA': 'A', 'CV': 'V'}
+        self._write('L'+dic[which])
+
+    #===========================================================================
+    # Run ======================================================================
+    #===========================================================================
+
+    # S) Start -> 'OK' + EOL (mdaq107 resets the cycle counter, mdaq209 not)
+    def start(self):
+        """ START the adquisition. Send "S" command to Hardware."""
+        self._write('S')
+        instr = self._read(4)
+        if instr != 'OK\r\n':
+            raise _UnexpectedProtocol('S', tipo=1, string=instr)
+
+    # T) Stop -> 'OK' + EOL
+    def stop(self):
+        """ STOP the adquisition. Send "T" command to Hardware."""
+        self._write('T')
+        instr = self._read(4)
+        if instr != 'OK\r\n':
+            raise _UnexpectedProtocol('T', tipo=1, string=instr)
+
+    def waitRK(self, timeout=None):
+        """ Wait until RK (answer to START when N != 0) appears on input
+        buffer (firmwares with RK).
+
+            Args:
+                timeout: seconds to wait for it (None: no limit). When
+                    they are over _UnexpectedProtocol is raised. """
+        if not self.profile['RK']:
+            raise NotImplementedError('%s sends no RK'%self.firmware)
+        tend = None if timeout is None else time() + timeout
+        while self.ser.inWaiting() < 4:
+            if tend is not None and time() > tend:
+                raise _UnexpectedProtocol('RK', tipo=2, string=self._read(
+                                          self.ser.inWaiting()))
+            sleep(0.001)
+        instr = self._read(4)
+        if instr != 'RK\r\n':
+            raise _UnexpectedProtocol('RK', tipo=2, string=instr)
+
+    # R) Reset -> BANNER + EOL
+    def reset(self):
+        """ RESET the hardware. Send "R" to the hardware.
+
+        Reset the hardware and clear the input buffer. If the firmware is
+        not known yet it is taken from the banner (see PROFILES).
+        """
+        # I don't remember why I send that '*'. Maybe to ensure
+        # abort any thing is waitting mdaq module
+        self._write('*')
+        self.ser.read(self.ser.inWaiting())   # vacio el buffer
+        self._write('R')
+        if self.firmware is None:
+            instr = self._readline()
+            fw = detect(instr)
+            if fw is None or not instr.endswith(_TERMINATOR):
+                raise _UnexpectedProtocol('Unknown module: RESET answered "%s"'%instr)
+            self._setprofile(fw)
+        else:
+            banner = self.profile['BANNER'] + _TERMINATOR
+            instr = self._read(len(banner))
+            if instr != banner:
+                raise _UnexpectedProtocol('R', tipo=1, string=instr)
+            for k in self.HWPARS:
+                self.HWPARS[k] = None
+            if not self.profile['STEP']:
+                self.HWPARS['P'] = 1
+        if self.ser.inWaiting() != 0:
+            raise _UnexpectedProtocol('R', tipo=1, string=instr)
+        print('reset.. OK')
+
+    #===========================================================================
+    # Auxiliary routines =======================================================
+    #===========================================================================
+
+    def open(self):
+        """ Open the serial port. """
+        self.ser.open()
+
+    def close(self):
+        """ Close the serial port. """
+        self.ser.close()
+
+    def raw(self, string):
+        """ Send raw strings to the MDAQxxxx and print the answer.
+
+        Example:
+            raw('K0001') will send the string K0001 and change the amplitude
+            to 0x0001 value. Inmediartly MDAQxxx answer KXXXX?0001 indicating
+            the change has be done. Where XXXX is the amplitude before
+            modification.
+        """
+        self._write(string)
+        sleep(0.1)
+        nb = self.ser.inWaiting()
+        strout = ''
+        while nb > 0:
+            strout += self.ser.read(nb).decode(_CODE)
+            nb = self.ser.inWaiting()
+            sleep(0.05)
+        print(strout)
+
+    def drain(self, quiet=0.005):
+        """ Discard everything waiting on the input buffer.
+
+        Keeps reading until the line stays silent for "quiet" seconds, so the
+        tail of a reply that was still arriving is also discarded.
+
+        Returns: the number of discarded bytes.
+        """
+        nb = 0
+        n = self.ser.inWaiting()
+        while n > 0:
+            nb += len(self.ser.read(n))
+            sleep(quiet)
+            n = self.ser.inWaiting()
+        return nb
+
+    def resync(self, tries=3):
+        """ Recover the command/answer framing without a hardware RESET.
+
+        Sends '*' to abort any half-received command, drains the input and
+        probes the module with the (cheap) status command until a well
+        formed status line is received. HWPARS is refreshed by the probe.
+
+        Returns: the status string.
+        """
+        for k in range(tries):
+            self._write('*')
+            self.drain()
+            try:
+                return self.getStatus()
+            except _UnexpectedProtocol:
+                if self.COMMVERBOSE:
+                    print('resync: bad status probe, try %d'%(k+1))
+        raise _UnexpectedProtocol('Could not resync with the module after '
+                                  '%d status probes'%tries)
+
+    def recover(self, restart=False, tries=3):
+        """ Fast recovery after an _UnexpectedProtocol error.
+
+        Alternative to reset() + setWave() + full configuration. The hardware
+        counters and the wave are untouched: framing is recovered with
+        :meth:`resync` and only the parameters whose actual value (from the
+        status line) differs from the last requested one (self.wanted) are
+        sent again. Parameters missing from the status line of the firmware
+        are sent again if requested.
+
+        Args:
+            restart: True or {False}. If True, START is sent at the end, to
+                resume the counting.
+            tries: number of status probes before giving up.
+
+        Returns: list with the re-applied parameters.
+        """
+        self.resync(tries)
+        status = self.profile['STATUS'][2]
+        fixed = []
+        for k in _ORDER:
+            if k in self.wanted and (k not in status or
+                                     self.HWPARS[k] != self.wanted[k]):
+                self._command_with_echo(k, self.wanted[k])
+                fixed.append(k)
+        if restart:
+            self.start()
+        if self.VERBOSE:
+            print('recover.. OK (re-applied: %s)'%(' '.join(fixed) or 'none'))
+        return fixed
+
+
+#==============================================================================
+# Helpers ======================================================================
+#==============================================================================
+
+def hes2numlist(string, bn):
+    """ Hexadecimal string to list of integers.
+
+    Args:
+        string: string with hexadecimal integers of the same char length
+                without separation character.
+        bn:     integer. Number of characters per hexadecimal number.
+
+    Returns: A list of integers (see decode.hex2array for a numpy array).
+
+    Example:
+        If string='0001000A000D0010...' and bn = 4 then the function
+        returns [1,10,13,16,...].
+    """
+    n = int(len(string)/bn)
+    return [int(string[i*bn:bn*(i+1)], 16) for i in range(n)]
+
+
+def heswis2numlist(string):
+    """ HExadecimal-String-WIth-Space-TO-NUMber-LIST.
+
+    Example:
+        if string='0001 000A 000D...' the function returns [1,10,13,...].
+    """
+    return [int(k, 16) for k in string.split()]
+
+
+def wavefromfile(datafile, label):
+    """ Takes the "label" wave from "datafile".
+
+    Args:
+        datafile: a file with MDAQxxx waves.
+        label: string that identifie the wave.
+
+    Returns: the wave string.
+
+    Read /auxilires/ondas.txt and /auxilires/ondas.dat for more information.
+    """
+    with open(datafile, 'r') as fid:
+        for k in fid.readlines():
+            if k.split(':')[0] == label:
+                return k.split(':')[1][:-1]   # el -1 es para eliminar el fin de
+                                              # línea al final del archivo
+    raise ValueError('Wave labeled: %s isn''t in the file %s'%(label, datafile))
+
+
+def wavesonfile(datafile):
+    """ List the waves contents of datafile.
+
+    Args: datafile: the name of a file with MDAQ waves.
+
+    Returns: a list with the labels of the waves on the file.
+    """
+    with open(datafile, 'r') as fid:
+        return [k.split(':')[0] for k in fid.readlines()
+                if not (k[0] == '#' or len(k) < 4096)]
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Acquisition planner: N, U, P and download format for a wanted interval.
+
+Each interval of an acquisition (as in spectrum107.espec0) costs, besides
+the counting time N/f, a dead time where the module does not count::
+
+    setup     Z, N and S commands (4 round trips)
+    wait      detection of the end of the counting (one M query, the end
+              is predicted, see schedule.py)
+    download  the counters: latency + bytes/throughput
+
+The planner evaluates all the combinations of time base U, step P and
+download format at once (numpy broadcasting over the grid). Among the
+combinations giving the target interval (within TOLERANCE, or the closest
+possible) and velocity resolution it picks the one with the best duty
+cycle = counting/(counting + dead), and then the drive frequency closest
+to "freq".
+
+    >>> link = planner.measure(hw)            # or planner.Link(0.002, 11520)
+    >>> plan = planner.plan('MDAQ209', link, interval=120, channels=512,
+    ...                     rate=2e4)
+    >>> print(planner.report(plan))
+
+Class:
+    planner.Link
+
+Func:
+    planner.plan
+    planner.grid
+    planner.measure
+    planner.report
+"""
+
+import time
+import warnings
+
+import numpy as np
+
+from mdaqcore import PROFILES
+
+# Firmware constants: clock, channels, step support, hex digits of the Y
+# dump, minimum U accepted by setTimeBase and U where the module stops
+# responding (and the rest of the profile, see mdaqcore.PROFILES).
+FIRMWARES = PROFILES
+
+NMAX = 0xFFFF
+SETUPROUNDTRIPS = 4       # Z, N (command + value) and S
+LOCKMARGIN = 1.25         # warn when U < LOCKMARGIN*ULOCK
+
+# Download formats: bytes per channel (None for the hex dump).
+FORMATS = {'I': 4, 'J': 2, 'V': 1, 'Y': None}
+TOLERANCE = 0.01          # accepted relative error of the interval
+
+
+class Link():
+    """ Serial link profile.
+
+    Args:
+        latency: seconds of a short command round trip.
+        throughput: bytes per second of a long reply.
+    """
+
+    def __init__(self, latency, throughput):
+        self.latency = latency
+        self.throughput = throughput
+
+    def __repr__(self):
+        return 'Link(latency=%.4g s, throughput=%.0f B/s)' % (self.latency,
+                                                              self.throughput)
+
+    def transfer(self, nbytes):
+        """ Seconds for a command with an nbytes reply. """
+        return self.latency + np.asarray(nbytes)/self.throughput
+
+
+def measure(hw, n=20):
+    """ Measure the link profile with an Instrument.
+
+    The latency is the mean time of n M queries; the throughput comes from
+    a Y (hex counters) download, which does not change anything on the
+    module.
+    """
+    t0 = time.time()
+    for k in range(n):
+        hw.getCycleNumber()
+    latency = (time.time() - t0)/n
+    t0 = time.time()
+    nbytes = len(hw.getCounters())
+    dt = time.time() - t0 - latency
+    return Link(latency, nbytes/max(dt, 1e-6))
+
+
+def _nchan(fw, P):
+    C = fw['CANALES']
+    return C//P + (C % P != 0)
+
+
+def grid(firmware, link, interval, channels=None, rate=None,
+         steps=None, formats=None):
+    """ Evaluate all the (U, P, format) combinations.
+
+    Args:
+        firmware: key of FIRMWARES ('MDAQ107-MAC' or 'MDAQ209').
+        link: a Link.
+        interval: wanted counting time per download (seconds).
+        channels: minimum number of channels (velocity resolution). P is
+            limited to CANALES/P >= channels.
+        rate: expected total count rate (counts/s). Used to reject
+            combinations that would overflow (mean + 6 sigma per channel)
+            the counters (4*HEXDIGITS bits) or the download format. If
+            None only the formats carrying the whole counters are accepted.
+        steps: candidate P values (default powers of two up to 0x200).
+        formats: candidate download formats (default all of FORMATS).
+
+    Returns: dict of arrays with shape (len(U), len(P), len(formats)) plus
+        the axes 'U', 'P' and 'formats'. Invalid combinations have duty 0.
+    """
+    fw = FIRMWARES[firmware]
+    U = np.arange(fw['UMIN'], 0x10000)
+    if fw['STEP']:
+        P = np.array(steps if steps is not None else [2**k for k in range(10)])
+    else:
+        P = np.array([1])
+    if channels is not None:
+        P = P[np.array([_nchan(fw, p) for p in P]) >= channels]
+        if P.size == 0:
+            raise ValueError('No step gives %d channels' % channels)
+    fmts = list(formats if formats is not None else FORMATS)
+    nchan = np.array([_nchan(fw, p) for p in P])
+
+    Ug = U[:, None].astype(float)
+    freq = fw['CLOCK']*P[None, :]/fw['CANALES']/Ug        # (nU, nP)
+    N = np.rint(interval*freq)
+    ok = (N >= 1) & (N <= NMAX)
+    tcount = N/freq
+
+    nbytes = np.array([[FORMATS[f]*n if FORMATS[f] else
+                        fw['HEXDIGITS']*n + 2 for f in fmts] for n in nchan])
+    tdown = link.transfer(nbytes)                         # (nP, nf)
+    tsetup = SETUPROUNDTRIPS*link.latency
+    twait = link.latency
+    dead = tsetup + twait + tdown[None, :, :]
+    tcount3 = tcount[:, :, None]
+    duty = tcount3/(tcount3 + dead)
+
+    valid = np.broadcast_to(ok[:, :, None], duty.shape).copy()
+    # The counters themselves are 4*HEXDIGITS bits wide (16 on the 107),
+    # whatever the download format.
+    counterbits = 4*fw['HEXDIGITS']
+    for k, f in enumerate(fmts):
+        bits = min(8*FORMATS[f], counterbits) if FORMATS[f] else counterbits
+        if rate is not None:
+            mean = rate*tcount/nchan[None, :]
+            valid[:, :, k] &= mean + 6*np.sqrt(mean) + 1 < 2.**bits
+        elif bits < counterbits:
+            valid[:, :, k] = False
+    duty = np.where(valid, duty, 0.)
+    return {'U': U, 'P': P, 'formats': fmts, 'nchan': nchan,
+            'freq': freq, 'N': N, 'tcount': tcount, 'dead': dead,
+            'duty': duty, 'valid': valid,
+            'tsetup': tsetup, 'twait': twait, 'tdown': tdown}
+
+
+def plan(firmware, link, interval, channels=None, rate=None, freq=10.,
+         steps=None, formats=None):
+    """ Best N, U, P and download format.
+
+    Args: as :func:`grid`, plus
+        freq: preferred drive frequency (Hz), used to choose among
+            combinations with the same duty cycle and interval error.
+
+    Returns: dict with N, U, P, format, nchan, freq, interval (actual
+        counting time), dead (dead time per interval), duty and warnings.
+    """
+    g = grid(firmware, link, interval, channels, rate, steps, formats)
+    duty = g['duty']
+    if not duty.any():
+        raise ValueError('No valid combination for an interval of %g s' % interval)
+    err = np.where(g['valid'], np.abs(g['tcount'] - interval)[:, :, None]/interval,
+                   np.inf)
+    # Lexicographic choice: interval error, duty (rounded, to let the
+    # frequency decide among practically equal ones), distance to freq.
+    best = err <= max(err.min(), TOLERANCE)
+    dkey = np.where(best, np.round(duty, 4), -1.)
+    best &= dkey == dkey.max()
+    df = np.abs(np.log(g['freq']/freq))[:, :, None]
+    iu, ip, jf = np.unravel_index(np.argmin(np.where(best, df, np.inf)),
+                                  duty.shape)
+
+    fw = FIRMWARES[firmware]
+    U = int(g['U'][iu])
+    res = {'firmware': firmware, 'N': int(g['N'][iu, ip]), 'U': U,
+           'P': int(g['P'][ip]), 'format': g['formats'][jf],
+           'nchan': int(g['nchan'][ip]), 'freq': float(g['freq'][iu, ip]),
+           'interval': float(g['tcount'][iu, ip]),
+           'dead': float(g['dead'][0, ip, jf]),
+           'tsetup': g['tsetup'], 'twait': g['twait'],
+           'tdown': float(g['tdown'][ip, jf]),
+           'duty': float(duty[iu, ip, jf]), 'warnings': []}
+    if U < LOCKMARGIN*fw['ULOCK']:
+        msg = ('U=0x%X is close to the 0x%X limit where the module stops '
+               'responding (only a reset gets it back)' % (U, fw['ULOCK']))
+        res['warnings'].append(msg)
+        warnings.warn(msg)
+    return res
+
+
+def report(res):
+    """ Text report of a plan. """
+    lines = ['Plan for %s' % res['firmware'],
+             '  N = %d   U = 0x%04X   P = %d   (%d channels, %.3f Hz)' % (
+                 res['N'], res['U'], res['P'], res['nchan'], res['freq']),
+             '  download format: %s' % res['format'],
+             '  counting %.3f s, dead %.4f s (setup %.4f, wait %.4f, '
+             'download %.4f)' % (res['interval'], res['dead'], res['tsetup'],
+                                 res['twait'], res['tdown']),
+             '  duty cycle: %.4f%%' % (100*res['duty'])]
+    for w in res['warnings']:
+        lines.append('  WARNING: ' + w)
+    return '\n'.join(lines)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Prefix-sum index of the intervals of a run.
+
+For each interval boundary k the file keeps the sum of the intervals 0 to
+k-1 (a running sum), together with the start and end times of the
+interval k-1. The file is memory-mapped, so the spectrum summed over any
+window of intervals is the difference of two rows, whatever the length of
+the run, and a time window is located by binary search on the times::
+
+    >>> ix = prefix.Index('run.00.mdz.psum')
+    >>> ix.window(100, 200)          # sum of the intervals 100..199
+    >>> ix.between(3600., 7200.)     # sum of the intervals inside the window
+    >>> ix.locate(5000.)             # interval counting at t = 5000 s
+
+The index is written next to the compressed archive while acquiring (see
+archive.Writer, option prefix) or built afterwards from any archive::
+
+    >>> ix = prefix.build('run.00.mdz')
+
+File (name.psum)::
+
+    header   magic 'MDQP', version, nchan
+    records  (ti, tf, sum[nchan]) float64, float64, int64; the record 0
+             has sum 0 and no times, record k the interval k-1.
+
+Class:
+    prefix.Writer
+    prefix.Index
+
+Func:
+    prefix.build
+"""
+
+import os
+import struct
+
+import numpy as np
+
+_MAGIC = b'MDQP'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHI')          # magic, version, reserved, nchan
+_HEADERSIZE = 16                           # keeps the records aligned
+
+
+def _dtype(nchan):
+    return np.dtype([('ti', '<f8'), ('tf', '<f8'), ('sum', '<i8', (nchan,))])
+
+
+def _readheader(fname):
+    with open(fname, 'rb') as fid:
+        magic, version, res, nchan = _HEADER.unpack(fid.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError('%s is not a prefix-sum index' % fname)
+    return nchan
+
+
+class Writer():
+    """ Appends intervals to a prefix-sum index.
+
+    Args:
+        fname: the index file (an existing one is continued).
+        nchan: number of channels.
+    """
+
+    def __init__(self, fname, nchan):
+        self.fname = fname
+        self.nchan = nchan
+        self.dtype = _dtype(nchan)
+        if os.path.exists(fname) and os.path.getsize(fname) > _HEADERSIZE:
+            if _readheader(fname) != nchan:
+                raise ValueError('%s has not %d channels' % (fname, nchan))
+            # Drop a record cut by a crash and continue from the last one.
+            n = (os.path.getsize(fname) - _HEADERSIZE)//self.dtype.itemsize
+            with open(fname, 'r+b') as fid:
+                fid.truncate(_HEADERSIZE + n*self.dtype.itemsize)
+            last = np.memmap(fname, self.dtype, 'r', _HEADERSIZE)[n - 1]
+            self.sum = last['sum'].astype(np.int64)
+            self.count = n - 1
+            self.fid = open(fname, 'ab')
+        else:
+            self.fid = open(fname, 'wb')
+            self.fid.write(_HEADER.pack(_MAGIC, _VERSION, 0, nchan).ljust(_HEADERSIZE, b'\0'))
+            self.sum = np.zeros(nchan, np.int64)
+            self.count = 0
+            self._record(np.nan, np.nan)
+
+    def _record(self, ti, tf):
+        rec = np.zeros(1, self.dtype)
+        rec['ti'], rec['tf'], rec['sum'] = ti, tf, self.sum
+        self.fid.write(rec.tobytes())
+
+    def truncate(self, n):
+        """ Keep only the first n intervals. """
+        if n > self.count:
+            raise ValueError('The index has only %d intervals' % self.count)
+        self.fid.close()
+        with open(self.fname, 'r+b') as fid:
+            fid.truncate(_HEADERSIZE + (n + 1)*self.dtype.itemsize)
+        last = np.memmap(self.fname, self.dtype, 'r', _HEADERSIZE)[n]
+        self.sum = last['sum'].astype(np.int64)
+        self.count = n
+        self.fid = open(self.fname, 'ab')
+
+    def write(self, counts, ti=0., tf=0.):
+        """ Add an interval. """
+        self.sum += np.asarray(counts, np.int64)
+        self.count += 1
+        self._record(ti, tf)
+
+    def flush(self):
+        self.fid.flush()
+
+    def close(self):
+        self.fid.close()
+
+
+class Index():
+    """ Read access to a prefix-sum index (memory-mapped).
+
+    Args:
+        fname: the index file (name.psum).
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.nchan = _readheader(fname)
+        dtype = _dtype(self.nchan)
+        n = (os.path.getsize(fname) - _HEADERSIZE)//dtype.itemsize
+        self.rec = np.memmap(fname, dtype, 'r', _HEADERSIZE, shape=(n,))
+        self.sums = self.rec['sum']
+        self.ti = self.rec['ti'][1:]
+        self.tf = self.rec['tf'][1:]
+
+    def __len__(self):
+        """ Number of intervals. """
+        return self.rec.shape[0] - 1
+
+    def window(self, k0, k1):
+        """ Sum of the intervals k0 to k1 - 1 (python slice convention). """
+        k0, k1, step = slice(k0, k1).indices(len(self))
+        if k1 <= k0:
+            return np.zeros(self.nchan, np.int64)
+        return self.sums[k1] - self.sums[k0]
+
+    def windows(self, edges):
+        """ Sums of the consecutive windows between the interval indexes
+        "edges" (an increasing sequence), as a 2D array (one per row). """
+        rows = self.sums[np.asarray(edges)]
+        return np.diff(rows, axis=0)
+
+    def span(self, t0, t1):
+        """ Indexes (k0, k1) of the intervals fully inside [t0, t1]. """
+        k0 = int(np.searchsorted(self.ti, t0, side='left'))
+        k1 = int(np.searchsorted(self.tf, t1, side='right'))
+        return k0, max(k0, k1)
+
+    def between(self, t0, t1):
+        """ Sum of the intervals fully inside the time window [t0, t1]. """
+        return self.window(*self.span(t0, t1))
+
+    def locate(self, t):
+        """ Index of the interval counting at time t (or the last one
+        started before t). """
+        return max(int(np.searchsorted(self.ti, t, side='right')) - 1, 0)
+
+    def close(self):
+        del self.rec, self.sums, self.ti, self.tf
+
+
+def build(archivename, fname=None):
+    """ Build (or complete) the prefix-sum index of a compressed archive.
+
+    Args:
+        archivename: the archive (see archive.py).
+        fname: index file (default archivename + '.psum').
+
+    Returns: the Index.
+    """
+    import archive
+    fname = fname or archivename + '.psum'
+    ar = archive.Reader(archivename)
+    wr = Writer(fname, ar.nchan)
+    # Blocks already indexed are skipped; the rest are summed block by block.
+    for b in range(ar.index.size):
+        first, n = int(ar.index['first'][b]), int(ar.index['n'][b])
+        if first + n <= wr.count:
+            continue
+        data, times = ar.block(b)
+        for j in range(max(wr.count - first, 0), n):
+            wr.write(data[j], times[j][0], times[j][1])
+    wr.close()
+    ar.close()
+    return Index(fname)
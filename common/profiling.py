@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Low overhead profiling of acquisition and analysis scripts.
+
+Answers where a slow run spends its time (serial I/O, hex parsing,
+np.savetxt, printing ...) from three sources:
+
+    * spans: wall-clock time (calls, total, max) around each protocol
+      command of the driver, each serial read/write (with the bytes moved)
+      and each stage of the loop (the duty.Ledger stages are forwarded);
+    * a sampling CPU profile: a thread looks at the stack of the profiled
+      thread every "interval" seconds and counts the functions found
+      (self: on top of the stack, total: anywhere in it). Nothing is traced
+      per call, so the cost does not depend on how busy the code is;
+    * optionally, tracemalloc snapshots (start, end and any taken with
+      snapshot()): peak of the traced memory and the lines that grew the
+      most.
+
+The spans cost some microseconds per command and the sampler a fraction
+of a percent of a CPU, low enough to leave on in real measurements.
+tracemalloc is another matter: it makes allocation heavy code (np.savetxt
+of the .counts) some 20 times slower, so it is off unless memory=True::
+
+    >>> prof = profiling.Profiler()
+    >>> profiling.instrument(hw, prof)     # driver commands and serial I/O
+    >>> prof.start()
+    >>> with prof.span('write'):
+    ...     np.savetxt(...)
+    >>> prof.stop()
+    >>> prof.write('run.00.profile')       # or print(prof.report())
+
+Class:
+    profiling.Profiler
+
+Func:
+    profiling.instrument
+"""
+
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class _Span():
+    """ Context manager adding the elapsed time to a span. """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.t)
+        return False
+
+
+class Profiler():
+    """ Spans, sampled CPU profile and memory snapshots of a run.
+
+    Args:
+        interval: seconds between stack samples (None: no sampling).
+        memory: if True trace the allocations with tracemalloc (slow).
+        nframes: frames kept by tracemalloc for each allocation.
+        thread: thread to sample (default: the one creating the
+            profiler).
+    """
+
+    def __init__(self, interval=0.005, memory=False, nframes=1, thread=None):
+        self.interval = interval
+        self.memory = memory
+        self.nframes = nframes
+        self.ident = (thread or threading.current_thread()).ident
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._halt = threading.Event()
+        self.reset()
+
+    def reset(self):
+        """ Forget everything collected. """
+        with self._lock:
+            self.spans = {}                            # name -> [n, total, max, bytes]
+            self.selfcount = collections.Counter()     # samples on top of the stack
+            self.totalcount = collections.Counter()    # samples anywhere in the stack
+            self.samples = 0
+        self.snapshots = []
+        self.peak = 0
+        self.tstart = self.tstop = None
+
+    def span(self, name):
+        """ Context manager timing a span. """
+        return _Span(self, name)
+
+    def add(self, name, dt, nbytes=0):
+        """ Add a call of dt seconds (and nbytes moved) to the span name. """
+        with self._lock:
+            s = self.spans.get(name)
+            if s is None:
+                s = self.spans[name] = [0, 0., 0., 0]
+            s[0] += 1
+            s[1] += dt
+            if dt > s[2]:
+                s[2] = dt
+            s[3] += nbytes
+
+    def start(self):
+        """ Start the sampler and the memory tracing. """
+        self.tstart = time.perf_counter()
+        self.tstop = None
+        if self.memory:
+            self._ownmemory = not tracemalloc.is_tracing()
+            if self._ownmemory:
+                tracemalloc.start(self.nframes)
+            tracemalloc.reset_peak()
+            self.snapshot('start')
+        if self.interval:
+            self._halt.clear()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        """ Stop sampling and tracing (a last snapshot is taken). """
+        if self.tstart is None or self.tstop is not None:
+            return
+        self.tstop = time.perf_counter()
+        if self._sampler is not None:
+            self._halt.set()
+            self._sampler.join()
+            self._sampler = None
+        if self.memory:
+            self.snapshot('end')
+            self.peak = tracemalloc.get_traced_memory()[1]
+            if self._ownmemory:
+                tracemalloc.stop()
+
+    def snapshot(self, label=''):
+        """ Take a tracemalloc snapshot (the allocations of tracemalloc and
+        of this module left out). """
+        if tracemalloc.is_tracing():
+            snap = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__),
+                 tracemalloc.Filter(False, __file__)])
+            self.snapshots.append((label, time.perf_counter(), snap))
+
+    def _sample(self):
+        frames = sys._current_frames
+        while not self._halt.wait(self.interval):
+            frame = frames().get(self.ident)
+            if frame is None:
+                continue
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if top:
+                    leaf = key
+                    top = False
+                seen.add(key)
+                frame = frame.f_back
+            with self._lock:
+                self.samples += 1
+                self.selfcount[leaf] += 1
+                self.totalcount.update(seen)
+
+    def report(self, top=15):
+        """ Text report. """
+        tend = self.tstop if self.tstop is not None else time.perf_counter()
+        wall = tend - self.tstart if self.tstart is not None else 0.
+        lines = ['Profile: %.3f s wall' % wall]
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda kv: -kv[1][1])
+            selfcount = self.selfcount.most_common(top)
+            totalcount = dict(self.totalcount)
+            samples = self.samples
+        if spans:
+            lines.append('  spans (they can nest)          calls    total s   mean ms    max ms  %wall      bytes')
+            for name, (n, tot, mx, nb) in spans:
+                lines.append('    %-28s %7d %10.3f %9.3f %9.3f %6.1f %10s' % (
+                    name, n, tot, 1e3*tot/n, 1e3*mx,
+                    100*tot/wall if wall > 0 else 0., nb if nb else ''))
+        if samples:
+            lines.append('  CPU samples: %d (every %g s); top functions    self%%  total%%' % (
+                samples, self.interval))
+            for key, n in selfcount:
+                lines.append('    %-44s %6.1f %6.1f' % (
+                    _where(key), 100.*n/samples, 100.*totalcount[key]/samples))
+        if len(self.snapshots) > 1:
+            first, last = self.snapshots[0][2], self.snapshots[-1][2]
+            lines.append('  memory: peak %.1f kB traced; growth from %s to %s:' % (
+                self.peak/1024., self.snapshots[0][0], self.snapshots[-1][0]))
+            for st in last.compare_to(first, 'lineno')[:top//3]:
+                fr = st.traceback[0]
+                lines.append('    %-44s %+10.1f kB %+8d blocks' % (
+                    '%s:%d' % (os.path.basename(fr.filename), fr.lineno),
+                    st.size_diff/1024., st.count_diff))
+        return '\n'.join(lines)
+
+    def write(self, fname):
+        """ Write the report on fname. """
+        with open(fname, 'w') as fid:
+            fid.write(self.report() + '\n')
+
+
+def _where(key):
+    fname, line, name = key
+    return '%s (%s:%d)' % (name, os.path.basename(fname), line)
+
+
+class _Serial():
+    """ Serial port proxy timing the I/O calls. """
+
+    def __init__(self, ser, profiler):
+        object.__setattr__(self, '_ser', ser)
+        object.__setattr__(self, '_prof', profiler)
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._ser, name, value)
+
+    def _timed(self, name, func, *args):
+        t = time.perf_counter()
+        out = func(*args)
+        nb = len(out) if isinstance(out, bytes) else (out or 0)
+        self._prof.add('serial:' + name, time.perf_counter() - t,
+                       nb if name != 'inWaiting' else 0)
+        return out
+
+    def read(self, size=1):
+        return self._timed('read', self._ser.read, size)
+
+    def readline(self, *args):
+        return self._timed('readline', self._ser.readline, *args)
+
+    def write(self, data):
+        return self._timed('write', self._ser.write, data)
+
+    def inWaiting(self):
+        return self._timed('inWaiting', self._ser.inWaiting)
+
+
+def instrument(hw, profiler, serial=True):
+    """ Time every command of an Instrument (and its serial I/O).
+
+    The public methods of the driver (and _command_with_echo, the echo
+    protocol of the parameter commands) are wrapped on the instance: each
+    call is a span 'cmd:name'. With serial True the port is wrapped too:
+    spans 'serial:read', 'serial:write' ... with the bytes moved.
+    """
+    for name in dir(type(hw)):
+        if name.startswith('__') or (name.startswith('_') and
+                                     name != '_command_with_echo'):
+            continue
+        attr = getattr(type(hw), name)
+        if not callable(attr) or isinstance(attr, type):
+            continue
+        method = getattr(hw, name)
+        label = 'cmd:' + name.lstrip('_')
+
+        def timed(*args, _method=method, _label=label, **kw):
+            t = time.perf_counter()
+            try:
+                return _method(*args, **kw)
+            finally:
+                profiler.add(_label, time.perf_counter() - t)
+        setattr(hw, name, functools.wraps(method)(timed))
+    if serial and not isinstance(hw.ser, _Serial):
+        hw.ser = _Serial(hw.ser, profiler)
+    return hw
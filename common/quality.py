@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Online quality screen of the downloaded intervals.
+
+Electronic noise bursts or a glitch of the drive can dump garbage into one
+interval. The screen keeps, for every channel, the mean and variance of
+the counts per unit of exposure of the accepted intervals, weighted
+exponentially over the last "memory" ones (so that a slow drift of the
+rate is followed), and tests each new interval against them:
+
+    * chi-square: sum over channels of (x - e)**2/v, where e is the
+      expected counts and v the larger of the Poisson variance (e, plus
+      the uncertainty of the mean) and the variance seen on the previous
+      intervals. Under the hypothesis of a good interval its reduced value
+      is 1 +- sqrt(2/nchan); the interval is rejected when it deviates
+      more than "threshold" of those sigmas;
+    * the largest single channel deviation (|x - e|/sqrt(v) > zmax).
+
+Everything is a handful of vectorized operations on arrays of nchan
+floats: some tens of microseconds per interval.
+
+    >>> scr = quality.Screen(1024)
+    >>> if scr.update(COUNTSnow):          # accepted: statistics updated
+    ...     COUNTS += COUNTSnow
+    ... else:                              # quarantined
+    ...     scr.quarantine('run.00.rejected', COUNTSnow, ti, tf)
+
+The first "warmup" intervals are accepted without test (there is nothing
+to compare them with), except empty ones.
+
+A lasting change of the rate (a step) would otherwise be rejected for the
+rest of the run. After "rebase" consecutive rejections the rejected
+intervals are taken as a new baseline, if the last one passes the test
+against the previous ones (noise bursts are not consistent among
+themselves); it is accepted and the screen goes on from there.
+
+Class:
+    quality.Screen
+"""
+
+import numpy as np
+
+
+class Screen():
+    """ Per-channel weighted statistics and chi-square test of intervals.
+
+    Args:
+        nchan: number of channels.
+        threshold: rejection level of the reduced chi-square, in sigmas.
+        zmax: rejection level of a single channel, in sigmas.
+        warmup: intervals accepted before the test starts.
+        memory: intervals of the exponential weighting (the first ones are
+            weighted equally, as a plain mean).
+        rebase: consecutive rejections that may start a new baseline (0
+            never does).
+    """
+
+    def __init__(self, nchan, threshold=6., zmax=10., warmup=2, memory=50,
+                 rebase=5):
+        self.nchan = nchan
+        self.threshold = threshold
+        self.zmax = zmax
+        self.warmup = warmup
+        self.memory = memory
+        self.rebase = rebase
+        self.n = 0
+        self.mean = np.zeros(nchan)        # counts per unit of exposure
+        self.var = np.zeros(nchan)
+        self.exposure = 0.
+        self.accepted = 0
+        self.rejected = 0
+        self.rebases = 0
+        self._pending = []                 # consecutive rejections (x, exposure)
+        self.last = None                   # (chi2 reduced, sigmas, zmax) of the last test
+        self._e = np.empty(nchan)          # work arrays of test()
+        self._v = np.empty(nchan)
+        self._r = np.empty(nchan)
+
+    def test(self, interval, exposure=1.):
+        """ Test an interval without updating the statistics.
+
+        Args:
+            interval: counters of the interval.
+            exposure: length of the interval (cycles or seconds), in the
+                same unit for all the intervals.
+
+        Returns: True if the interval looks good.
+        """
+        x = np.asarray(interval, float)
+        if self.n < self.warmup:
+            self.last = None
+            return bool(x.any())
+        e, v, r = self._e, self._v, self._r
+        k = min(self.n, self.memory)
+        np.multiply(self.mean, exposure, out=e)
+        # Poisson variance (with the error of the mean) or the observed one.
+        np.multiply(e, 1. + 1./k, out=v)
+        if k > 1:
+            np.maximum(v, self.var*(exposure**2*k/(k - 1)), out=v)
+        np.maximum(v, 1., out=v)
+        np.subtract(x, e, out=r)
+        r *= r
+        r /= v
+        chi2 = r.sum()/self.nchan
+        sig = (chi2 - 1.)/np.sqrt(2./self.nchan)
+        z = np.sqrt(r.max())
+        self.last = (chi2, sig, z)
+        return bool(sig <= self.threshold and z <= self.zmax)
+
+    def update(self, interval, exposure=1.):
+        """ Test an interval and, if it is accepted, add it to the
+        statistics.
+
+        Returns: True if accepted.
+        """
+        if self.test(interval, exposure):
+            self._pending = []
+            self._add(interval, exposure)
+            self.accepted += 1
+            return True
+        if self.rebase and np.any(interval):
+            self._pending.append((np.array(interval, float), exposure))
+            if len(self._pending) >= self.rebase and self._rebaseline():
+                self.accepted += 1
+                return True
+        self.rejected += 1
+        return False
+
+    def _add(self, interval, exposure):
+        """ Add an interval to the statistics. """
+        rate = np.asarray(interval, float)/exposure
+        self.n += 1
+        a = 1./min(self.n, self.memory)
+        d = self._e
+        np.subtract(rate, self.mean, out=d)
+        self.mean += a*d
+        d *= d
+        d *= a
+        self.var += d
+        self.var *= 1. - a
+        self.exposure += exposure
+
+    def _rebaseline(self):
+        """ New statistics from the pending rejected intervals, if the
+        last one passes against the others.
+
+        Returns: True if the baseline was changed.
+        """
+        old = (self.n, self.mean.copy(), self.var.copy(), self.exposure,
+               self.last)
+        self.n = 0
+        self.mean[:] = 0.
+        self.var[:] = 0.
+        for x, exposure in self._pending[:-1]:
+            self._add(x, exposure)
+        x, exposure = self._pending[-1]
+        if self.test(x, exposure):
+            self._add(x, exposure)
+            # The other pending intervals stay rejected.
+            self.exposure = old[3] + exposure
+            self.rebases += 1
+            self._pending = []
+            return True
+        self.n, self.mean, self.var, self.exposure, self.last = old
+        self._pending.pop(0)
+        return False
+
+    def quarantine(self, fname, interval, ti=0., tf=0.):
+        """ Append the rejected interval to the side file fname, in the
+        spectrum107 format plus the test result as a comment. """
+        chi2, sig, z = self.last if self.last is not None else (0., 0., 0.)
+        with open(fname, 'a') as fid:
+            fid.write('# chi2/n %.3f (%.1f sigma), max channel %.1f sigma\n'
+                      % (chi2, sig, z))
+            fid.write('%.2f %.2f %.2f:' % (ti, tf, tf - ti) +
+                      ' '.join('%x' % k for k in np.asarray(interval, int)) + '\n')
+
+    def report(self):
+        """ One line summary. """
+        text = 'Quality screen: %d intervals accepted, %d rejected' % (
+            self.accepted, self.rejected)
+        if self.rebases:
+            text += ', %d new baselines' % self.rebases
+        return text
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Rate meter and fault detection while the module counts.
+
+A dead detector, a disconnected amplifier or a stalled drive are otherwise
+seen at the next download, after the whole interval is lost. The monitor
+asks the sum of counts in the gate (m, 10 bytes; mdaq209) and the cycle
+counter (M, 10 bytes) every "period" seconds, builds the count rate series
+and tests it online:
+
+    zero    the gate sum does not grow for "zero" seconds while the cycles
+            go on (detector, high voltage, amplifier);
+    drop    the counts of the last "window" seconds are below "drop" times
+            those expected from the rate of the run so far, by more than
+            "nsigma" Poisson sigmas;
+    stall   the cycle counter does not advance for "stall" seconds (or 3
+            cycle periods, the longer) before reaching N (drive, clock).
+
+Without m (mdaq107) only the stall test is done. On a fault the counting
+is stopped (action 'stop') or the fault is only recorded ('flag').
+
+Inline, sampling while the acquisition loop sleeps until the predicted end
+of the counting (see schedule.Completion.wait)::
+
+    >>> mon = ratemeter.Monitor(period=1.)
+    >>> sched.wait(hw, monitor=mon)      # raises ratemeter.Fault on a fault
+
+or on a thread, sharing the port through safe.Instrument::
+
+    >>> shw = safe.Instrument(hw)
+    >>> mon = ratemeter.Monitor(period=1., action='flag').start(shw, N)
+    >>> ...
+    >>> mon.close(); mon.faults
+
+The gate for the best sensitivity of m to the absorption is suggested from
+a spectrum (for example the .counts of a previous run)::
+
+    >>> G, g = ratemeter.suggestgate(counts, P=1, firmware='MDAQ209')
+    >>> hw.setGate(G, g)
+
+Class:
+    ratemeter.Meter
+    ratemeter.Monitor
+    ratemeter.Fault
+
+Func:
+    ratemeter.suggestgate
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from mdaqcore import PROFILES, nchannels
+
+
+class Fault(Exception):
+    """ Fault detected while counting. kind: 'zero', 'drop' or 'stall'. """
+
+    def __init__(self, kind, message):
+        Exception.__init__(self, message)
+        self.kind = kind
+
+
+class Meter():
+    """ Count rate series and online tests (no I/O: see Monitor).
+
+    Args:
+        zero: seconds without counts in the gate to report 'zero'.
+        drop: fraction of the expected counts below which a window is a
+            drop.
+        nsigma: Poisson significance needed for a drop.
+        window: seconds of the window tested for a drop.
+        stall: seconds without a new cycle to report 'stall'.
+        warmup: seconds of rate needed before the drop test starts.
+    """
+
+    def __init__(self, zero=5., drop=0.5, nsigma=5., window=5., stall=5.,
+                 warmup=10.):
+        self.zero = zero
+        self.drop = drop
+        self.nsigma = nsigma
+        self.window = window
+        self.stall = stall
+        self.warmup = warmup
+        self.series = []           # (t, gate rate (1/s) or None, cycles/s)
+        self.counts = 0.           # gate counts and seconds of the run, for
+        self.seconds = 0.          # the reference rate
+        self.last = None
+        self._recent = collections.deque()
+        self._cycleperiod = 0.
+
+    def _segment(self, t, M, S):
+        """ New counting (first sample, or M and the sum were cleared). """
+        self.last = (t, M, S)
+        self.tM = self.tS = t
+        self._recent.clear()
+
+    def update(self, t, M, S=None, N=None):
+        """ Add a sample.
+
+        Args:
+            t: time of the sample (s).
+            M: cycle counter.
+            S: gate sum (None if the firmware has no m).
+            N: cycles of the counting (M == N is the end, not a stall).
+
+        Returns: None, or (kind, message) of a fault.
+        """
+        if self.last is None or M < self.last[1] or \
+                (S is not None and self.last[2] is not None and S < self.last[2]):
+            self._segment(t, M, S)
+            return None
+        t0, M0, S0 = self.last
+        dt = t - t0
+        if dt <= 0:
+            return None
+        self.last = (t, M, S)
+        done = N is not None and N > 0 and M >= N
+        if M > M0:
+            self._cycleperiod = dt/(M - M0)
+            self.tM = t
+        rate = None
+        if S is not None and S0 is not None and not done:
+            dS = S - S0
+            rate = dS/dt
+            if dS > 0:
+                self.tS = t
+            self._recent.append((t, dt, dS))
+            while self._recent and self._recent[0][0] - self._recent[0][1] < t - self.window:
+                self._recent.popleft()
+        self.series.append((t, rate, (M - M0)/dt))
+        if done:
+            return None
+        stall = max(self.stall, 3*self._cycleperiod)
+        if t - self.tM > stall:
+            return ('stall', 'Cycle counter stopped at %d for %.1f s' % (M, t - self.tM))
+        if rate is None:
+            return None
+        if t - self.tS > self.zero and M > M0:
+            return ('zero', 'No counts in the gate for %.1f s (%d cycles)' % (
+                    t - self.tS, M - M0))
+        fault = None
+        if self.seconds >= self.warmup and self.counts > 0:
+            secs = sum(r[1] for r in self._recent)
+            n = sum(r[2] for r in self._recent)
+            e = self.counts/self.seconds*secs
+            if secs >= 0.5*self.window and n < self.drop*e and \
+                    e - n > self.nsigma*np.sqrt(e):
+                fault = ('drop', 'Gate rate %.1f/s, expected %.1f/s' % (
+                         n/secs, e/secs))
+        if fault is None:
+            # Faulty stretches do not enter the reference rate.
+            self.counts += S - S0
+            self.seconds += dt
+        return fault
+
+    def rate(self):
+        """ Reference gate rate of the run (counts/s, None before any). """
+        return self.counts/self.seconds if self.seconds else None
+
+
+def _result(value):
+    # Calls through safe.Instrument return Futures.
+    return value.result() if isinstance(value, Future) else value
+
+
+class Monitor():
+    """ Samples m and M while the module counts and feeds a Meter.
+
+    Args:
+        meter: the Meter (default Meter()).
+        period: seconds between samples.
+        action: 'stop' (STOP the counting and raise Fault) or 'flag'
+            (only record the fault).
+    """
+
+    def __init__(self, meter=None, period=1., action='stop'):
+        self.meter = meter if meter is not None else Meter()
+        self.period = period
+        self.action = action
+        self.faults = []           # (t, kind, message), once per episode
+        self.queries = 0
+        self._thread = None
+        self._halt = threading.Event()
+        self._active = None        # kind of the fault going on
+
+    def sample(self, hw, N=None):
+        """ One sample (M, and m when the firmware has it).
+
+        Returns: None, or (kind, message) of a fault.
+        """
+        t = time.time()
+        M = _result(hw.getCycleNumber())
+        S = None
+        if 'm' in PROFILES[hw.firmware]['COMMANDS']:
+            S = _result(hw.getSumInGate())
+        self.queries += 1
+        fault = self.meter.update(t, M, S, N)
+        if fault is not None and fault[0] != self._active:
+            self.faults.append((t,) + fault)
+            print('FAULT (%s): %s' % fault)
+            if self.action == 'stop':
+                _result(hw.stop())
+        self._active = fault[0] if fault is not None else None
+        return fault
+
+    def sleep(self, hw, dt, N=None):
+        """ Sleep dt seconds sampling every period.
+
+        Raises: Fault if action is 'stop' and a fault was found (the
+            counting was stopped).
+        """
+        tend = time.time() + dt
+        while tend - time.time() > self.period:
+            time.sleep(self.period)
+            fault = self.sample(hw, N)
+            if fault is not None and self.action == 'stop':
+                raise Fault(*fault)
+        time.sleep(max(tend - time.time(), 0))
+
+    def start(self, hw, N=None):
+        """ Sample on a thread until close(). hw must be shared with the
+        acquisition through safe.Instrument. """
+        self._halt.clear()
+        self._thread = threading.Thread(target=self._run, args=(hw, N),
+                                        name='mdaq-ratemeter', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self, hw, N):
+        while not self._halt.wait(self.period):
+            if self.sample(hw, N) is not None and self.action == 'stop':
+                break
+
+    def close(self):
+        """ Stop the sampling thread. """
+        if self._thread is not None:
+            self._halt.set()
+            self._thread.join()
+            self._thread = None
+
+    def report(self):
+        """ Text summary. """
+        rate = self.meter.rate()
+        text = 'Rate meter: %d samples' % self.queries
+        if rate is not None:
+            text += ', gate rate %.1f counts/s' % rate
+        for t, kind, message in self.faults:
+            text += '\n  %s %s: %s' % (time.strftime('%H:%M:%S', time.localtime(t)),
+                                       kind, message)
+        return text
+
+
+def suggestgate(counts, P=1, firmware='MDAQ209', smooth=5):
+    """ Gate G, g covering the main absorption region.
+
+    The gate sum is most sensitive to the absorption when the deficit D
+    of the counts in the gate (below the baseline) is largest against the
+    Poisson noise of the sum, sqrt(B): the contiguous window around the
+    deepest point of the spectrum maximizing D/sqrt(B) is chosen (all the
+    windows at once, from cumulative sums).
+
+    Args:
+        counts: spectrum (1D, or 2D with one interval per row) acquired
+            with step P.
+        P: step of the acquisition (the gate is in samples, channels at
+            P=1).
+        firmware: key of mdaqcore.PROFILES.
+        smooth: channels of the moving average used to find the baseline
+            and the deepest point.
+
+    Returns: (G, g), start and stop of the gate, within the limits of the
+        firmware.
+    """
+    y = np.asarray(counts, float)
+    if y.ndim == 2:
+        y = y.sum(axis=0)
+    n = len(y)
+    h = smooth//2
+    ys = np.convolve(np.concatenate((y[n - h:], y, y[:h])),
+                     np.ones(smooth)/smooth, 'valid')[:n] if smooth > 1 else y
+    base = np.percentile(ys, 90)
+    k = int(np.argmax(base - ys))
+    D = np.concatenate(([0.], np.cumsum(base - y)))
+    B = np.concatenate(([0.], np.cumsum(y)))
+    a = np.arange(k + 1)[:, None]
+    b = np.arange(k + 1, n + 1)[None, :]
+    snr = (D[b] - D[a])/np.sqrt(np.maximum(B[b] - B[a], 1.))
+    i, j = np.unravel_index(np.argmax(snr), snr.shape)
+    C = PROFILES[firmware]['CANALES']
+    if PROFILES[firmware]['STEP'] and n != nchannels(firmware, P):
+        raise ValueError('%d channels, %s at P=%d gives %d' % (
+                         n, firmware, P, nchannels(firmware, P)))
+    G = int(i)*P
+    g = min(int(k + 1 + j)*P, C) - 1
+    gmax = PROFILES[firmware]['LIMITS']['g'][1]
+    return min(G, gmax), min(g, gmax)
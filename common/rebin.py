@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Rebinning and merging of spectra taken with different steps P.
+
+With step P channel i of the module integrates the samples (channels at
+P=1) i*P ... i*P+P-1; when P does not divide the number of samples C of the
+firmware the last channel gets the C % P remaining ones. So a run at P=3 on
+mdaq209 has 683 channels, the last one 2 samples wide, and it can not be
+summed with a run at P=2 (1024 channels) as it is.
+
+Here every channel is an interval of samples. The counts of a channel are
+spread uniformly over its samples and integrated over the bins of the new
+grid (through the cumulative counts, evaluated at the new edges): the total
+is conserved exactly, also for the remainder channel::
+
+    >>> y = rebin.rebin(counts3, P=3, step=2)          # 683 -> 1024 channels
+
+or onto a velocity grid, with the velocity of each sample (velocity.axis
+at P=1; a run at another K or calibration has another axis)::
+
+    >>> v = velocity.axis(wave, K, P=1, calib=(c1,c0))
+    >>> y, exposure = rebin.tovelocity(counts3, 3, v, np.linspace(-8,8,401))
+
+Runs with mixed P are merged in one pass: rebinning is linear, so the runs
+are summed for each P (and velocity axis) first, and each sum is rebinned
+once::
+
+    >>> y, exposure = rebin.merge([c1, c2, c3], steps=[1, 2, 3])
+
+exposure is the number of sample-cycles behind each bin (cycles given per
+run): bins of a velocity grid see different numbers of samples, and runs
+different numbers of cycles, so compare y/exposure.
+
+Counters are 1D (a spectrum) or 2D (one interval per row).
+
+Func:
+    rebin.edges
+    rebin.rebin
+    rebin.tovelocity
+    rebin.merge
+"""
+
+import numpy as np
+
+from mdaqcore import PROFILES, nchannels
+
+
+def _samples(firmware):
+    return PROFILES[firmware]['CANALES']
+
+
+def edges(P, firmware='MDAQ209'):
+    """ Sample edges of the channels acquired with step P.
+
+    Returns: integer array of nchannels(firmware,P)+1 edges, from 0 to the
+        number of samples C (the last channel is C % P wide when P does
+        not divide C).
+    """
+    C = _samples(firmware)
+    n = nchannels(firmware, P)
+    return np.minimum(np.arange(n + 1)*P, C)
+
+
+def _cumulative(counts, e, x):
+    """ Cumulative counts at the sample positions x (counts uniform inside
+    each channel of edges e). """
+    F = np.zeros(counts.shape[:-1] + (counts.shape[-1] + 1,))
+    np.cumsum(counts, axis=-1, out=F[..., 1:])
+    k = np.clip(np.searchsorted(e, x, side='right') - 1, 0, len(e) - 2)
+    frac = (x - e[k])/np.diff(e)[k].astype(float)
+    return F[..., k] + counts[..., k]*frac
+
+
+def _check(counts, P, firmware):
+    counts = np.asarray(counts, float)
+    n = nchannels(firmware, P)
+    if counts.shape[-1] != n:
+        raise ValueError('%d channels, %s at P=%d gives %d' % (
+                         counts.shape[-1], firmware, P, n))
+    return counts
+
+
+def rebin(counts, P, step=1, firmware='MDAQ209'):
+    """ Counters acquired with step P on the channels of another step.
+
+    Args:
+        counts: counters (1D, or 2D with one interval per row) acquired
+            with step P, remainder channel included.
+        P: step of the acquisition.
+        step: step of the new channels. A finer grid than P spreads the
+            counts of a channel uniformly over its samples.
+        firmware: key of mdaqcore.PROFILES (number of samples).
+
+    Returns: float array with nchannels(firmware,step) channels (last
+        axis), the same total counts.
+    """
+    counts = _check(counts, P, firmware)
+    if step == P:
+        return counts
+    return np.diff(_cumulative(counts, edges(P, firmware),
+                               edges(step, firmware)), axis=-1)
+
+
+def tovelocity(counts, P, v, vedges, firmware='MDAQ209'):
+    """ Counters acquired with step P on a velocity grid.
+
+    Each sample goes whole to the velocity bin of its velocity; samples
+    outside the grid are left out.
+
+    Args:
+        counts: counters (1D or 2D) acquired with step P.
+        P: step of the acquisition.
+        v: velocity of each sample (velocity.axis with P=1).
+        vedges: increasing edges of the velocity bins.
+        firmware: key of mdaqcore.PROFILES.
+
+    Returns: (y, exposure): counts and number of samples of each bin.
+    """
+    v = np.asarray(v, float)
+    if v.size != _samples(firmware):
+        raise ValueError('%d velocities, %s has %d samples' % (
+                         v.size, firmware, _samples(firmware)))
+    y = rebin(counts, P, 1, firmware)
+    nb = len(vedges) - 1
+    k = np.searchsorted(vedges, v, side='right') - 1
+    k[v == vedges[-1]] = nb - 1                # last edge closes the grid
+    inside = (k >= 0) & (k < nb)
+    k, y = k[inside], y[..., inside]
+    exposure = np.bincount(k, minlength=nb).astype(float)
+    if y.ndim == 1:
+        return np.bincount(k, y, nb), exposure
+    rows = y.reshape(-1, y.shape[-1])
+    idx = (np.arange(len(rows))[:, None]*nb + k).ravel()
+    out = np.bincount(idx, rows.ravel(), len(rows)*nb)
+    return out.reshape(y.shape[:-1] + (nb,)), exposure
+
+
+def merge(spectra, steps, step=None, cycles=None, v=None, vedges=None,
+          firmware='MDAQ209'):
+    """ Sum of runs with mixed steps on a common grid.
+
+    Args:
+        spectra: sequence of counters (1D), one per run.
+        steps: step P of each run.
+        step: step of the common channel grid (default the largest P of
+            the runs: no run is spread over channels finer than its own).
+        cycles: cycles counted by each run, for the exposure (default 1).
+        v: velocity of the samples (velocity.axis with P=1) for a velocity
+            grid: one array for all the runs, or one per run (runs sharing
+            the same array object are grouped).
+        vedges: edges of the velocity bins; if given the common grid is
+            velocity instead of channels.
+        firmware: key of mdaqcore.PROFILES.
+
+    Returns: (y, exposure): summed counts and sample-cycles of each bin.
+    """
+    if len(spectra) != len(steps):
+        raise ValueError('%d spectra and %d steps' % (len(spectra), len(steps)))
+    if cycles is None:
+        cycles = [1]*len(spectra)
+    if vedges is not None:
+        if v is None:
+            raise ValueError('A velocity grid needs the velocities v')
+        if np.ndim(v[0]) == 0:
+            v = [v]*len(spectra)
+    groups = {}
+    for k, (counts, P) in enumerate(zip(spectra, steps)):
+        key = (P, id(v[k])) if vedges is not None else P
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = [_check(counts, P, firmware).copy(), 0,
+                               v[k] if vedges is not None else None]
+        else:
+            g[0] += _check(counts, P, firmware)
+        g[1] += cycles[k]
+    if vedges is not None:
+        y = np.zeros(len(vedges) - 1)
+        exposure = np.zeros(len(vedges) - 1)
+        for (P, _), (counts, ncycles, vk) in groups.items():
+            yk, ek = tovelocity(counts, P, vk, vedges, firmware)
+            y += yk
+            exposure += ncycles*ek
+        return y, exposure
+    if step is None:
+        step = max(steps)
+    width = np.diff(edges(step, firmware)).astype(float)
+    y = np.zeros(len(width))
+    for P, (counts, _, _) in groups.items():
+        y += rebin(counts, P, step, firmware)
+    return y, sum(cycles)*width
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Persistent state of a run, to resume it after a crash or a reboot.
+
+The acquisition loop commits, after every interval is safely written, a
+small JSON file (name.state) with the fingerprint of the module
+configuration, the number of intervals, the accumulated counters, the time
+origin of the run and the size of the intervals file. The file is replaced
+atomically, so after a crash it holds the last committed interval.
+
+On restart the script reattaches to the module (no reset, no wave upload),
+compares the fingerprint of the actual configuration with the stored one
+and carries on the same run: same files, same totals, same time origin::
+
+    >>> st = runstate.load('run.00.state')
+    >>> if st is not None and not st.finished and \\
+    ...         st.fingerprint == runstate.fingerprint(wave, K, U):
+    ...     COUNTS = st.totals             # continue from st.intervals
+    >>> ...
+    >>> fid.write(line); fid.flush(); os.fsync(fid.fileno())
+    >>> st.commit(i, COUNTS, ti, tf, fid.tell())   # size of what is on disk
+    >>> st.finish()                        # reached the stop criterion
+
+Class:
+    runstate.State
+
+Func:
+    runstate.fingerprint
+    runstate.load
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+def fingerprint(*parts):
+    """ Hash of the configuration of the module.
+
+    Args:
+        parts: the wave string and the parameters that define the
+            measurement (for example K, Q, O and U of mdaq107). The wave
+            terminator and letter case are ignored.
+
+    Returns: hexadecimal string.
+    """
+    h = hashlib.sha1()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.strip().upper()
+        h.update(str(p).encode('ascii'))
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def load(fname):
+    """ The State stored on fname, or None if there is no state file. """
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as fid:
+        data = json.load(fid)
+    st = State(fname, data['fingerprint'], data['N'], data['t0'])
+    st.intervals = data['intervals']
+    st.totals = np.array(data['totals'], np.int64)
+    st.ti, st.tf = data['ti'], data['tf']
+    st.size = data['size']
+    st.finished = data['finished']
+    st.resumes = data.get('resumes', 0)
+    return st
+
+
+class State():
+    """ Run state, written to fname on each commit.
+
+    Args:
+        fname: the state file (name.state).
+        fingerprint: see :func:`fingerprint`.
+        N: cycles per interval.
+        t0: time origin of the run (time.time() at the start).
+    """
+
+    def __init__(self, fname, fingerprint, N, t0=None):
+        self.fname = fname
+        self.fingerprint = fingerprint
+        self.N = N
+        self.t0 = time.time() if t0 is None else t0
+        self.intervals = 0
+        self.totals = None
+        self.ti = self.tf = None
+        self.size = 0
+        self.finished = False
+        self.resumes = 0
+
+    def __repr__(self):
+        return 'Run state %s: %d intervals%s' % (
+            self.fname, self.intervals, ' (finished)' if self.finished else '')
+
+    def commit(self, intervals, totals, ti, tf, size):
+        """ Store the state after the interval number "intervals".
+
+        Args:
+            intervals: number of intervals written.
+            totals: accumulated counters.
+            ti, tf: times of the last interval (from t0).
+            size: bytes of the intervals file after the last interval.
+        """
+        self.intervals = intervals
+        self.totals = np.asarray(totals).astype(np.int64)
+        self.ti, self.tf = ti, tf
+        self.size = size
+        self._save()
+
+    def finish(self):
+        """ Mark the run as finished: it is not resumed any more. """
+        self.finished = True
+        self._save()
+
+    def _save(self):
+        data = {'fingerprint': self.fingerprint, 'N': self.N, 't0': self.t0,
+                'intervals': self.intervals,
+                'totals': [] if self.totals is None else self.totals.tolist(),
+                'ti': self.ti, 'tf': self.tf, 'size': self.size,
+                'finished': self.finished, 'resumes': self.resumes}
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(data, fid)
+            fid.flush()
+            os.fsync(fid.fileno())
+        os.replace(tmp, self.fname)
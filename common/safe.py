@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Thread-safe access to an Instrument.
+
+The drivers (mdaq107 and mdaq209 mdaq.Instrument) write and read the
+serial port without any locking: two threads using the same Instrument
+interleave bytes and corrupt both replies. safe.Instrument wraps an
+Instrument so that several threads can share it. A single worker thread
+owns the serial port and runs one protocol transaction (one driver method)
+at a time, taking them from a priority queue. Every call returns a
+concurrent.futures.Future::
+
+    >>> hw = mdaq.Instrument('/dev/ttyUSB0')
+    >>> shw = safe.Instrument(hw)
+    >>> f = shw.getCycleNumber()          # from a monitoring thread
+    >>> f.result()
+    >>> shw.getBinCounters(4).result()    # from the acquisition thread
+    >>> shw.close()                       # stops the worker (not the port)
+
+Downloads, START/STOP and RESET go before the setters, and these before
+the status polling (see PRIORITY), so a monitor polling M does not delay
+the acquisition: it waits at most for the transaction in progress.
+Requests of the same priority keep their order.
+
+A sequence of commands that must not be interleaved with other threads
+(e.g. Z, N and START of an interval) is run inside :meth:`exclusive`,
+which holds the worker while the caller uses the wrapped Instrument
+directly::
+
+    >>> with shw.exclusive(HIGH):
+    ...     hw.clear(); hw.setCycleNumber(N); hw.start()
+
+Note: on mdaq209 the RK notice sent when N cycles are counted arrives
+without a request; wait for it (waitRK) before sharing the port with a
+status poller, or use N = 0.
+
+Class:
+    safe.Instrument
+"""
+
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+HIGH, NORMAL, LOW = 0, 1, 2
+
+# Priority of the driver methods. Any other method is NORMAL.
+PRIORITY = {'getCounters': HIGH, 'getBinCounters': HIGH, 'start': HIGH,
+            'stop': HIGH, 'reset': HIGH, 'waitRK': HIGH, 'clear': HIGH,
+            'getCycleNumber': LOW, 'getStatus': LOW, 'getSumInGate': LOW}
+
+
+class Instrument():
+    """ Serializes the calls to an Instrument on a worker thread.
+
+    Args:
+        hw: the Instrument (mdaq107 or mdaq209 driver) to share.
+
+    Methods of hw are called through this object and return Futures; other
+    attributes (HWPARS, firmware...) are read from hw.
+    """
+
+    def __init__(self, hw):
+        self.hw = hw
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='mdaq-worker',
+                                        daemon=True)
+        self._worker.start()
+
+    def __repr__(self):
+        return 'Thread-safe access to:\n' + repr(self.hw)
+
+    def __getattr__(self, name):
+        attr = getattr(self.hw, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            return self.submit(name, *args, **kwargs)
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    def submit(self, name, *args, **kwargs):
+        """ Queue the call hw.name(*args, **kwargs).
+
+        The keyword "priority" (HIGH, NORMAL or LOW) overrides PRIORITY.
+
+        Returns: a Future with the result of the call (or its exception).
+        """
+        priority = kwargs.pop('priority', None)
+        if priority is None:
+            priority = PRIORITY.get(name, NORMAL)
+        return self._put(priority, getattr(self.hw, name), args, kwargs)
+
+    def _put(self, priority, func, args, kwargs):
+        if self._closed:
+            raise RuntimeError('safe.Instrument is closed')
+        fut = Future()
+        self._queue.put((priority, next(self._seq), func, args, kwargs, fut))
+        return fut
+
+    def _run(self):
+        while True:
+            priority, seq, func, args, kwargs, fut = self._queue.get()
+            if func is None:
+                break
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+
+    def exclusive(self, priority=NORMAL):
+        """ Context manager giving the caller thread the port for a sequence
+        of commands. It waits until the queued requests with a better (or
+        the same, earlier) priority are done. """
+        return _Exclusive(self, priority)
+
+    def close(self, wait=True):
+        """ Stop the worker after the queued requests. The serial port is
+        left open (see hw.close). """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((LOW + 1, next(self._seq), None, (), {}, None))
+        if wait:
+            self._worker.join()
+
+
+class _Exclusive():
+    """ Holds the worker thread while the caller runs its commands. """
+
+    def __init__(self, shared, priority):
+        self.shared = shared
+        self.priority = priority
+        self.granted = threading.Event()
+        self.released = threading.Event()
+
+    def _hold(self):
+        self.granted.set()
+        self.released.wait()
+
+    def __enter__(self):
+        self.fut = self.shared._put(self.priority, self._hold, (), {})
+        self.granted.wait()
+        return self.shared.hw
+
+    def __exit__(self, *exc):
+        self.released.set()
+        self.fut.result()
+        return False
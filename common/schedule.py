@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Predictive wait for the end of a counting.
+
+Instead of asking the cycle number (M) every 10 ms while the module counts,
+the end of the counting is predicted from N and the frequency, corrected
+by the drift measured on the previous intervals. The scheduler sleeps until
+just before that time and confirms with one M query (or, on mdaq209, with
+the RK notice sent by the module when it reaches N). Only when the
+prediction was early it goes back to polling, for a few polls at most.
+
+    >>> sched = schedule.Completion(mdaq.frequency(U))   # mdaq107
+    >>> hw.start()
+    >>> sched.start(N)
+    >>> ...                                  # process the previous interval
+    >>> sched.wait(hw)                       # returns when M == N
+    >>> sched.queries                        # M queries of the whole run
+
+Class:
+    schedule.Completion
+"""
+
+import time
+
+
+class Completion():
+    """ Predicts and waits for the end of the counting of N cycles.
+
+    Args:
+        freq: nominal frequency of the module (Hz), see mdaq.frequency.
+        guard: seconds before the predicted end to wake up.
+        poll: poll period when the counting was not finished yet.
+        alpha: weight of the last measurement in the drift estimation.
+    """
+
+    def __init__(self, freq, guard=0.02, poll=0.01, alpha=0.3):
+        self.freq = freq
+        self.guard = guard
+        self.poll = poll
+        self.alpha = alpha
+        self.drift = 1.          # actual duration / nominal duration
+        self.queries = 0
+        self.missed = 0          # RK notices not seen by the deadline
+        self.N = None
+        self.t0 = None
+        self.tend = None
+        self.tconfirm = None
+
+    def start(self, N, t0=None):
+        """ Register the START of a counting of N cycles (at time t0). """
+        self.N = N
+        self.t0 = time.time() if t0 is None else t0
+        self.tend = self.t0 + self.drift*N/self.freq
+
+    def remaining(self):
+        """ Predicted seconds to the end of the counting. """
+        return self.tend - time.time()
+
+    def end(self):
+        """ Best estimate of the time when the counting really ended.
+
+        The module counts exactly N cycles, so the end is the start plus
+        the duration given by the (drift corrected) frequency, but never
+        after it was confirmed by wait().
+        """
+        t = self.t0 + self.drift*self.N/self.freq
+        if self.tconfirm is not None:
+            t = min(t, self.tconfirm)
+        return t
+
+    def _measure(self, M, t):
+        """ Update the drift with M cycles counted at time t. """
+        if M <= 0 or t <= self.t0:
+            return
+        d = (t - self.t0)*self.freq/M
+        # A measurement with few cycles is dominated by the START latency.
+        if M >= 0.5*self.N:
+            self.drift = (1 - self.alpha)*self.drift + self.alpha*d
+
+    def wait(self, hw, rk=False, monitor=None, timeout=None):
+        """ Sleep until the counting ends.
+
+        Args:
+            hw: the Instrument.
+            rk: if True wait for the RK notice (mdaq209 with N != 0)
+                instead of querying M. Only the local input buffer is
+                watched, nothing is sent to the module.
+            monitor: None or a ratemeter.Monitor, sampling the rate during
+                the sleep (it raises ratemeter.Fault on a fault). Not with
+                rk: its M queries could meet the RK notice.
+            timeout: with rk, seconds after the predicted end to wait for
+                RK (default 10% of the counting, at least 10 guards). Then
+                the notice is taken as lost and the end is confirmed with
+                M queries.
+
+        Returns: the time when the end was confirmed.
+        """
+        if rk and monitor is not None:
+            raise ValueError('The monitor queries M: it can not wait for RK')
+        self.tconfirm = None
+        dt = self.tend - self.guard - time.time()
+        if dt > 0:
+            if monitor is not None:
+                monitor.sleep(hw, dt, self.N)
+            else:
+                time.sleep(dt)
+        if rk:
+            if timeout is None:
+                timeout = max(0.1*(self.tend - self.t0), 10*self.guard)
+            deadline = self.tend + timeout
+            while hw.ser.inWaiting() < 4 and time.time() < deadline:
+                time.sleep(0.001)
+            if hw.ser.inWaiting() >= 4:
+                t = time.time()
+                hw.waitRK()
+                # The end happened before t: do not let the drift grow with
+                # the time spent on other tasks before calling wait().
+                if t - self.tend < self.poll:
+                    self._measure(self.N, t)
+                self.tconfirm = t
+                return t
+            # No RK: drop what arrived of it and confirm with M.
+            self.missed += 1
+            hw.drain()
+        while True:
+            M = hw.getCycleNumber()
+            t = time.time()
+            self.queries += 1
+            if M >= self.N:
+                if t - self.tend < self.poll:
+                    self._measure(M, t)
+                self.tconfirm = t
+                return t
+            self._measure(M, t)
+            left = (self.N - M)/self.freq*self.drift
+            time.sleep(max(left - 0.5*self.guard, self.poll))
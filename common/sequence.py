@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Sequences of acquisitions from a recipe file.
+
+A recipe lists acquisitions to run back to back on one open Instrument
+(overnight or weekend series of samples or settings). Each line is a step:
+the output name followed by the parameters that change; a step keeps the
+settings of the previous one, so only the differences are written::
+
+    # name        settings
+    defaults      wave=macveiga1.wave K=0x400 U=0x1000 T=120
+    hematite      counts=2e5
+    hematite_hk   K=0x600 dip=0.01
+    foil          U=0x800 intervals=30
+
+Settings:
+    wave          file with the wave (hexadecimal string, as macveiga1.wave)
+    K, U, P, O, Q module parameters (P only on mdaq209; O and Q only on
+                  mdaq107)
+    gate          G,g (start and stop channels of the gate)
+    N or T        cycles per interval, or seconds per interval
+    counts, dip, intervals   stop criteria (see stop.py), any of them
+
+Between steps the :class:`Configurator` sends only the parameters whose
+value on the module differs from the wanted one (the wave is compared by
+fingerprint and uploaded only when it changes). The progress of the
+sequence is kept on a small JSON file, replaced atomically, so an
+interrupted sequence continues from the step it was running::
+
+    >>> steps = sequence.load('weekend.recipe')
+    >>> conf = sequence.Configurator(hw)
+    >>> prog = sequence.Progress('weekend.recipe.progress', steps)
+    >>> for k in range(prog.step, len(steps)):
+    ...     changed = conf.apply(steps[k])    # e.g. ['K', 'N']
+    ...     prog.start(k, filename)
+    ...     ...                               # acquisition
+    ...     prog.done(k)
+
+See mdaq107/scripts/sequence107.py.
+
+Class:
+    sequence.Configurator
+    sequence.Progress
+
+Func:
+    sequence.load
+    sequence.criterion
+"""
+
+import json
+import os
+
+import runstate
+import stop
+from mdaqcore import PROFILES
+
+# Parameters in the order they are sent, and the Instrument method for each.
+SETTERS = (('wave', 'setWave'), ('P', 'setStep'), ('U', 'setTimeBase'),
+           ('K', 'setAmplitude'), ('O', 'setOffset'),
+           ('Q', 'setCentralChannel'), ('gate', 'setGate'),
+           ('N', 'setCycleNumber'))
+# Status words of each firmware (see mdaqcore.PROFILES).
+STATUS = dict((k, fw['STATUS'][2]) for k, fw in PROFILES.items())
+CRITERIA = ('counts', 'dip', 'intervals')
+_INTEGERS = ('K', 'U', 'P', 'O', 'Q', 'N', 'intervals')
+_FLOATS = ('T', 'counts', 'dip')
+
+
+def _value(key, text, base):
+    if key in _INTEGERS:
+        return int(text, 0)
+    if key in _FLOATS:
+        return float(text)
+    if key == 'gate':
+        g0, g1 = text.split(',')
+        return (int(g0, 0), int(g1, 0))
+    if key == 'wave':
+        return os.path.join(base, text)
+    raise ValueError('Unknown setting %s' % key)
+
+
+def load(fname):
+    """ Steps of a recipe file.
+
+    Returns: list of dicts, one per step, with 'name', the full settings
+        (inherited from the previous steps) and 'waveform' (the wave
+        string read from the wave file).
+    """
+    base = os.path.dirname(os.path.abspath(fname))
+    steps = []
+    settings = {}
+    with open(fname) as fid:
+        for nline, line in enumerate(fid, 1):
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            try:
+                new = dict(w.split('=', 1) for w in words[1:])
+                new = dict((k, _value(k, v, base)) for k, v in new.items())
+            except ValueError as e:
+                raise ValueError('%s line %d: %s' % (fname, nline, e))
+            if 'N' in new:
+                settings.pop('T', None)
+            if 'T' in new:
+                settings.pop('N', None)
+            if any(k in new for k in CRITERIA):
+                for k in CRITERIA:
+                    settings.pop(k, None)
+            settings.update(new)
+            if words[0] == 'defaults':
+                continue
+            step = dict(settings, name=words[0], line=nline)
+            if 'wave' in step:
+                with open(step['wave']) as wfid:
+                    step['waveform'] = wfid.readline().strip()
+            steps.append(step)
+    return steps
+
+
+def criterion(step):
+    """ Stop criterion of a step (None if it has none). """
+    crits = []
+    if 'counts' in step:
+        crits.append(stop.BaselineCounts(step['counts']))
+    if 'dip' in step:
+        crits.append(stop.DipError(step['dip']))
+    if 'intervals' in step:
+        crits.append(stop.MaxIntervals(step['intervals']))
+    if not crits:
+        return None
+    return stop.Any(*crits)
+
+
+def _fingerprint(steps):
+    return runstate.fingerprint(*[sorted((k, str(v)) for k, v in s.items()
+                                         if k != 'line') for s in steps])
+
+
+class Configurator():
+    """ Sends to the module only the parameters that change.
+
+    Args:
+        hw: an open Instrument. Its configuration is read at once (status
+            and wave).
+    """
+
+    def __init__(self, hw):
+        self.hw = hw
+        self.current = {}
+        self.sent = []             # parameters sent by the last apply()
+        self.read()
+
+    def read(self):
+        """ Read the configuration of the module (status line and wave). """
+        words = self.hw.getStatus().split()
+        keys = STATUS.get(self.hw.firmware, ())
+        self.current = dict((k, int(w, 16)) for k, w in zip(keys, words))
+        if 'G' in self.current:
+            self.current['gate'] = (self.current['G'], self.current['g'])
+        self.current['wave'] = runstate.fingerprint(self.hw.getWave())
+        return self.current
+
+    def wanted(self, step):
+        """ Parameters (in the order they are sent) wanted by a step. """
+        out = []
+        for key, method in SETTERS:
+            if key == 'wave':
+                if 'waveform' in step:
+                    out.append((key, runstate.fingerprint(step['waveform'])))
+            elif key in step:
+                out.append((key, step[key]))
+        return out
+
+    def apply(self, step, N=None):
+        """ Configure the module for a step.
+
+        Args:
+            step: a step of :func:`load`.
+            N: cycles per interval, when the step gives T (seconds).
+
+        Returns: list with the parameters sent.
+        """
+        step = dict(step)
+        if N is not None:
+            step['N'] = N
+        self.sent = []
+        for key, value in self.wanted(step):
+            if self.current.get(key) == value:
+                continue
+            method = dict(SETTERS)[key]
+            if key not in ('wave', 'gate') and \
+                    key not in PROFILES[self.hw.firmware]['LIMITS']:
+                raise ValueError('%s has no parameter %s' % (self.hw.firmware, key))
+            # Unknown until the echo confirms it (an error leaves it unknown).
+            self.current.pop(key, None)
+            if key == 'wave':
+                self.hw.setWave(step['waveform'])
+            elif key == 'gate':
+                self.hw.setGate(*value)
+            else:
+                getattr(self.hw, method)(value)
+            self.current[key] = value
+            self.sent.append(key)
+        return self.sent
+
+
+class Progress():
+    """ Persistent progress of a sequence.
+
+    Args:
+        fname: progress file (replaced atomically on every change).
+        steps: the steps of the recipe. A progress file of another recipe
+            is not continued.
+    """
+
+    def __init__(self, fname, steps):
+        self.fname = fname
+        self.fingerprint = _fingerprint(steps)
+        self.nsteps = len(steps)
+        self.step = 0              # first step not finished
+        self.runs = {}             # step -> output file name
+        self.started = False       # the step self.step was started
+        if os.path.exists(fname):
+            with open(fname) as fid:
+                data = json.load(fid)
+            if data['fingerprint'] != self.fingerprint:
+                raise ValueError('%s is the progress of another recipe' % fname)
+            self.step = data['step']
+            self.runs = dict((int(k), v) for k, v in data['runs'].items())
+            self.started = data['started']
+
+    @property
+    def finished(self):
+        return self.step >= self.nsteps
+
+    def start(self, k, filename):
+        """ Step k started on the output filename. """
+        self.step = k
+        self.runs[k] = filename
+        self.started = True
+        self._save()
+
+    def done(self, k):
+        """ Step k finished. """
+        self.step = k + 1
+        self.started = False
+        self._save()
+
+    def _save(self):
+        data = {'fingerprint': self.fingerprint, 'step': self.step,
+                'runs': self.runs, 'started': self.started}
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(data, fid)
+            fid.flush()
+            os.fsync(fid.fileno())
+        os.replace(tmp, self.fname)
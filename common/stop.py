@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Stop criteria for MAC acquisitions.
+
+A criterion is updated with every downloaded interval and says when the
+accumulated spectrum is good enough. The estimates are kept online (a few
+sums per interval), so checking costs almost nothing compared with the
+download itself::
+
+    >>> crit = stop.BaselineCounts(1e6) | stop.DipError(0.01)
+    >>> ...
+    >>> if crit.update(interval, total):   # in the acquisition loop
+    ...     break
+    >>> print(crit.report())
+
+Criteria are combined with | (any of them) and & (all of them).
+
+Class:
+    stop.BaselineCounts
+    stop.DipError
+    stop.ParameterError
+    stop.MaxIntervals
+"""
+
+import numpy as np
+
+
+class Criterion():
+    """ Base class of the stop criteria.
+
+    Subclasses implement _check(interval, total) returning True when the
+    target is reached, and keep in self.value the current estimate.
+    """
+    name = 'criterion'
+    target = None
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.nintervals = 0
+
+    def update(self, interval, total):
+        """ Update with a new interval.
+
+        Args:
+            interval: counters of the last interval.
+            total: accumulated counters (including the last interval).
+
+        Returns: True if the target is reached.
+        """
+        self.nintervals += 1
+        if not self.done:
+            self.done = bool(self._check(np.asarray(interval),
+                                         np.asarray(total)))
+        return self.done
+
+    def _check(self, interval, total):
+        raise NotImplementedError
+
+    def report(self):
+        """ One line text with the state of the criterion. """
+        return '%s: %s (target %s)%s' % (self.name, _fmt(self.value),
+                                         _fmt(self.target),
+                                         ' REACHED' if self.done else '')
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __and__(self, other):
+        return All(self, other)
+
+
+def _fmt(x):
+    if x is None:
+        return '-'
+    if isinstance(x, float):
+        return '%.4g' % x
+    return str(x)
+
+
+class Any(Criterion):
+    """ Reached when any of the criteria is reached. """
+    name = 'any'
+
+    def __init__(self, *criteria):
+        Criterion.__init__(self)
+        self.criteria = list(criteria)
+
+    def update(self, interval, total):
+        self.nintervals += 1
+        res = [c.update(interval, total) for c in self.criteria]
+        self.done = self._combine(res)
+        return self.done
+
+    def _combine(self, res):
+        return any(res)
+
+    def report(self):
+        return '\n'.join(c.report() for c in self.criteria)
+
+
+class All(Any):
+    """ Reached when all the criteria are reached. """
+    name = 'all'
+
+    def _combine(self, res):
+        return all(res)
+
+
+class BaselineCounts(Criterion):
+    """ Baseline counts per channel.
+
+    Estimated as the mean counts per channel, which slightly underestimates
+    the baseline of spectra with strong absorption (conservative side).
+
+    Args:
+        target: counts per channel.
+    """
+    name = 'baseline counts'
+
+    def __init__(self, target):
+        Criterion.__init__(self)
+        self.target = target
+        self._sum = 0.
+
+    def _check(self, interval, total):
+        self._sum += float(interval.sum())
+        self.value = self._sum/interval.size
+        return self.value >= self.target
+
+
+class DipError(Criterion):
+    """ Relative error of the absorption area.
+
+    The absorption is S = sum_dip (B - y) with B the baseline estimated
+    from the channels out of the dip region. Its Poisson error is
+    sqrt(Y_dip + m**2 * B/n_base), where m is the number of channels on the
+    dip region and n_base the number of baseline channels.
+
+    Args:
+        target: relative error (0.01 means 1%).
+        region: indexes (or boolean mask) of the dip channels. If None they
+            are located on the accumulated spectrum, once it has "locate"
+            counts per channel: the channels more than 3 sigma below the
+            median.
+        locate: counts per channel needed to locate the dip automatically.
+    """
+    name = 'dip relative error'
+
+    def __init__(self, target, region=None, locate=100.):
+        Criterion.__init__(self)
+        self.target = target
+        self.locate = locate
+        self.mask = None
+        if region is not None:
+            self._region = region
+
+    def _setmask(self, total):
+        if hasattr(self, '_region'):
+            mask = np.zeros(total.size, bool)
+            mask[self._region] = True
+        else:
+            med = np.median(total)
+            if med < self.locate:
+                return
+            mask = total < med - 3.*np.sqrt(med)
+            if not mask.any() or mask.all():
+                return
+        self.mask = mask
+        self._m = int(mask.sum())
+        self._nb = total.size - self._m
+        self._ydip = float(total[mask].sum())
+        self._ybase = float(total[~mask].sum())
+
+    def _check(self, interval, total):
+        if self.mask is None:
+            self._setmask(total)
+            if self.mask is None:
+                return False
+        else:
+            self._ydip += float(interval[self.mask].sum())
+            self._ybase += float(interval.sum()) - float(interval[self.mask].sum())
+        B = self._ybase/self._nb
+        S = self._m*B - self._ydip
+        if S <= 0:
+            self.value = None
+            return False
+        err = np.sqrt(self._ydip + self._m**2*B/self._nb)
+        self.value = float(err/S)
+        return self.value <= self.target
+
+
+class ParameterError(Criterion):
+    """ Uncertainty of a fitted parameter.
+
+    Reads the last result of a fit.Worker (or anything with a "result"
+    attribute holding the dict returned by fit.Fitter.fit). It does not
+    fit anything itself, so it never blocks the loop.
+
+    Args:
+        worker: the fit.Worker fed with the accumulated spectrum.
+        name: parameter name (fit.Model.names), for example 'sextet0.B'.
+        target: the wanted error.
+        relative: if True (default) the target is dp/|p|.
+    """
+    name = 'parameter error'
+
+    def __init__(self, worker, name, target, relative=True):
+        Criterion.__init__(self)
+        self.worker = worker
+        self.par = name
+        self.name = '%s error' % name
+        self.target = target
+        self.relative = relative
+
+    def _check(self, interval, total):
+        res = self.worker.result
+        if res is None:
+            return False
+        k = res['names'].index(self.par)
+        p, dp = res['p'][k], res['dp'][k]
+        if not np.isfinite(dp):
+            return False
+        self.value = float(dp/abs(p)) if self.relative and p != 0 else float(dp)
+        return self.value <= self.target
+
+
+class MaxIntervals(Criterion):
+    """ Fixed number of downloaded intervals (a time budget). """
+    name = 'intervals'
+
+    def __init__(self, target):
+        Criterion.__init__(self)
+        self.target = target
+
+    def _check(self, interval, total):
+        self.value = self.nintervals
+        return self.nintervals >= self.target
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Synthetic MAC counts for load and scaling tests.
+
+Generates interval counters as the module would give them, without source
+or beam: Poisson draws of a spectrum made of fit components (sextets,
+doublets, singlets) seen through the MAC geometry of the firmware (1024
+channels on mdaq107, 2048/P on mdaq209, with the remainder channel when P
+does not divide 2048). The drive is a triangular wave: channel i and
+channel s - i see the same velocity (s the fold point, see fold.py).
+
+Drift of the fold point and glitches (noise bursts on a group of
+channels, drops of the count rate) are available on demand. All the
+intervals of a batch are drawn at once with numpy, so the generator runs
+far faster than any serial link (tens of thousands of 1024 channel
+intervals per second).
+
+The counters are also given as the raw replies of the module, exactly what
+Instrument.getCounters() ('Y', hexadecimal text) and getBinCounters()
+('I', 'J', 'V', little endian binary) read::
+
+    >>> gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)],
+    ...                       firmware='MDAQ209', P=2, rate=2e5, interval=1.)
+    >>> counts, info = gen.intervals(1000, drift=0.001, glitches=0.01)
+    >>> line = synth.hexstream(counts[0], 'MDAQ209')     # like getCounters()
+    >>> raw = synth.binstream(counts[0], 2)              # like a 'J' dump
+
+Class:
+    synth.Generator
+
+Func:
+    synth.hexstream
+    synth.binstream
+"""
+
+import numpy as np
+
+import fit
+from planner import FIRMWARES
+
+_HEXDIGITS = np.frombuffer(b'0123456789ABCDEF', np.uint8)
+_BINFORMATS = {4: '<u4', 2: '<u2', 1: 'u1'}
+
+
+class Generator():
+    """ Poisson interval counters of a parametrized MAC spectrum.
+
+    Args:
+        components: fit components (fit.Sextet, fit.Doublet, fit.Singlet)
+            with their parameters in mm/s.
+        firmware: 'MDAQ107-MAC' or 'MDAQ209'.
+        P: step (mdaq209 only).
+        vmax: velocity at the ends of the triangular wave (mm/s).
+        rate: total count rate out of resonance (counts/s).
+        interval: seconds per interval.
+        foldpoint: fold point in channels (default: the last channel, as
+            channel i and nchan-1-i).
+        seed: seed of the random generator.
+    """
+    CHUNK = 256            # intervals evaluated at once when the spectrum drifts
+
+    def __init__(self, components, firmware='MDAQ107-MAC', P=1, vmax=10.,
+                 rate=1e5, interval=1., foldpoint=None, seed=None):
+        fw = FIRMWARES[firmware]
+        if P != 1 and not fw['STEP']:
+            raise ValueError('%s has no step' % firmware)
+        self.firmware = firmware
+        self.canales = fw['CANALES']
+        self.P = P
+        self.nchan = self.canales//P + (self.canales % P != 0)
+        self.vmax = vmax
+        self.rate = rate
+        self.interval = interval
+        self.foldpoint = self.nchan - 1. if foldpoint is None else foldpoint
+        self.model = fit.Model(components, baseline=1.)
+        self.p = self.model.p0()
+        self.rng = np.random.default_rng(seed)
+
+    def velocity(self, shift=0.):
+        """ Velocity (mm/s) of each wave sample, for a fold point moved by
+        "shift" channels. Array (nsamples,) or (len(shift), nsamples). """
+        shift = np.asarray(shift, float)
+        # Fold point in samples: output channel j covers samples jP..jP+P-1.
+        s = ((self.foldpoint + shift)*self.P + self.P - 1)[..., None]
+        u = ((np.arange(self.canales) - 0.5*s) % self.canales)/self.canales
+        return self.vmax*(4.*np.abs(u - 0.5) - 1.)
+
+    def expected(self, shift=0.):
+        """ Expected counts per channel in one interval. """
+        return self._expected(np.atleast_1d(shift))[0]
+
+    def _expected(self, shifts):
+        v = self.velocity(shifts)                          # (n, nsamples)
+        y = self.model.evaluate(v.ravel(), self.p).reshape(v.shape)
+        # Counts of the samples summed on their channel (P samples, fewer
+        # on the remainder channel).
+        P = self.P
+        full = self.canales//P
+        lam = y[:, :full*P].reshape(y.shape[0], full, P).sum(axis=2)
+        if self.nchan > full:
+            lam = np.column_stack([lam, y[:, full*P:].sum(axis=1)])
+        return lam*(self.rate*self.interval/self.canales)
+
+    def intervals(self, n, drift=0., jitter=0., glitches=0., burst=50.,
+                  drop=0.5):
+        """ Draw n intervals.
+
+        Args:
+            n: number of intervals.
+            drift: fold point drift (channels per interval).
+            jitter: standard deviation of a random walk added to the drift
+                (channels per interval).
+            glitches: probability of a glitch in each interval; half are
+                noise bursts, half drops of the rate.
+            burst: counts per channel added by a noise burst (on a random
+                group of 1 to 32 channels).
+            drop: fraction of the rate left in a drop.
+
+        Returns: (counts, info). counts is a (n, nchan) uint32 array; info
+            a dict with 'shift' (fold point shift of each interval) and
+            'glitch' (0 none, 1 burst, 2 drop).
+        """
+        k = np.arange(n)
+        shift = drift*k
+        if jitter:
+            shift = shift + np.cumsum(self.rng.normal(0., jitter, n))
+        counts = np.empty((n, self.nchan), np.uint32)
+        if not drift and not jitter:
+            counts[:] = self.rng.poisson(self.expected(), (n, self.nchan))
+        else:
+            for a in range(0, n, self.CHUNK):
+                lam = self._expected(shift[a:a + self.CHUNK])
+                counts[a:a + lam.shape[0]] = self.rng.poisson(lam)
+        glitch = np.zeros(n, np.uint8)
+        if glitches:
+            hit = np.flatnonzero(self.rng.random(n) < glitches)
+            kind = self.rng.integers(1, 3, hit.size)
+            glitch[hit] = kind
+            for j, g in zip(hit, kind):
+                if g == 1:
+                    w = int(self.rng.integers(1, 33))
+                    c0 = int(self.rng.integers(0, self.nchan - w + 1))
+                    counts[j, c0:c0 + w] += self.rng.poisson(burst, w).astype(np.uint32)
+                else:
+                    counts[j] = self.rng.binomial(counts[j], drop)
+        return counts, {'shift': shift, 'glitch': glitch}
+
+
+def hexstream(counts, firmware='MDAQ107-MAC'):
+    """ The 'Y' reply of the module for the counters (str, with the CR+LF
+    terminator), as returned by Instrument.getCounters(). The counters are
+    truncated to the digits of the firmware. """
+    nd = FIRMWARES[firmware]['HEXDIGITS']
+    c = np.asarray(counts, np.uint64)
+    shifts = np.arange(4*(nd - 1), -1, -4, dtype=np.uint64)
+    digits = (c[:, None] >> shifts) & np.uint64(0xF)
+    return _HEXDIGITS[digits].tobytes().decode('ascii') + '\r\n'
+
+
+def binstream(counts, nbytes=4):
+    """ The 'I' (nbytes 4), 'J' (2) or 'V' (1) reply of the module for the
+    counters (bytes, little endian, no terminator), as read by
+    Instrument.getBinCounters(). """
+    c = np.asarray(counts, np.uint64) & np.uint64((1 << 8*nbytes) - 1)
+    return c.astype(_BINFORMATS[nbytes]).tobytes()
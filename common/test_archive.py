@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of archive.py on synthetic intervals (synth.py). """
+
+import os
+
+import numpy as np
+import pytest
+
+import archive
+import fit
+import synth
+
+
+def _intervals(n, seed=0):
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], rate=1e5,
+                          seed=seed)
+    return gen.intervals(n, drift=0.01, glitches=0.05)[0]
+
+
+def _write(fname, counts, t0=0, **kw):
+    ar = archive.Writer(fname, counts.shape[1], **kw)
+    for k, c in enumerate(counts):
+        ar.write(c, t0 + k, t0 + k + 0.9)
+    ar.close()
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'bz2', 'lzma'])
+def test_roundtrip(tmp_path, codec):
+    counts = _intervals(70)
+    fname = str(tmp_path/'run.00.mdz')
+    _write(fname, counts, blocksize=32, codec=codec)
+    rd = archive.Reader(fname)
+    assert len(rd) == 70 and rd.shape == (70, 1024)
+    assert np.array_equal(rd[:], counts)
+    assert np.array_equal(rd[45], counts[45])
+    assert np.array_equal(rd[10:60:7], counts[10:60:7])
+    assert np.array_equal(np.array(list(rd)), counts)
+    assert rd.times(69) == (69., 69.9)
+
+
+def test_continue_and_rebuilt_index(tmp_path):
+    counts = _intervals(50)
+    fname = str(tmp_path/'run.00.mdz')
+    _write(fname, counts[:20], blocksize=8)
+    _write(fname, counts[20:], t0=20, blocksize=8)
+    os.remove(fname + '.idx')
+    rd = archive.Reader(fname)
+    assert len(rd) == 50
+    assert np.array_equal(rd[:], counts)
+
+
+def test_resume_after_a_cut_block(tmp_path):
+    # A crash cut the last block: the writer continues from the last
+    # complete one, and the header scan (no .idx) still finds everything.
+    counts = _intervals(80)
+    fname = str(tmp_path/'run.00.mdz')
+    _write(fname, counts[:40], blocksize=8)
+    size = os.path.getsize(fname)
+    _write(fname, counts[40:48], t0=40, blocksize=8)
+    with open(fname, 'r+b') as fid:
+        fid.truncate(size + (os.path.getsize(fname) - size)//2)
+    ar = archive.Writer(fname, 1024)
+    assert ar.count == 40
+    assert os.path.getsize(fname) == size
+    ar.close()
+    _write(fname, counts[40:], t0=40)
+    assert len(archive.Reader(fname)) == 80
+    os.remove(fname + '.idx')
+    rd = archive.Reader(fname)
+    assert len(rd) == 80
+    assert np.array_equal(rd[:], counts)
+    assert rd.times(79) == (79., 79.9)
+
+
+def test_resume_after_a_lost_index_entry(tmp_path):
+    # The block reached the disk, its .idx entry did not.
+    counts = _intervals(24)
+    fname = str(tmp_path/'run.00.mdz')
+    _write(fname, counts[:16], blocksize=8)
+    with open(fname + '.idx', 'r+b') as fid:
+        fid.truncate(archive._INDEX.itemsize)
+    _write(fname, counts[16:], t0=16)
+    rd = archive.Reader(fname)
+    assert np.array_equal(rd[:], counts)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of cumulative.py: intervals from cumulative snapshots. """
+
+import numpy as np
+import pytest
+
+import cumulative
+
+
+def test_intervals_across_the_roll_over():
+    rng = np.random.RandomState(0)
+    steps = rng.randint(0, 30000, (6, 64))
+    snaps = np.cumsum(steps, axis=0)           # goes past 2**16 several times
+    dif = cumulative.Differ(64, bits=16)
+    dif.reset(np.zeros(64), 0)
+    for k, s in enumerate(snaps):
+        interval, cycles = dif.update(s & 0xFFFF, 100*(k + 1))
+        assert np.array_equal(interval, steps[k])
+        assert cycles == 100
+    assert np.array_equal(dif.total, snaps[-1])
+    assert dif.cycles == 600
+
+
+def test_cycle_counter_roll_over():
+    dif = cumulative.Differ(4, bits=16, mbits=16)
+    dif.reset(np.zeros(4), 0xFFF0)
+    interval, cycles = dif.update(np.ones(4), 0x0010)
+    assert cycles == 0x20 and dif.cycles == 0x20
+    assert np.array_equal(interval, np.ones(4))
+
+
+def test_first_update_is_the_origin():
+    dif = cumulative.Differ(4)
+    interval, cycles = dif.update(np.arange(4), 50)
+    assert not interval.any() and cycles == 0
+    interval, cycles = dif.update(np.arange(4) + 3, 70)
+    assert np.array_equal(interval, [3, 3, 3, 3]) and cycles == 20
+
+
+def test_maxinterval():
+    # 1024 channels at 1e5 counts/s: 4*1e5/1024 counts/s in the busiest.
+    t = cumulative.maxinterval(1e5, 1024, 16)
+    assert t == pytest.approx(0.5*65536/(4e5/1024))
+    assert cumulative.maxinterval(1e5, 1024, 32) == pytest.approx(t*65536)
+    # With 32 bits the cycle counter is the limit.
+    assert cumulative.maxinterval(1e5, 1024, 32, freq=1e4) == \
+        pytest.approx(0.5*2**32/1e4)
+    assert cumulative.maxinterval(1e5, 1024, 16, freq=1e4) == t
+    assert cumulative.maxinterval(1e5, 1024, 16, freq=1e4, mbits=16) == \
+        pytest.approx(0.5*65536/1e4)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of decode.py against the replies built by synth.py. """
+
+import numpy as np
+
+import decode
+import fit
+import mdaqcore
+import synth
+
+
+def _counts(firmware, P=1):
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], firmware=firmware,
+                          P=P, rate=1e7, seed=0)
+    return gen.intervals(1)[0][0]
+
+
+def test_hex2array_roundtrip_mdaq107():
+    c = _counts('MDAQ107-MAC') & 0xFFFF
+    a = decode.hex2array(synth.hexstream(c, 'MDAQ107-MAC'), 4)
+    assert np.array_equal(a, c)
+
+
+def test_hex2array_roundtrip_mdaq209():
+    c = _counts('MDAQ209', P=3)
+    a = decode.hex2array(synth.hexstream(c, 'MDAQ209'), 8)
+    assert len(a) == mdaqcore.nchannels('MDAQ209', 3)
+    assert np.array_equal(a, c)
+
+
+def test_hex2array_bytes_and_lower_case():
+    assert list(decode.hex2array(b'0001000a000D\r\n', 4)) == [1, 10, 13]
+
+
+def test_hex2array_agrees_with_hes2numlist():
+    s = synth.hexstream(_counts('MDAQ107-MAC') & 0xFFFF, 'MDAQ107-MAC')
+    assert list(decode.hex2array(s, 4)) == mdaqcore.hes2numlist(s[:-2], 4)
+
+
+def test_hexws2array_interval_line():
+    # The '%x' counters of the spectrum107 interval lines (any width).
+    c = _counts('MDAQ107-MAC').astype(np.uint64)
+    c[5] = 0
+    c[7] = 0x123456789
+    a = decode.hexws2array(' '.join('%x' % k for k in c) + '\n')
+    assert a.dtype == np.uint64
+    assert np.array_equal(a, c)
+
+
+def test_hexws2array_same_width():
+    a = decode.hexws2array('0001 000A 000D')
+    assert a.dtype == np.uint64
+    assert list(a) == [1, 10, 13]
+    assert decode.hexws2array('').dtype == np.uint64
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of fit.py on synthetic spectra (synth.py). """
+
+import numpy as np
+import pytest
+
+import fit
+import synth
+
+
+def test_parse():
+    comps = fit.parse('sextet(B=33, w=0.3) + Doublet(d=0.3,q=0.6) + singlet')
+    assert [c.kind for c in comps] == ['sextet', 'doublet', 'singlet']
+    assert comps[0].p0 == [0.05, 0., 0., 33., 0.3]
+    assert comps[1].p0 == [0.05, 0.3, 0.6, 0.3]
+    for text in ('triplet', 'sextet(q=0.6)', 'sextet(B)', 'sextet(B=x)'):
+        with pytest.raises(ValueError):
+            fit.parse(text)
+
+
+def test_fit_converges_and_warm_starts():
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3),
+                           fit.Doublet(A=0.05, d=0.3, q=0.8, w=0.3)],
+                          rate=1e6, seed=1)
+    counts = gen.intervals(20)[0].astype(float)
+    model = fit.Model(fit.parse('sextet(A=0.08,B=32,w=0.4)+doublet(d=0.2,q=0.7)'))
+    fitter = fit.Fitter(model, gen.velocity())
+    res = fitter.fit(counts[:10].sum(axis=0))
+    p = dict(zip(res['names'], res['p']))
+    assert p['sextet0.B'] == pytest.approx(33., abs=0.05)
+    assert p['doublet1.q'] == pytest.approx(0.8, abs=0.05)
+    assert res['chi2'] == pytest.approx(1., abs=0.2)
+    warm = fitter.fit(counts.sum(axis=0))
+    assert warm['niter'] <= res['niter']
+    assert np.all(warm['dp'][1:] < res['dp'][1:])
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of fold.py: conservation of the counts when folding. """
+
+import numpy as np
+import pytest
+
+import fit
+import fold
+import synth
+
+
+def _counts(n=1):
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], rate=1e6, seed=0)
+    c = gen.intervals(n)[0].astype(float)
+    return c[0] if n == 1 else c
+
+
+@pytest.mark.parametrize('s', [1023., 1000.4, 511.5, 17.25, 0.])
+def test_mirror_conserves_counts(s):
+    c = _counts()
+    assert np.isclose(fold.mirror(c, s)[0].sum(), c.sum())
+
+
+@pytest.mark.parametrize('s', [1023., 1001., 3.])
+def test_fold_conserves_counts(s):
+    # Odd s: no channel is its own mirror, every count goes to one of the
+    # n//2 folded channels.
+    c = _counts()
+    y, dy, s2 = fold.fold(c, s)
+    assert s2 == s and len(y) == 512
+    assert np.isclose(y.sum(), c.sum())
+    assert np.allclose(dy**2, y)
+
+
+def test_fold_rows_as_the_sum():
+    c = _counts(3)
+    y = fold.fold(c, 1023.)[0]
+    assert np.allclose(y.sum(axis=0), fold.fold(c.sum(axis=0), 1023.)[0])
+
+
+def test_channels_pairs():
+    c = np.arange(1024.)
+    idx = fold.channels(1024, 1023.)
+    y = fold.fold(c, 1023.)[0]
+    assert np.array_equal(y, c[idx] + c[(1023 - idx) % 1024])
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of planner.py. """
+
+import pytest
+
+import planner
+
+LINK = planner.Link(0.002, 11520)
+
+
+def test_formats_limited_by_the_counters():
+    # mdaq107: 16 bit counters, the 4 bytes of I do not make them wider.
+    g = planner.grid('MDAQ107-MAC', LINK, 60., rate=2e6)
+    assert not g['valid'].any()
+    with pytest.raises(ValueError):
+        planner.plan('MDAQ107-MAC', LINK, 60., rate=2e6)
+    g = planner.grid('MDAQ209', LINK, 60., rate=4e6)
+    valid = dict((f, g['valid'][:, :, k].any())
+                 for k, f in enumerate(g['formats']))
+    assert valid == {'I': True, 'J': False, 'V': False, 'Y': True}
+
+
+def test_without_rate_the_whole_counters():
+    g = planner.grid('MDAQ107-MAC', LINK, 60.)
+    valid = dict((f, g['valid'][:, :, k].any())
+                 for k, f in enumerate(g['formats']))
+    assert valid == {'I': True, 'J': True, 'V': False, 'Y': True}
+    assert planner.plan('MDAQ209', LINK, 60.)['format'] in ('I', 'Y')
+
+
+def test_plan_interval_and_duty():
+    res = planner.plan('MDAQ209', LINK, 120., channels=512, rate=2e4)
+    assert res['nchan'] >= 512
+    assert abs(res['interval'] - 120.)/120. <= planner.TOLERANCE
+    assert res['duty'] == pytest.approx(res['interval']/(res['interval'] +
+                                                         res['dead']))
+    assert 'duty cycle' in planner.report(res)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of prefix.py on synthetic intervals (synth.py). """
+
+import os
+
+import numpy as np
+
+import archive
+import fit
+import prefix
+import synth
+
+
+def _intervals(n, seed=0):
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], rate=1e5,
+                          seed=seed)
+    return gen.intervals(n, drift=0.01, glitches=0.05)[0]
+
+
+def _write(fname, counts, t0=0):
+    wr = prefix.Writer(fname, counts.shape[1])
+    for k, c in enumerate(counts):
+        wr.write(c, t0 + k, t0 + k + 0.9)
+    wr.close()
+
+
+def test_windows(tmp_path):
+    counts = _intervals(40)
+    fname = str(tmp_path/'run.00.mdz.psum')
+    _write(fname, counts)
+    ix = prefix.Index(fname)
+    assert len(ix) == 40 and ix.nchan == 1024
+    assert np.array_equal(ix.window(0, 40), counts.sum(axis=0))
+    assert np.array_equal(ix.window(7, 23), counts[7:23].sum(axis=0))
+    assert np.array_equal(ix.window(30, None), counts[30:].sum(axis=0))
+    assert np.array_equal(ix.window(-5, 40), counts[-5:].sum(axis=0))
+    assert not ix.window(12, 12).any() and not ix.window(20, 10).any()
+    w = ix.windows([0, 10, 40])
+    assert np.array_equal(w[0], counts[:10].sum(axis=0))
+    assert np.array_equal(w[1], counts[10:].sum(axis=0))
+
+
+def test_time_windows(tmp_path):
+    counts = _intervals(40)
+    fname = str(tmp_path/'run.00.mdz.psum')
+    _write(fname, counts, t0=100)
+    ix = prefix.Index(fname)
+    assert ix.span(105., 110.) == (5, 10)
+    assert ix.span(104.5, 109.95) == (5, 10)   # partial intervals left out
+    assert ix.span(110.5, 110.6) == (11, 11)
+    assert np.array_equal(ix.between(105., 110.), counts[5:10].sum(axis=0))
+    assert ix.locate(112.5) == 12
+    assert ix.locate(112.95) == 12             # dead time after interval 12
+    assert ix.locate(50.) == 0
+    assert ix.locate(1e6) == 39
+
+
+def test_truncate_and_continue(tmp_path):
+    counts = _intervals(30)
+    fname = str(tmp_path/'run.00.mdz.psum')
+    wr = prefix.Writer(fname, 1024)
+    for k, c in enumerate(counts[:20]):
+        wr.write(c, k, k + 0.9)
+    wr.truncate(12)
+    assert wr.count == 12
+    wr.close()
+    _write(fname, counts[12:], t0=12)
+    ix = prefix.Index(fname)
+    assert len(ix) == 30
+    assert np.array_equal(ix.window(0, 30), counts.sum(axis=0))
+    assert ix.locate(25.5) == 25
+
+
+def test_cut_record_dropped_on_reopen(tmp_path):
+    counts = _intervals(10)
+    fname = str(tmp_path/'run.00.mdz.psum')
+    _write(fname, counts[:6])
+    with open(fname, 'r+b') as fid:
+        fid.truncate(os.path.getsize(fname) - 100)
+    wr = prefix.Writer(fname, 1024)
+    assert wr.count == 5
+    wr.close()
+    _write(fname, counts[5:], t0=5)
+    ix = prefix.Index(fname)
+    assert np.array_equal(ix.sums[1:], np.cumsum(counts, axis=0))
+
+
+def test_build_matches_writer(tmp_path):
+    counts = _intervals(40)
+    fname = str(tmp_path/'run.00.mdz')
+    ar = archive.Writer(fname, 1024, blocksize=16, prefix=True)
+    for k, c in enumerate(counts):
+        ar.write(c, k, k + 0.9)
+    ar.close()
+    ix = prefix.Index(fname + '.psum')
+    built = prefix.build(fname, str(tmp_path/'built.psum'))
+    assert np.array_equal(built.sums, ix.sums)
+    assert np.array_equal(built.tf, ix.tf)
+
+
+def test_build_completes_a_partial_index(tmp_path):
+    counts = _intervals(40)
+    fname = str(tmp_path/'run.00.mdz')
+    ar = archive.Writer(fname, 1024, blocksize=16)
+    for k, c in enumerate(counts):
+        ar.write(c, k, k + 0.9)
+    ar.close()
+    _write(fname + '.psum', counts[:21])        # ends inside the 2nd block
+    ix = prefix.build(fname)
+    assert len(ix) == 40
+    assert np.array_equal(ix.sums[1:], np.cumsum(counts, axis=0))
+    assert ix.ti[39] == 39.
+
+
+def test_writer_drops_buffered_prefix_after_a_crash(tmp_path):
+    # The prefix rows of the intervals still buffered by the archive are
+    # dropped when the archive is reopened.
+    counts = _intervals(20)
+    fname = str(tmp_path/'run.00.mdz')
+    ar = archive.Writer(fname, 1024, blocksize=8, prefix=True)
+    for k, c in enumerate(counts):
+        ar.write(c, k, k + 0.9)
+    ar.prefix.flush()
+    ar._buf, ar._times = [], []
+    ar.close()
+    ar = archive.Writer(fname, 1024, prefix=True)
+    assert ar.count == 16 and ar.prefix.count == 16
+    ar.close()
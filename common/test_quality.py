@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of quality.py on synthetic intervals (synth.py). """
+
+import numpy as np
+
+import fit
+import quality
+import synth
+
+SEXTET = [fit.Sextet(A=0.1, B=33., w=0.3)]
+RATE = 1024*1e4                   # about 10000 counts per channel and interval
+
+
+def _intervals(n, rate=RATE, seed=0, **kw):
+    gen = synth.Generator(SEXTET, rate=rate, seed=seed)
+    return gen.intervals(n, **kw)[0]
+
+
+def test_accepts_good_intervals():
+    scr = quality.Screen(1024)
+    assert all(scr.update(c) for c in _intervals(100))
+    assert scr.rejected == 0
+
+
+def test_rejects_glitches():
+    counts = _intervals(40)
+    counts[20, 100:120] += 2000           # noise burst
+    counts[30] //= 2                      # drop of the rate
+    scr = quality.Screen(1024)
+    ok = [scr.update(c) for c in counts]
+    assert [k for k, a in enumerate(ok) if not a] == [20, 30]
+    assert scr.rebases == 0
+
+
+def test_step_gets_a_new_baseline():
+    # A lasting 2% change of the rate: rejected only until the new baseline.
+    counts = np.vstack([_intervals(30), _intervals(60, RATE*1.02, seed=1)])
+    scr = quality.Screen(1024, rebase=5)
+    ok = [scr.update(c) for c in counts]
+    assert all(ok[:30])
+    assert not ok[30]
+    assert all(ok[34:])
+    assert scr.rebases == 1 and scr.rejected == 4
+
+
+def test_step_without_rebase_is_rejected_for_ever():
+    counts = np.vstack([_intervals(30), _intervals(30, RATE*1.02, seed=1)])
+    scr = quality.Screen(1024, rebase=0)
+    ok = [scr.update(c) for c in counts]
+    assert not any(ok[30:])
+
+
+def test_slow_drift_is_followed():
+    # The rate grows 2% along 200 intervals.
+    rates = RATE*(1 + 0.02*np.arange(200)/200.)
+    counts = [_intervals(1, r, seed=k)[0] for k, r in enumerate(rates)]
+    scr = quality.Screen(1024)
+    assert all(scr.update(c) for c in counts)
+    assert scr.rebases == 0
+
+
+def test_inconsistent_rejections_do_not_rebase():
+    counts = _intervals(30).astype(float)
+    rng = np.random.default_rng(2)
+    counts[10:20] *= rng.uniform(0.5, 3., (10, 1024))
+    scr = quality.Screen(1024, rebase=5)
+    ok = [scr.update(c) for c in counts]
+    assert not any(ok[10:20])
+    assert all(ok[20:])
+    assert scr.rebases == 0
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of ratemeter.py: the online tests of the Meter on sample series,
+and the Monitor on an emulated module. """
+
+import numpy as np
+import pytest
+
+import ratemeter
+
+
+def _feed(meter, samples, N=None):
+    """ Feeds (t, M, S) samples; returns the faults found. """
+    faults = []
+    for t, M, S in samples:
+        fault = meter.update(t, M, S, N)
+        if fault is not None:
+            faults.append((t, fault[0]))
+    return faults
+
+
+def _steady(t0, t1, rate=1000., freq=25., M0=0, S0=0, t00=None):
+    """ One sample per second, counting at rate in the gate. """
+    t00 = t0 if t00 is None else t00
+    return [(t, M0 + int((t - t00)*freq), S0 + int((t - t00)*rate))
+            for t in np.arange(t0, t1, 1.)]
+
+
+def test_steady_rate_has_no_fault():
+    meter = ratemeter.Meter()
+    assert _feed(meter, _steady(0, 60)) == []
+    assert meter.rate() == pytest.approx(1000.)
+    assert len(meter.series) == 59
+    assert meter.series[-1][1:] == (pytest.approx(1000.), pytest.approx(25.))
+
+
+def test_zero():
+    meter = ratemeter.Meter(zero=5., warmup=1e9)   # no drop test
+    samples = _steady(0, 20) + [(t, int(t*25.), 19000) for t in range(20, 40)]
+    assert _feed(meter, samples[:26]) == [(25, 'zero')]
+    # Once found, the stretch without counts does not lower the reference
+    # rate any more.
+    rate = meter.rate()
+    assert len(_feed(meter, samples[26:])) == 14
+    assert meter.rate() == rate
+
+
+def test_drop():
+    meter = ratemeter.Meter(drop=0.5, window=5., warmup=10.)
+    samples = _steady(0, 20) + _steady(20, 40, rate=200., M0=500, S0=20000,
+                                       t00=20)
+    faults = _feed(meter, samples)
+    assert faults and faults[0][1] == 'drop'
+    assert 22 <= faults[0][0] <= 25
+    assert meter.rate() > 800.
+
+
+def test_no_drop_before_the_warmup():
+    meter = ratemeter.Meter(warmup=30.)
+    samples = _steady(0, 10) + _steady(10, 25, rate=200., M0=250, S0=10000,
+                                       t00=10)
+    assert _feed(meter, samples) == []
+
+
+def test_stall_without_gate_sum():
+    # mdaq107: no m, only the cycle counter.
+    meter = ratemeter.Meter(stall=5.)
+    samples = [(t, M, None) for t, M, S in _steady(0, 10)]
+    samples += [(t, 225, None) for t in range(10, 20)]
+    faults = _feed(meter, samples)
+    assert faults[0] == (15, 'stall')
+    assert meter.rate() is None
+
+
+def test_done_is_not_a_stall():
+    meter = ratemeter.Meter(stall=5.)
+    samples = _steady(0, 8) + [(t, 200, 8000) for t in range(8, 20)]
+    assert _feed(meter, samples, N=200) == []
+
+
+def test_cleared_counters_start_a_new_segment():
+    meter = ratemeter.Meter()
+    samples = _steady(0, 20) + _steady(20, 40, t00=20)
+    assert _feed(meter, samples) == []
+    assert meter.rate() == pytest.approx(1000.)
+
+
+class FakeModule():
+    """ Cycle counter and gate sum of a module counting until "dead". """
+
+    firmware = 'MDAQ209'
+
+    def __init__(self, dead=None):
+        self.dead = dead
+        self.k = 0
+        self.stopped = False
+
+    def getCycleNumber(self):
+        self.k += 1
+        return 25*self.k
+
+    def getSumInGate(self):
+        return 1000*min(self.k, self.dead or self.k)
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [0.]
+    monkeypatch.setattr(ratemeter.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(ratemeter.time, 'sleep',
+                        lambda dt: clock.__setitem__(0, clock[0] + dt))
+    return clock
+
+
+def test_monitor_stops_on_a_fault(clock):
+    hw = FakeModule(dead=10)
+    mon = ratemeter.Monitor(ratemeter.Meter(zero=3., warmup=1e9), period=1.)
+    with pytest.raises(ratemeter.Fault) as e:
+        mon.sleep(hw, 60.)
+    assert e.value.kind == 'zero' and hw.stopped
+    assert clock[0] == pytest.approx(14.)
+    assert len(mon.faults) == 1 and 'zero' in mon.report()
+
+
+def test_monitor_flags_once_per_episode(clock):
+    hw = FakeModule(dead=5)
+    mon = ratemeter.Monitor(ratemeter.Meter(zero=2., warmup=1e9),
+                            action='flag')
+    mon.sleep(hw, 20.5)
+    assert mon.queries == 20 and not hw.stopped
+    assert [f[1] for f in mon.faults] == ['zero']
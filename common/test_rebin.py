@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of rebin.py: conservation of the counts between steps. """
+
+import numpy as np
+import pytest
+
+import fit
+import mdaqcore
+import rebin
+import synth
+
+
+def _counts(P, n=1, seed=0):
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], firmware='MDAQ209',
+                          P=P, rate=1e6, seed=seed)
+    c = gen.intervals(n)[0]
+    return c[0] if n == 1 else c
+
+
+@pytest.mark.parametrize('P,step', [(1, 2), (2, 1), (3, 2), (2, 3), (7, 5),
+                                    (3, 3), (512, 1), (1, 512)])
+def test_rebin_conserves_counts(P, step):
+    c = _counts(P)
+    y = rebin.rebin(c, P, step)
+    assert len(y) == mdaqcore.nchannels('MDAQ209', step)
+    assert np.isclose(y.sum(), c.sum())
+
+
+def test_rebin_rows():
+    c = _counts(3, n=4)
+    y = rebin.rebin(c, 3, 2)
+    assert y.shape == (4, 1024)
+    assert np.allclose(y.sum(axis=1), c.sum(axis=1))
+
+
+def test_rebin_to_finer_and_back():
+    # Spreading uniformly and summing again gives the same counters.
+    c = _counts(4)
+    assert np.allclose(rebin.rebin(rebin.rebin(c, 4, 1), 1, 4), c)
+
+
+def test_edges_remainder_channel():
+    e = rebin.edges(3)
+    assert len(e) == 684 and e[-1] == 2048 and e[-1] - e[-2] == 2
+
+
+def test_wrong_number_of_channels():
+    with pytest.raises(ValueError):
+        rebin.rebin(np.zeros(1024), 3, 1)
+
+
+def test_merge_conserves_counts():
+    spectra = [_counts(1), _counts(2, seed=1), _counts(3, seed=2)]
+    y, exposure = rebin.merge(spectra, [1, 2, 3], cycles=[10, 20, 30])
+    assert len(y) == mdaqcore.nchannels('MDAQ209', 3)
+    assert np.isclose(y.sum(), sum(c.sum() for c in spectra))
+    assert np.isclose(exposure.sum(), 60*2048)
+
+
+def test_tovelocity_keeps_the_counts_inside_the_grid():
+    c = _counts(2)
+    v = np.linspace(-10., 10., 2048)
+    y, exposure = rebin.tovelocity(c, 2, v, np.linspace(-10., 10., 101))
+    assert np.isclose(y.sum(), c.sum())
+    assert exposure.sum() == 2048
+    y, exposure = rebin.tovelocity(c, 2, v, np.linspace(-5., 5., 51))
+    assert y.sum() < c.sum()
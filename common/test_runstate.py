@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of runstate.py. """
+
+import os
+
+import numpy as np
+
+import runstate
+
+
+def test_commit_and_load(tmp_path):
+    fname = str(tmp_path/'run.00.state')
+    assert runstate.load(fname) is None
+    st = runstate.State(fname, runstate.fingerprint('0000', 0x400, 0x500), 20,
+                        t0=100.)
+    totals = np.arange(1024, dtype=np.uint64)*(1 << 33)
+    st.commit(3, totals, 2.5, 3.4, 1234)
+    ld = runstate.load(fname)
+    assert (ld.intervals, ld.N, ld.t0, ld.size) == (3, 20, 100., 1234)
+    assert (ld.ti, ld.tf) == (2.5, 3.4)
+    assert np.array_equal(ld.totals, totals.astype(np.int64))
+    assert ld.fingerprint == st.fingerprint and not ld.finished
+    st.finish()
+    assert runstate.load(fname).finished
+    assert not os.path.exists(fname + '.tmp')
+
+
+def test_fingerprint():
+    a = runstate.fingerprint('0000ffff', 0x400, 0x500)
+    assert a == runstate.fingerprint('0000FFFF\r\n', 0x400, 0x500)
+    assert a != runstate.fingerprint('0000ffff', 0x400, 0x501)
+    assert a != runstate.fingerprint('0000fffe', 0x400, 0x500)
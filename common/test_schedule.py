@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of schedule.py on an emulated module counting at a known
+frequency. """
+
+import time
+
+import pytest
+
+import schedule
+
+FREQ = 1000.                               # nominal frequency (Hz)
+
+
+class FakeModule():
+    """ Counts at freq from start(); with rk it sends the notice at the
+    end, unless the notice is lost. """
+
+    def __init__(self, freq=FREQ, N=100, lost=False):
+        self.freq = freq
+        self.N = N
+        self.lost = lost
+        self.t0 = None
+        self.M = []
+        self.drained = 0
+        self.ser = self
+
+    def start(self):
+        self.t0 = time.time()
+
+    def getCycleNumber(self):
+        self.M.append(time.time())
+        return min(int((time.time() - self.t0)*self.freq), self.N)
+
+    def inWaiting(self):
+        done = (time.time() - self.t0)*self.freq >= self.N
+        return 4 if done and not self.lost else 0
+
+    def waitRK(self):
+        pass
+
+    def drain(self):
+        self.drained += 1
+
+
+def _count(sched, hw, **kw):
+    hw.start()
+    sched.start(hw.N, hw.t0)
+    t = sched.wait(hw, **kw)
+    assert (t - hw.t0)*hw.freq >= hw.N
+    return t
+
+
+def test_on_time_prediction():
+    # Woken a guard before the end, a couple of polls confirm it.
+    sched = schedule.Completion(FREQ)
+    hw = FakeModule()
+    _count(sched, hw)
+    assert sched.queries <= 3
+    assert sched.drift == pytest.approx(1., rel=0.05)
+    assert sched.end() <= sched.tconfirm
+
+
+def test_slow_module_measures_the_drift():
+    sched = schedule.Completion(FREQ)
+    hw = FakeModule(freq=0.8*FREQ)
+    for k in range(6):
+        _count(sched, hw)
+    assert sched.drift == pytest.approx(1.25, rel=0.05)
+    # Once the drift is known the prediction is on time again.
+    q = sched.queries
+    _count(sched, hw)
+    assert sched.queries - q <= 3
+
+
+def test_polls_are_spaced_by_what_is_left():
+    # The prediction is 400 ms early: the polls sleep about the time left
+    # (less half a guard), not one poll period (40 polls) each.
+    sched = schedule.Completion(FREQ, alpha=0.)
+    hw = FakeModule(freq=0.5*FREQ, N=400)
+    _count(sched, hw)
+    assert sched.queries <= 12
+
+
+def test_rk():
+    sched = schedule.Completion(FREQ)
+    hw = FakeModule()
+    _count(sched, hw, rk=True)
+    assert sched.queries == 0 and sched.missed == 0 and not hw.M
+
+
+def test_lost_rk_falls_back_to_m():
+    sched = schedule.Completion(FREQ)
+    hw = FakeModule(lost=True)
+    t = _count(sched, hw, rk=True, timeout=0.02)
+    assert sched.missed == 1 and hw.drained == 1
+    assert sched.queries >= 1
+    assert t >= sched.tend + 0.02
+
+
+def test_monitor_and_rk():
+    sched = schedule.Completion(FREQ)
+    sched.start(100)
+    with pytest.raises(ValueError):
+        sched.wait(FakeModule(), rk=True, monitor=object())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of stop.py on synthetic intervals (synth.py). """
+
+import numpy as np
+import pytest
+
+import fit
+import stop
+import synth
+
+
+def _gen():
+    return synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], rate=1e6, seed=2)
+
+
+def test_baseline_counts_and_intervals():
+    counts = _gen().intervals(10)[0]
+    crit = stop.BaselineCounts(5e3) | stop.MaxIntervals(100)
+    total = np.zeros(counts.shape[1])
+    for k, c in enumerate(counts):
+        total += c
+        if crit.update(c, total):
+            break
+    assert 4 <= k <= 6
+    assert 'REACHED' in crit.report()
+
+
+def test_parameter_error_from_the_fit_worker():
+    gen = _gen()
+    counts = gen.intervals(30)[0]
+    worker = fit.Worker(fit.Fitter(fit.Model(fit.parse('sextet(B=32)')),
+                                   gen.velocity()))
+    crit = stop.ParameterError(worker, 'sextet0.B', 1e-3)
+    total = np.zeros(counts.shape[1])
+    errors = []
+    for c in counts:
+        total += c
+        worker.submit(total)
+        worker.wait(10.)
+        done = crit.update(c, total)
+        errors.append(crit.value)
+        if done:
+            break
+    worker.stop()
+    assert done and crit.value <= 1e-3
+    assert errors[0] > errors[-1]
+    assert worker.result['p'][4] == pytest.approx(33., abs=0.1)
+
+
+def test_parameter_error_without_a_fit_yet():
+    class Idle():
+        result = None
+    crit = stop.ParameterError(Idle(), 'sextet0.B', 1e-3)
+    assert not crit.update(np.ones(4), np.ones(4)) and crit.value is None
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of velocity.py. """
+
+import numpy as np
+import pytest
+
+import mdaqcore
+import velocity
+
+
+def _triangle(n=2048, top=0xFFF):
+    """ Triangular wave (list of integers) and its getWave() string. """
+    k = np.arange(n)
+    w = np.round(top*(1. - np.abs(2.*k/n - 1.))).astype(int)
+    return w, ''.join('%04X' % x for x in w) + '\r\n'
+
+
+def test_gain():
+    assert velocity.gain(0x2000, 'MDAQ209') == 0.
+    assert velocity.gain(0x3FFF, 'MDAQ209') == pytest.approx(1., abs=1e-3)
+    assert velocity.gain(0x0000, 'MDAQ107-MAC') == 1.
+    assert velocity.gain(0x800, 'MDAQ107-MAC') == 0.
+
+
+def test_axis_is_linear_in_the_wave():
+    w, s = _triangle()
+    v = velocity.axis(s, 0x3FFF, calib=(10., 0.5))
+    x = velocity.gain(0x3FFF)*(w - 0.5*(w.max() + w.min()))/(0.5*(w.max() - w.min()))
+    assert np.allclose(v, 10.*x + 0.5)
+    assert v.max() == pytest.approx(10.5, abs=1e-2)
+
+
+def test_axis_with_step_averages_the_samples():
+    w, s = _triangle()
+    P = 3
+    v1 = velocity.axis(s, 0x3FFF, P=1)
+    v3 = velocity.axis(s, 0x3FFF, P=P)
+    assert len(v3) == mdaqcore.nchannels('MDAQ209', P)
+    assert v3[5] == pytest.approx(v1[15:18].mean())
+    assert v3[-1] == pytest.approx(v1[-2:].mean())   # remainder channel
+
+
+def test_cache_and_fingerprint():
+    w, s = _triangle(1024)
+    v = velocity.axis(s, 0x400, firmware='MDAQ107-MAC')
+    assert velocity.axis(s.lower(), 0x400, firmware='MDAQ107-MAC') is v
+    assert velocity.axis(list(w), 0x400, firmware='MDAQ107-MAC') is v
+    assert velocity.axis(s, 0x401, firmware='MDAQ107-MAC') is not v
+    assert not v.flags.writeable
+    assert velocity.fingerprint(s) == velocity.fingerprint(np.array(w))
+
+
+def test_flat_wave():
+    with pytest.raises(ValueError):
+        velocity.axis('0800'*1024, 0x400, firmware='MDAQ107-MAC')
+
+
+def test_calibration():
+    w, s = _triangle()
+    x = velocity.axis(s, 0x3FFF)
+    channels = np.array([100.3, 400.7, 900.2, 1500.5])
+    lines = 8.1*np.interp(channels, np.arange(len(x)), x) - 0.2
+    c1, c0 = velocity.calibration(x, channels, lines)
+    assert (c1, c0) == (pytest.approx(8.1), pytest.approx(-0.2))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Velocity axis of MDAQ spectra, calculated from the reference wave.
+
+The drive follows the reference wave uploaded with setWave() scaled by the
+amplitude K. The velocity of channel i is then linear in the mean value of
+the wave over the samples that feed that channel (P samples when the step P
+is larger than one)::
+
+    x[i] = gain(K) * (wave[i] - center)/halfrange      (-1 <= x <= 1)
+    v[i] = c1 * x[i] + c0
+
+where (c1,c0) are the calibration constants (mm/s) obtained from a reference
+spectrum, for example alpha-Fe, with :func:`calibration`.
+
+The axis is cached: it is keyed on the wave fingerprint and the parameters,
+so calling :func:`axis` on every download of a running acquisition costs
+just the fingerprint of the wave string.
+
+    >>> v = velocity.axis(hw.getWave(), K=hw.HWPARS['K'], P=hw.HWPARS['P'],
+    ...                   U=hw.HWPARS['U'], firmware=hw.firmware,
+    ...                   calib=(c1,c0))
+
+Func:
+    velocity.axis
+    velocity.calibration
+    velocity.fingerprint
+    velocity.gain
+"""
+
+import hashlib
+
+import numpy as np
+
+from decode import hex2array
+
+# Amplitude DAC codes: (code for zero amplitude, code span to +max).
+AMPLITUDE = {'MDAQ107-MAC': (0x800, -0x800),   # [0000]=max+, [0FFF]=max-
+             'MDAQ209': (0x2000, 0x2000)}     # [0000]=max-, [3FFF]=max+
+
+_HEXDIGITS = np.frombuffer(b'0123456789ABCDEF', np.uint8)
+_CACHE = {}
+_CACHESIZE = 64
+
+
+def _wavearray(wave):
+    """ Wave as numpy array, from a getWave() string or a list of integers. """
+    if isinstance(wave, (str, bytes)):
+        return hex2array(wave, 4)
+    return np.asarray(wave).astype(np.uint32)
+
+
+def fingerprint(wave):
+    """ Short hash (12 hex digits) identifying a reference wave.
+
+    The same wave gives the same fingerprint as getWave() string, as list
+    of integers (hes2numlist) or as numpy array (the .wave files).
+    """
+    if isinstance(wave, (str, bytes)):
+        if isinstance(wave, str):
+            wave = wave.encode('ascii')
+        wave = wave.rstrip(b'\r\n').upper()
+        return hashlib.sha1(wave).hexdigest()[:12]
+    w = _wavearray(wave)
+    digits = (w[:, None] >> np.array([12, 8, 4, 0], np.uint32)) & 0xF
+    return fingerprint(_HEXDIGITS[digits].tobytes())
+
+
+def gain(K, firmware='MDAQ209'):
+    """ Relative amplitude (-1 to 1) corresponding to the amplitude code K. """
+    zero, span = AMPLITUDE[firmware]
+    return (K - zero)/float(span)
+
+
+def _axis(wave, K, P, firmware, calib):
+    w = _wavearray(wave).astype(float)
+    center = 0.5*(w.max() + w.min())
+    half = 0.5*(w.max() - w.min())
+    if half == 0:
+        raise ValueError('Flat wave: the velocity axis is undefined')
+    if P > 1:
+        # Channel i integrates samples i*P ... i*P+P-1 (the last channel
+        # gets the remainder when P does not divide the number of samples).
+        edges = np.arange(0, w.size, P)
+        w = np.add.reduceat(w, edges)/np.diff(np.append(edges, w.size))
+    x = gain(K, firmware)*(w - center)/half
+    v = calib[1] + calib[0]*x
+    v.setflags(write=False)
+    return v
+
+
+def axis(wave, K, P=1, U=None, calib=(1., 0.), firmware='MDAQ209'):
+    """ Velocity of each channel.
+
+    Args:
+        wave: the reference wave. String returned by Instrument.getWave() or
+            a list/array of integers (as saved in the .wave files).
+        K: amplitude code (HWPARS['K']).
+        P: step (HWPARS['P']). For mdaq107 leave it on 1.
+        U: time base (HWPARS['U']). It does not enter the formula, but the
+            response of the drive (and so the calibration) depends on the
+            frequency, so it is part of the cache key.
+        calib: (c1,c0) calibration constants, velocity = c1*x + c0. With the
+            default (1,0) the axis is the normalized amplitude x.
+        firmware: 'MDAQ209' or 'MDAQ107-MAC' (Instrument.firmware). Sets the
+            amplitude code convention.
+
+    Returns: a read only numpy array, one velocity per channel. Repeated
+        calls with the same wave and parameters return the same object.
+    """
+    key = (fingerprint(wave), K, P, U, tuple(calib), firmware)
+    v = _CACHE.get(key)
+    if v is None:
+        if len(_CACHE) >= _CACHESIZE:
+            _CACHE.pop(next(iter(_CACHE)))
+        v = _CACHE[key] = _axis(wave, K, P, firmware, calib)
+    return v
+
+
+def calibration(x, channels, velocities):
+    """ Calibration constants from the positions of known lines.
+
+    Args:
+        x: normalized axis, :func:`axis` called with calib=(1,0).
+        channels: fitted (non integer) positions of the reference lines
+            (for example the six alpha-Fe lines) in channels.
+        velocities: the known velocities of those lines (mm/s).
+
+    Returns: (c1,c0) for the calib argument of :func:`axis`.
+    """
+    xi = np.interp(channels, np.arange(len(x)), x)
+    c1, c0 = np.polyfit(xi, velocities, 1)
+    return float(c1), float(c0)
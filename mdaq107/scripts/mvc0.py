@@ -5,11 +5,12 @@
 """ 
 script to get CONSTANT VELOCITY spectrum with MDAQXXX (here 107)  
 
-Be sure thah on the same folder than this script file are the files
-mdaq.py and mvcdef0.w
-Be also sure mdaq.py correspond to this hardware.
+Be sure thah on the same folder than this script file is the file
+mvcdef0.w. mdaq.py (of this hardware, mdaq107/) and schedule.py,
+profiling.py (from common/) are found in the repository (see the sys.path
+setup below).
 
-python mvc0.py port fname ChTime ChStep
+python mvc0.py port fname ChTime ChStep [--profile [--profile-memory]]
 
     port:  (string) serial port. Example: \dev\ttyUSB0
     fname: (string) tag for output filename. Example: firstspectrum
@@ -20,12 +21,26 @@ python mvc0.py port fname ChTime ChStep
     sys.argv[2]: fname
     sys.argv[3]: Time at each channel.
     sys.argv[4]: Step between channesl.
+    --profile: time the commands and stages and sample the CPU; report on
+               profile_fname (see profiling.py).
+    --profile-memory: also trace the memory (slower).
 """
 
-import sys, time
+import sys, time, os
+# The driver (mdaq107/mdaq.py) and common/ of this repository; copies next
+# to this script still come first.
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[1:1] = [p for p in (os.path.normpath(os.path.join(_HERE,'..')),
+                 os.path.normpath(os.path.join(_HERE,'..','..','common')))
+                 if p not in sys.path]
 import mdaq as mdaq
+import schedule
+import profiling
 
 # getting input arguments
+PROFILE = '--profile' in sys.argv
+MEMORY = '--profile-memory' in sys.argv
+sys.argv = [a for a in sys.argv if a not in ('--profile','--profile-memory')]
 scriptname = sys.argv[0]
 port = sys.argv[1]
 name = sys.argv[2]
@@ -42,6 +57,11 @@ filename= time.strftime('%m-%d_%H:%M:%S_')+name
 
 # Initiatting hardware communication
 hw=mdaq.Instrument(port)
+if PROFILE:
+    prof = profiling.Profiler(memory=MEMORY)
+    profiling.instrument(hw,prof)
+else:
+    prof = profiling.Profiler(interval=None,memory=False)   # spans only, not reported
 hw.setWave(wave_string)
 hw.clear()
 
@@ -84,21 +104,41 @@ print('TIME BASE %d'%TB)
 NUMCICLOS = int(change_ratio*(40960./4400))
 # Seteamos ese numero de cíclos
 hw.setCycleNumber(NUMCICLOS)
+# Sleeps until the predicted end of each channel instead of polling M.
+sched = schedule.Completion(mdaq.frequency(TB))
 
 # Main loop. Catching ctrl+c to getting out.
 t_inicial=time.time()
+prof.start()
+nerr=0
 try:
     while 1:
-        hw.start()
-        while hw.getCycleNumber()!=NUMCICLOS:
-            # print hw.getCycleNumber()
-            time.sleep(0.01)
-        inpstr=hw.getCounters()
+        try:
+            # Clears and sets the channel on every pass, so after a
+            # protocol error the channel is measured again from zero.
+            hw.clear()
+            hw.setAmplitude(CHAN)
+            hw.start()
+            sched.start(NUMCICLOS)
+            with prof.span('stage:wait'):
+                sched.wait(hw)
+            with prof.span('stage:download'):
+                inpstr=hw.getCounters()
+        except mdaq._UnexpectedProtocol as e:
+            nerr += 1
+            print('Protocol error (%s): recovering'%e)
+            if nerr > 3:
+                raise
+            hw.recover()
+            fid.write('# Protocol error at %d s on chan %d: recovered\n'%(
+                      round(time.time()-t_inicial),CHAN))
+            continue
+        nerr=0
 
         # escribe a disco
-        fid.write('%d:%d:'%(round(time.time()-t_inicial),CHAN)+inpstr)
-        print('chan %d, counts %d'%(CHAN,int(inpstr[:4],16)))
-        hw.clear()      
+        with prof.span('stage:write'):
+            fid.write('%d:%d:'%(round(time.time()-t_inicial),CHAN)+inpstr)
+            print('chan %d, counts %d'%(CHAN,int(inpstr[:4],16)))
         # Setea nuevo canal:
         if P==1:
             if CHAN+PASO > 0xFFF:
@@ -111,13 +151,16 @@ try:
             else:
                 CHAN -= PASO
 
-        hw.setAmplitude(CHAN)        
-       
 except KeyboardInterrupt:
     print('\n Finalizando\n Guardando última línea')
     inpstr=hw.getCounters()
     fid.write('%d:'%round(time.time()-t_inicial)+inpstr)
 
+if PROFILE:
+    prof.stop()
+    prof.write('profile_'+filename)   # not fname.profile: it would look like a run
+    print(prof.report())
+
 print(' --------------------------------- The End  -------------------------------------')        
 
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf8
+
+"""
+Runs the acquisitions of a recipe file back to back on mdaq107 (see
+common/sequence.py for the recipe format).
+
+The module is reset and configured once; between steps only the parameters
+that change are sent (the wave only if it is another one). Each step is a
+spectrum107 run (same files: name.NN, .log, .counts, .state ...) that ends
+by its stop criterion. The progress goes to RECIPE.progress: after a crash
+or Ctrl + C, "--resume" goes on with the step that was running (the run
+itself is continued from its .state, see runstate.py) and the next ones.
+
+    python sequence107.py port recipe [--resume]
+
+The driver and common/ are found in the repository (see the sys.path
+setup below); macveiga1.wave is read from the working directory.
+
+19/10/2026
+Primera versión.
+"""
+__version__ = '.261019'
+
+import sys, time, argparse, datetime, os
+# The driver (mdaq107/mdaq.py) and common/ of this repository; copies next
+# to this script still come first.
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[1:1] = [p for p in (os.path.normpath(os.path.join(_HERE,'..')),
+                 os.path.normpath(os.path.join(_HERE,'..','..','common')))
+                 if p not in sys.path]
+import mdaq
+import runstate
+import sequence
+import spectrum107
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = 'Sequence of mdaq107 '+
+                                     'acquisitions from a recipe file.')
+    parser.add_argument('port',
+                     type = str,
+                     help = 'Serial port. For example /dev/ttyUSB0.')
+    parser.add_argument('recipe',
+                     type = str,
+                     help = 'Recipe file (see sequence.py).')
+    parser.add_argument('--resume',
+                     action = 'store_true',
+                     help = 'Continue the sequence from RECIPE.progress.')
+    args = parser.parse_args()
+
+    steps = sequence.load(args.recipe)
+    for step in steps:
+        if sequence.criterion(step) is None:
+            sys.exit('Step %s (line %d) has no stop criterion'%(step['name'],step['line']))
+        if 'N' not in step and 'T' not in step:
+            sys.exit('Step %s (line %d) has neither N nor T'%(step['name'],step['line']))
+        if 'P' in step:                                   # <<< HARDWARE-DEPENDENT-LINE >>>
+            sys.exit('mdaq107 has no step P (line %d)'%step['line'])
+
+    progname = args.recipe+'.progress'
+    if os.path.exists(progname) and not args.resume:
+        sys.exit('%s exists: use --resume, or remove it to start again'%progname)
+    prog = sequence.Progress(progname,steps)
+    if prog.finished:
+        sys.exit('The sequence %s is finished'%args.recipe)
+
+    hw = mdaq.Instrument(args.port)
+    hw.VERBOSE = False
+    if args.resume:
+        # Reattach: recover the framing and stop a counting left running.
+        hw.resync()
+        hw.stop()
+    else:
+        hw.reset()
+        time.sleep(0.8)
+    conf = sequence.Configurator(hw)
+
+    for k in range(prog.step,len(steps)):
+        step = steps[k]
+        U = step.get('U',conf.current.get('U'))
+        N = step.get('N')
+        if N is None:
+            N = int(round(step['T']*mdaq.frequency(U)))   # <<< HARDWARE-DEPENDENT-LINE >>>
+        tc = time.time()
+        sent = conf.apply(step,N)
+        print('================================================================')
+        print('Step %d/%d: %s (sent %s in %.2f s)'%(k+1,len(steps),step['name'],
+              ' '.join(sent) or 'nothing',time.time()-tc))
+
+        state = None
+        if prog.started and k == prog.step and k in prog.runs:
+            filename = prog.runs[k]
+            state = runstate.load(filename+'.state')
+            if state is not None and state.finished:
+                # Ended by its criterion just before the crash.
+                prog.done(k)
+                continue
+            if state is not None and (state.fingerprint !=
+                    spectrum107._fingerprint(hw,hw.getWave())):
+                state = None
+            if state is not None:
+                state.resumes += 1
+                with open(filename+'.log','a') as fid:
+                    fid.write('#Resumed after interval %d: %s \n'%(state.intervals,
+                              datetime.datetime.now().strftime("%b-%d-%Y %H:%M:%S")))
+                print('Resuming %s after interval %d'%(filename,state.intervals))
+        if state is None:
+            filename = spectrum107._safename(step['name'])
+            fid,state = spectrum107._newrun(hw,filename,N,script='sequence107.py')
+            fid.write('#Sequence: %s step %d (line %d)\n'%(args.recipe,k+1,step['line']))
+            fid.write('#Init time: %s \n'%(datetime.datetime.now().strftime("%b-%d-%Y %H:%M:%S")))
+            fid.close()
+        prog.start(k,filename)
+
+        DONE = spectrum107.espec0(hw,N,fout = filename,
+                                  criterion = sequence.criterion(step),
+                                  state = state)
+        if not DONE:
+            print('Sequence interrupted on step %d: continue with --resume'%(k+1))
+            break
+        prog.done(k)
+    else:
+        print('Sequence %s finished'%args.recipe)
@@ -3,6 +3,58 @@
 
 """
 
+19/10/2026
+Criterios de parada (stop.py, en common/): opciones --counts, --dip e
+--intervals. Con varios nombres de archivo los espectros se adquieren uno
+detrás del otro.
+Publicación del espectro en memoria compartida (--shm, common/livespec.py)
+para ver la medición desde otros procesos.
+Archivo comprimido con todos los intervalos (--archive, common/archive.py).
+Cada intervalo se escribe y se sincroniza (fsync) antes de guardar el estado;
+--resume no acepta --continuous.
+Al continuar una corrida (--resume) el último bloque del archivo comprimido,
+perdido en el corte, se rehace desde filename.
+Espera del fin del conteo por predicción (common/schedule.py) en lugar de
+preguntar M cada 10 ms.
+Contabilidad del tiempo muerto (common/duty.py): una fila por intervalo en
+filename.duty y el ciclo útil de la corrida al final del .log.
+Estado persistente de la corrida (filename.state, common/runstate.py): con
+--resume se continúa la misma corrida después de un corte sin resetear el
+módulo si mantiene la configuración.
+Modo continuo (--continuous, common/cumulative.py): el módulo cuenta sin
+parar ni borrar, los intervalos son diferencias de lecturas acumuladas.
+Con la tasa del primer intervalo se verifica que TIME no sea tan largo que un
+contador pueda dar dos vueltas (cumulative.maxinterval); no acepta --monitor.
+Índice de sumas acumuladas junto al archivo comprimido (filename.mdz.psum,
+common/prefix.py): espectro de cualquier ventana de tiempo con una resta.
+Suma alineada por deriva (--align, common/align.py): filename.aligned y el
+corrimiento de cada intervalo en filename.shifts.
+Control de calidad de cada intervalo (--screen, common/quality.py): los
+intervalos con ruido o fallas del transductor van a filename.rejected.
+Tablero web local (--http PORT, common/dashboard.py): espectro, tasa y
+ciclos en el navegador, servido por un proceso aparte que lee la memoria
+compartida.
+Encabezado de una corrida nueva en _newrun, usado también por
+sequence107.py (secuencias de mediciones desde una receta).
+Perfil de la corrida (--profile, common/profiling.py): tiempos de cada
+comando y etapa y muestreo de CPU en filename.profile (y memoria con
+--profile-memory).
+El driver (../mdaq.py) y los módulos de common/ se buscan en el repositorio
+(sys.path al comienzo del script): no hace falta copiarlos junto al script.
+Monitor de tasa durante el conteo (--monitor SEGUNDOS, common/ratemeter.py):
+pregunta M mientras espera el fin del conteo y corta la corrida si el
+contador de ciclos se detiene (el mdaq107 no tiene el comando m, así que
+no hay tasa en la ventana).
+Ajuste durante la medición (--fit MODELO, common/fit.py): el espectro
+acumulado se ajusta en un hilo aparte después de cada intervalo y el último
+resultado queda en filename.fit; velocidades en mm/s con --calib C1,C0
+(common/velocity.py).
+Criterio de parada por el error de un parámetro del ajuste (--fit-error
+NOMBRE:ERROR, con --fit). Con varios nombres de archivo, --next COMANDO se
+ejecuta antes de cada corrida siguiente (por ejemplo para pasar a la
+próxima muestra); para cambiar la configuración entre corridas ver
+sequence107.py.
+
 05/11/2014 
 Agrego el registro de la fecha y hora en el archivo log.
 
@@ -11,11 +63,31 @@ Start adaptation of spectrum.py(ver.140422)@mdaq208 to the mdaq107 package.
 Elimino funcion auxiliar de ploteo y la importacion de matplotlib.
 Elimino la entrada -step cuando corre como funcion __main__
 """
-__version__ = '.141105'
+__version__ = '.261019'
 
 import numpy as np
-import sys, glob, time, argparse, os, datetime
+import sys, glob, time, argparse, os, datetime, subprocess, atexit
+# The driver (mdaq107/mdaq.py) and common/ of this repository; copies next
+# to this script still come first.
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[1:1] = [p for p in (os.path.normpath(os.path.join(_HERE,'..')),
+                 os.path.normpath(os.path.join(_HERE,'..','..','common')))
+                 if p not in sys.path]
 import mdaq
+import stop
+import livespec
+import archive
+import schedule
+import duty
+import runstate
+import decode
+import cumulative
+import align
+import quality
+import profiling
+import ratemeter
+import fit
+import velocity
 
 
 # Reads the ASCII string with the smoothed-triangular wave from
@@ -25,68 +97,415 @@ with open('macveiga1.wave','r') as fid:
 
 
 
-def espec0(hw,N,fout='noname.niente'):
+def espec0(hw,N,fout='noname.niente',criterion=None,publisher=None,archive=None,
+           state=None,aligner=None,screen=None,profiler=None,monitor=None,
+           fitter=None):
     """ Adquire spectrum in Constant-Aceleration-Mode, using the Veiga's 
         smooth-ended-reference wave.
 
     Args:
         hw: instance of mdaq107.Instrument. 
         N:  mdaq107 Cycles per file download.
-        fout: name (char-string) of the output file."""
+        fout: name (char-string) of the output file.
+        criterion: None or a stop criterion (see stop.py). If given, the
+            acquisition ends when the accumulated spectrum reaches it.
+        publisher: None or a livespec.Publisher where each interval is
+            published for viewer processes.
+        archive: None or an archive.Writer where every interval is stored.
+        state: None or a runstate.State, committed after every interval. If
+            it already has intervals the run is continued (resume).
+        aligner: None or an align.Aligner. Each interval is aligned: the
+            aligned sum goes to fout.aligned and the shifts to fout.shifts.
+        screen: None or a quality.Screen. Intervals it rejects are not
+            summed: they go to fout.rejected.
+        profiler: None or a profiling.Profiler, where the stages of the
+            loop are also timed.
+        monitor: None or a ratemeter.Monitor, sampling the module while it
+            counts. A fault ends the run (the interval is lost).
+        fitter: None or a fit.Worker. The accumulated spectrum is handed to
+            it after every interval (the loop never waits for the fit) and
+            its last result goes to fout.fit.
+
+    Returns: True if the criterion was reached, False if ended by user
+        or by a fault."""
 
     hw.VERBOSE = False
 
     COUNTS = np.zeros(1024)                # <<< HARDWARE-DEPENDENT-LINE >>>
-    print(hw.getStatus())                  # <<< HARDWARE-DEPENDENT-LINE >>>
-
+    status = hw.getStatus()
+    print(status)                          # <<< HARDWARE-DEPENDENT-LINE >>>
+    U = int(status.split()[4],16)          # <<< HARDWARE-DEPENDENT-LINE >>>
+    sched = schedule.Completion(mdaq.frequency(U))
     i = 0
     t0 = time.time()
+    if state is not None and state.intervals > 0:
+        # Resume: drop what was written after the last commit and go on
+        # with the same totals and time origin.
+        i, t0 = state.intervals, state.t0
+        COUNTS += state.totals
+        if os.path.getsize(fout) < state.size:
+            # truncate would pad with NUL bytes: committed intervals are lost.
+            raise RuntimeError('%s has %d bytes, the run committed %d'%(
+                               fout,os.path.getsize(fout),state.size))
+        with open(fout,'r+') as fid:
+            fid.truncate(state.size)
+        if criterion is not None or aligner is not None or screen is not None:
+            _replay(fout,criterion,aligner,screen)
+        if archive is not None and archive.count < i:
+            # Intervals still buffered in the archive when the run was cut.
+            _rearchive(archive,fout)
+        if archive is not None and archive.count != i:
+            raise RuntimeError('The archive has %d intervals, the run %d'%(
+                               archive.count,i))
+    elif state is not None:
+        state.t0 = t0
+    led = duty.Ledger(fout+'.duty',append=i>0,profiler=profiler)
+    DONE = False
+    nerr = 0
     try:
         MUSTSAVE = False
-        while 1:
-            hw.clear(soft=True)
-            hw.setCycleNumber(N)
-            
-            # MDAQXXX Start to adquiring and timing control
-            ti1 = time.time()            
-            hw.start()                     
-            ti2 = time.time()
+        while not DONE:
+            try:
+                tc = time.time()
+                hw.clear(soft=True)
+                hw.setCycleNumber(N)
+
+                # MDAQXXX Start to adquiring and timing control
+                ti1 = time.time()
+                hw.start()
+                ti2 = time.time()
+            except mdaq._UnexpectedProtocol as e:
+                # The pending interval (MUSTSAVE) is saved on the next pass.
+                nerr = _recover(hw,fout,e,nerr)
+                continue
+            led.add('setup',ti2-tc)
+            sched.start(N,(ti1+ti2)*0.5)
             ti = (ti1+ti2)*0.5 -t0
             
-            # Waits while MDAQ is counting. In the menwhiles update files and arrays. 
-            while hw.getCycleNumber() != N:
-                if MUSTSAVE:
-                    WrtStr = '%6d %s'%(tflast,COUNTstr)
-                    COUNTSnow = np.array(mdaq.hes2numlist(COUNTstr[:-2],4))  # [:-2] to remove TERMINATOR 
-                    COUNTS += COUNTSnow
-            
-                    # New output file proposal (July 2022) --------          
-                    COUNTStr2 = ' '.join(['%x'%k for k in COUNTSnow])
-                    WrtStr2 = '%.2f %.2f %.2f:'%(tilast,tflast,tflast-tilast) + COUNTStr2 + '\n'
-                    with open(fout,'a') as fid:
-                        fid = open(fout,'a')
-                        fid.write(WrtStr2)
+            # While MDAQ is counting update files and arrays, then sleep
+            # until the predicted end of the counting (see schedule.py).
+            if MUSTSAVE:
+                tp = time.time()
+                WrtStr = '%6d %s'%(tflast,COUNTstr)
+                COUNTSnow = np.array(mdaq.hes2numlist(COUNTstr[:-2],4))  # [:-2] to remove TERMINATOR 
+                if screen is not None and not screen.update(COUNTSnow):
+                    # Garbage interval (noise burst, drive glitch): not summed.
+                    screen.quarantine(fout+'.rejected',COUNTSnow,tilast,tflast)
+                    print('%6d interval rejected (chi2/n %.2f)'%(tflast,screen.last[0]))
+                    led.add('parse',time.time()-tp)
+                    MUSTSAVE = False
+            if MUSTSAVE:
+                COUNTS += COUNTSnow
+                tw = time.time()
+                led.add('parse',tw-tp)
         
+                # New output file proposal (July 2022) --------          
+                COUNTStr2 = ' '.join(['%x'%k for k in COUNTSnow])
+                WrtStr2 = '%.2f %.2f %.2f:'%(tilast,tflast,tflast-tilast) + COUNTStr2 + '\n'
+                with open(fout,'a') as fid:
+                    fid.write(WrtStr2)
+                    fid.flush()
+                    os.fsync(fid.fileno())
+                    size = fid.tell()
+    
 
-                    print('%6d %d'%(tflast,sum(COUNTSnow)),'(ctrl + C to abort)')
-                    sys.stdout.flush()
-        
-                    np.savetxt(fout+'.counts',COUNTS,fmt='%d')
-                    MUSTSAVE = False
-                time.sleep(0.01)
+                print('%6d %d'%(tflast,sum(COUNTSnow)),'(ctrl + C to abort)')
+                sys.stdout.flush()
+    
+                np.savetxt(fout+'.counts',COUNTS,fmt='%d')
+                if fitter is not None:
+                    _fit(fitter,fout,COUNTS)
+                MUSTSAVE = False
+                i += 1
+
+                if publisher is not None:
+                    publisher.publish(COUNTS,COUNTSnow,i*N,tilast,tflast)
+                if aligner is not None:
+                    _align(aligner,fout,COUNTSnow,tilast,tflast)
+                if state is not None:
+                    state.commit(i,COUNTS,tilast,tflast,size)
+                # After the commit: on resume the archive is never ahead of
+                # the run, the missing tail is rebuilt from fout.
+                if archive is not None:
+                    archive.write(COUNTSnow,tilast,tflast)
+                led.add('write',time.time()-tw)
+
+                if criterion is not None and criterion.update(COUNTSnow,COUNTS):
+                    # The interval being counted now is discarded.
+                    hw.stop()
+                    DONE = True
+                    if state is not None:
+                        state.finish()
+                    break
+
+            try:
+                sched.wait(hw,monitor=monitor)
+                led.counting(sched.t0,sched.end(),(ti2-ti1)*0.5)
+                led.add('overshoot',sched.tconfirm-sched.end())
+
+                tf = time.time() - t0
+                tilast = ti
+                tflast = tf
+                with led.stage('download'):
+                    COUNTstr = hw.getCounters()
+            except mdaq._UnexpectedProtocol as e:
+                # The interval being counted is lost.
+                nerr = _recover(hw,fout,e,nerr)
+                continue
+            MUSTSAVE = True
+            nerr = 0
 
 
-            tf = time.time() - t0
-            tilast = ti
-            tflast = tf
-            COUNTstr = hw.getCounters()
-            MUSTSAVE = True
+    except KeyboardInterrupt:
+        print('\n Ended by user.')
+    except ratemeter.Fault as e:
+        print('\n Ended by fault (%s): %s'%(e.kind,e))
+    finally:
+        # Duty cycle of the run: rows on fout.duty, summary on fout.log
+        led.close()
+        report = led.report()
+        if monitor is not None:
+            report += '\n' + monitor.report()
+        with open(fout+'.log','a') as fid:
+            fid.write(''.join('#%s\n'%line for line in report.split('\n')))
+        print(report)
+
+    if fitter is not None:
+        _savefit(fitter,fout,wait=True)
+    if criterion is not None:
+        print(criterion.report())
+    return DONE
+
+def espec1(hw,T,fout='noname.niente',criterion=None,publisher=None,archive=None,
+           aligner=None,screen=None,profiler=None,fitter=None):
+    """ Adquire spectrum in Constant-Aceleration-Mode without stopping the
+        module between downloads (continuous mode).
+
+    The module counts from a single START with N = 0 and is never cleared.
+    Every T seconds the cycle counter and the cumulative counters are read
+    and the interval is the difference with the previous reading (see
+    cumulative.py), so there is no dead time between intervals. The
+    interval boundaries are the M readings; the counters are read just
+    after it, so a few counts may move to the next interval, but none is
+    lost.
+
+    Args:
+        hw: instance of mdaq107.Instrument. 
+        T:  seconds between downloads.
+        fout, criterion, publisher, archive, aligner, screen, profiler,
+            fitter: as in espec0
+            (the screen exposure is the number of cycles of each interval).
+
+    Returns: True if the criterion was reached, False if ended by user.
+
+    Raises: RuntimeError if, at the rate of the first interval, T is too long
+        to tell the roll overs of the counters (cumulative.maxinterval)."""
 
+    hw.VERBOSE = False
+
+    COUNTS = np.zeros(1024)                # <<< HARDWARE-DEPENDENT-LINE >>>
+    print(hw.getStatus())                  # <<< HARDWARE-DEPENDENT-LINE >>>
+    dif = cumulative.Differ(1024,bits=16)  # <<< HARDWARE-DEPENDENT-LINE >>> (Y: 4 hex digits)
+    led = duty.Ledger(fout+'.duty',profiler=profiler)
+
+    DONE = False
+    nerr = 0
+    tmax = None
+    hw.clear(soft=True)
+    hw.setCycleNumber(0)                   # counts without end
+    ti1 = time.time()
+    hw.start()
+    ti2 = time.time()
+    t0 = tlast = (ti1+ti2)*0.5
+    dif.reset(np.zeros(1024),0)            # <<< HARDWARE-DEPENDENT-LINE >>>
+    try:
+        while not DONE:
+            # T after the last reading, whether its interval was written,
+            # rejected by the screen or lost to a protocol error.
+            time.sleep(max(tlast + T - time.time(),0))
+            try:
+                ta = time.time()
+                M = hw.getCycleNumber()
+                tb = time.time()
+                COUNTstr = hw.getCounters()
+            except mdaq._UnexpectedProtocol as e:
+                # Counting again from a new reading: the counts since the
+                # last one are lost.
+                while True:
+                    nerr = _recover(hw,fout,e,nerr,restart=True)
+                    try:
+                        tlast = time.time()
+                        dif.reset(decode.hex2array(hw.getCounters(),4),hw.getCycleNumber())
+                        break
+                    except mdaq._UnexpectedProtocol as e2:
+                        e = e2
+                continue
+            nerr = 0
+            tnow = (ta+tb)*0.5
+            led.counting(tlast,tnow,(tb-ta)*0.5)
+
+            tp = time.time()
+            COUNTSnow, cycles = dif.update(decode.hex2array(COUNTstr,4),M)
+            tilast, tflast = tlast-t0, tnow-t0
+            tlast = tnow
+            if tmax is None and COUNTSnow.sum() > 0:
+                # Longer than tmax a counter may roll over twice unseen.
+                tmax = cumulative.maxinterval(COUNTSnow.sum()/(tflast-tilast),
+                                              1024,16)  # <<< HARDWARE-DEPENDENT-LINE >>>
+                if T > tmax:
+                    raise RuntimeError('At %.0f counts/s the interval must be '
+                                       'shorter than %.1f s (TIME is %.1f s)'%(
+                                       COUNTSnow.sum()/(tflast-tilast),tmax,T))
+            if screen is not None and not screen.update(COUNTSnow,max(cycles,1)):
+                screen.quarantine(fout+'.rejected',COUNTSnow,tilast,tflast)
+                print('%6d interval rejected (chi2/n %.2f)'%(tflast,screen.last[0]))
+                led.add('parse',time.time()-tp)
+                continue
+            COUNTS += COUNTSnow
+            tw = time.time()
+            led.add('parse',tw-tp)
+
+            with open(fout,'a') as fid:
+                fid.write('%.2f %.2f %.2f:'%(tilast,tflast,tflast-tilast) +
+                          ' '.join(['%x'%k for k in COUNTSnow]) + '\n')
+            print('%6d %d'%(tflast,COUNTSnow.sum()),'(ctrl + C to abort)')
+            sys.stdout.flush()
+            np.savetxt(fout+'.counts',COUNTS,fmt='%d')
+            if fitter is not None:
+                _fit(fitter,fout,COUNTS)
+
+            if publisher is not None:
+                publisher.publish(COUNTS,COUNTSnow,dif.cycles,tilast,tflast)
+            if archive is not None:
+                archive.write(COUNTSnow,tilast,tflast)
+            if aligner is not None:
+                _align(aligner,fout,COUNTSnow,tilast,tflast)
+            led.add('write',time.time()-tw)
+
+            if criterion is not None and criterion.update(COUNTSnow,COUNTS):
+                DONE = True
 
     except KeyboardInterrupt:
         print('\n Ended by user.')
+    finally:
+        hw.stop()
+        led.close()
+        with open(fout+'.log','a') as fid:
+            fid.write(''.join('#%s\n'%line for line in led.report().split('\n')))
+        print(led.report())
+
+    if fitter is not None:
+        _savefit(fitter,fout,wait=True)
+    if criterion is not None:
+        print(criterion.report())
+    return DONE
 
 # FUNCIONE/S AUXILIARES
+MAXERRORS = 3       # protocol errors in a row before giving up the run
+
+def _recover(hw,fout,error,nerr,restart=False):
+    """ Recover the framing after a protocol error without resetting the
+    module (see mdaqcore.Instrument.recover) and note it on fout.log.
+
+    Returns: nerr + 1, the number of errors in a row. The error is raised
+        again after MAXERRORS in a row (or if the module does not answer).
+    """
+    nerr += 1
+    print('Protocol error (%s): recovering'%error)
+    if nerr > MAXERRORS:
+        raise error
+    fixed = hw.recover(restart=restart)
+    with open(fout+'.log','a') as fid:
+        fid.write('#Protocol error at %s: %s. Recovered, re-applied: %s\n'%(
+                  datetime.datetime.now().strftime("%b-%d-%Y %H:%M:%S"),error,
+                  ' '.join(fixed) or 'none'))
+    return nerr
+
+def _replay(fout,criterion,aligner=None,screen=None):
+    """ Feed the criterion, the aligner and the quality screen with the
+    intervals already written on fout, to resume a run with them in the
+    same state. """
+    total = np.zeros(1024)                 # <<< HARDWARE-DEPENDENT-LINE >>>
+    times = []
+    with open(fout) as fid:
+        for line in fid:
+            t, data = line.split(':',1)
+            c = decode.hexws2array(data)
+            total += c
+            if criterion is not None:
+                criterion.update(c,total)
+            if aligner is not None:
+                aligner.update(c)
+                times.append(t.split()[:2])
+            if screen is not None:
+                screen.update(c)
+    if aligner is not None:
+        with open(fout+'.shifts','w') as fid:
+            for (ti,tf),shift in zip(times,aligner.shifts):
+                fid.write('%s %s %.4f\n'%(ti,tf,shift))
+
+def _rearchive(archive,fout):
+    """ Append to the archive the intervals of fout it is missing (the ones
+    of its last, unwritten, block when the run was cut). """
+    with open(fout) as fid:
+        for k,line in enumerate(fid):
+            if k < archive.count:
+                continue
+            t, data = line.split(':',1)
+            ti, tf = t.split()[:2]
+            archive.write(decode.hexws2array(data),float(ti),float(tf))
+    archive.flush()
+
+def _align(aligner,fout,interval,ti,tf):
+    """ Align the interval (see align.py), save the aligned sum and append
+    the shift to fout.shifts. """
+    shift = aligner.update(interval)
+    np.savetxt(fout+'.aligned',aligner.total,fmt='%.2f')
+    with open(fout+'.shifts','a') as fid:
+        fid.write('%.2f %.2f %.4f\n'%(ti,tf,shift))
+
+def _fit(fitter,fout,COUNTS):
+    """ Hand the accumulated spectrum to the fit worker and save its last
+    result (the fit of a previous interval while this one is fitted). """
+    fitter.submit(COUNTS)
+    _savefit(fitter,fout)
+
+def _savefit(fitter,fout,wait=False):
+    """ Write the last result of the fit worker on fout.fit (replaced
+    atomically, for the viewers). With wait, the fit of the last spectrum
+    is waited for first. """
+    res = fitter.wait(10.) if wait else fitter.result
+    if res is None:
+        return
+    with open(fout+'.fit.tmp','w') as fid:
+        fid.write('#fit %d, chi2/n %.3f, %d iterations, %.1f ms\n'%(
+                  fitter.nfits,res['chi2'],res['niter'],1e3*res['time']))
+        for name,p,dp in zip(res['names'],res['p'],res['dp']):
+            fid.write('%-16s %14.6g %12.3g\n'%(name,p,dp))
+    os.replace(fout+'.fit.tmp',fout+'.fit')
+
+def _fingerprint(hw,wave):
+    """ Fingerprint of the configuration of the module: the wave and the
+    K, Q, O and U parameters (see runstate.py). """
+    status = hw.getStatus().split()        # <<< HARDWARE-DEPENDENT-LINE >>>
+    return runstate.fingerprint(wave,status[0],status[1],status[3],status[4])
+
+def _newrun(hw,filename,N,script='spectrum107.py'):
+    """ Save the wave and start the .log of a new run.
+
+    Returns: (fid, state): the .log file, open to go on writing the
+        header, and the runstate.State of the run. """
+    y_wa = hw.getWave()
+    np.savetxt(filename+'.wave', mdaq.hes2numlist(y_wa,4), fmt = '%d')    
+
+    fid = open(filename+'.log','w')
+    fid.write('#Hardware mdaq107, script %s (ver %s)\n'%(script,__version__))
+    fid.write('#Veiga´s MAC wave (smooth triangular)\n')
+    fid.write('#Status: KKKK QQQQ NNNN OOOO UUUU\n')
+    fid.write('#Status: ' + hw.getStatus() + '\n')
+    fid.write('#Init date: %s \n'%(datetime.datetime.now().strftime("%I:%M%p %B %d, %Y")))
+    return fid,runstate.State(filename+'.state',_fingerprint(hw,y_wa),N)
+
 def _safename(name):
     """ This auxiliar function assure not to overwrite another file with the same name.
  		
@@ -130,8 +549,11 @@ if __name__ == "__main__":
 
     parser.add_argument('filename',
                      type = str, 
+                     nargs = '+',
                      help = 'Root name of the output spectrum files: filename.counts, '+
-                            'filename.wave, filename.mdaqb')
+                            'filename.wave, filename.mdaqb. With several names '+
+                            'and a stop criterion the spectra are acquired one '+
+                            'after the other.')
 
     parser.add_argument('-p','--port',
                      type = str, 
@@ -154,61 +576,332 @@ if __name__ == "__main__":
                      default = 0x1000, 
                      help = 'mdaq107 U parameter (Time Base parameter).')
 
+    parser.add_argument('--counts',
+                     type = float, 
+                     default = None, 
+                     help = 'Stop when the baseline reaches COUNTS counts per channel.')
+
+    parser.add_argument('--dip',
+                     type = float, 
+                     default = None, 
+                     help = 'Stop when the relative error of the absorption area '+
+                            'is below DIP (0.01 means 1%%).')
+
+    parser.add_argument('--intervals',
+                     type = int, 
+                     default = None, 
+                     help = 'Stop after INTERVALS downloads.')
+
+    parser.add_argument('--shm',
+                     type = str, 
+                     default = None, 
+                     metavar = 'NAME',
+                     help = 'Publish the live spectrum on the shared memory segment '+
+                            'NAME (see livespec.py).')
+
+    parser.add_argument('--http',
+                     type = int, 
+                     default = None, 
+                     metavar = 'PORT',
+                     help = 'Show the live spectrum on http://localhost:PORT/ '+
+                            '(see dashboard.py). Publishes on the segment of '+
+                            '--shm, or "mdaq107" if not given.')
+
+    parser.add_argument('--profile',
+                     action = 'store_true',
+                     help = 'Time every command, serial transfer and stage of '+
+                            'the loop and sample the CPU; report on '+
+                            'filename.profile (see profiling.py).')
+
+    parser.add_argument('--profile-memory',
+                     action = 'store_true',
+                     help = 'With --profile, also trace the memory (slows down '+
+                            'the parsing and writing of the intervals).')
+
+    parser.add_argument('--monitor',
+                     type = float,
+                     default = None,
+                     metavar = 'SECONDS',
+                     help = 'Ask the cycle counter every SECONDS while the '+
+                            'module counts and end the run if it stalls '+
+                            '(see ratemeter.py). Not with --continuous.')
+
+    parser.add_argument('--continuous',
+                     action = 'store_true',
+                     help = 'Never stop nor clear the module: the intervals are '+
+                            'differences of cumulative readings every TIME '+
+                            'seconds (no dead time, see cumulative.py). Not '+
+                            'resumable.')
+
+    parser.add_argument('--align',
+                     action = 'store_true',
+                     help = 'Also keep the drift-aligned sum filename.aligned and '+
+                            'the shift of each interval, filename.shifts (see '+
+                            'align.py).')
+
+    parser.add_argument('--screen',
+                     type = float, 
+                     default = None, 
+                     metavar = 'SIGMAS',
+                     help = 'Do not sum the intervals whose chi-square against '+
+                            'the previous ones deviates more than SIGMAS (6 is '+
+                            'a good value); they go to filename.rejected (see '+
+                            'quality.py).')
+
+    parser.add_argument('--resume',
+                     action = 'store_true',
+                     help = 'Continue the run FILENAME (with its .NN) from '+
+                            'FILENAME.state after a crash or a reboot. The '+
+                            'module is not reset if it keeps the configuration '+
+                            'of the run.')
+
+    parser.add_argument('--archive',
+                     action = 'store_true',
+                     help = 'Keep every interval on the compressed archive '+
+                            'filename.mdz (see archive.py) and its prefix-sum '+
+                            'index filename.mdz.psum (see prefix.py).')
+
+    parser.add_argument('--fit',
+                     type = str,
+                     default = None,
+                     metavar = 'MODEL',
+                     help = 'Fit the accumulated spectrum after every interval, '+
+                            'on a separate thread, with the components MODEL, '+
+                            'for example "sextet(B=33)+doublet(q=0.6)"; the last '+
+                            'result goes to filename.fit (see fit.py).')
+
+    parser.add_argument('--calib',
+                     type = str,
+                     default = None,
+                     metavar = 'C1,C0',
+                     help = 'Velocity calibration (mm/s) of the --fit axis, '+
+                            'velocity = C1*x + C0 with x the normalized '+
+                            'amplitude of the wave (see velocity.py). Without '+
+                            'it the positions are in units of x.')
+
+    parser.add_argument('--fit-error',
+                     type = str,
+                     default = None,
+                     metavar = 'NAME:ERROR',
+                     help = 'With --fit, stop when the relative error of the '+
+                            'fitted parameter NAME is below ERROR, for example '+
+                            'sextet0.B:0.001 (names as in filename.fit).')
+
+    parser.add_argument('--next',
+                     type = str,
+                     default = None,
+                     metavar = 'COMMAND',
+                     help = 'With several file names, run COMMAND (with the '+
+                            'name of the next run as argument) before each run '+
+                            'after the first, for example to move a sample '+
+                            'changer to the next sample. A failing COMMAND ends '+
+                            'the chain. To change the settings of the module '+
+                            'between runs see sequence107.py.')
+
     args = parser.parse_args()
+    if args.fit is not None:
+        try:
+            components = fit.parse(args.fit)
+        except ValueError as e:
+            sys.exit('--fit: %s'%e)
+    if args.calib is not None:
+        try:
+            calib = tuple(float(c) for c in args.calib.split(','))
+        except ValueError:
+            calib = ()
+        if len(calib) != 2:
+            sys.exit('--calib takes two numbers, C1,C0')
+    else:
+        calib = (1.,0.)
+    if args.fit_error is not None:
+        if args.fit is None:
+            sys.exit('--fit-error needs the fit of --fit')
+        par, _, target = args.fit_error.rpartition(':')
+        names = fit.Model(components).names
+        if par not in names:
+            sys.exit('--fit-error: no parameter "%s" in the fit (%s)'%(par,
+                     ' '.join(names)))
+        try:
+            target = float(target)
+        except ValueError:
+            sys.exit('--fit-error takes NAME:ERROR, for example sextet0.B:0.001')
+    if args.next is not None and args.counts is None and args.dip is None \
+            and args.intervals is None and args.fit_error is None:
+        sys.exit('--next needs a stop criterion to end each run')
+    if args.resume and args.continuous:
+        sys.exit('--continuous runs are not resumable (see --resume)')
+    if args.monitor is not None and args.continuous:
+        sys.exit('--monitor samples the module while it counts a fixed N, '+
+                 'not with --continuous')
 
 
     port = args.port          
-    filename = args.filename   
+    if args.http is not None and args.shm is None:
+        args.shm = 'mdaq107'
+    filenames = args.filename   
     U = args.timebase
     #P = args.step  
     T = args.time  
     #N = mdaq.time2N(T,P,U)        # <<< HARDWARE-DEPENDENT-LINE >>>
-    N = int(round(T*41.78e6/1024/U))
+    N = int(round(T*mdaq.frequency(U)))   # see also planner.py to choose U and N
+
+    def criterion(worker=None):
+        """ New stop criterion (fresh state for each run) from the arguments.
+        worker is the fit.Worker of the run (for --fit-error). """
+        crits = []
+        if args.counts is not None:
+            crits.append(stop.BaselineCounts(args.counts))
+        if args.dip is not None:
+            crits.append(stop.DipError(args.dip))
+        if args.intervals is not None:
+            crits.append(stop.MaxIntervals(args.intervals))
+        if args.fit_error is not None:
+            crits.append(stop.ParameterError(worker,par,target))
+        if len(crits) == 0:
+            return None
+        return stop.Any(*crits)
 
     # FIN ENTRADA DE ARGUMENTOS ------------------------------------------------
     # --------------------------------------------------------------------------
 
     #print port,filename,U,P,T,N
-    print(port,filename,U,T,N)
+    print(port,filenames,U,T,N)
      
     hw = mdaq.Instrument(port)
+    if args.profile:
+        prof = profiling.Profiler(memory = args.profile_memory)
+        profiling.instrument(hw,prof)
+    else:
+        prof = None
+
+    resume = None
+    same = False
+    if args.resume:
+        resume = runstate.load(filenames[0]+'.state')
+        if resume is None or resume.finished:
+            sys.exit('No unfinished run to resume on %s.state'%filenames[0])
+        N = resume.N
+        # Reattach: recover the framing and compare the configuration.
+        try:
+            hw.resync()
+            hw.stop()
+            same = _fingerprint(hw,hw.getWave()) == resume.fingerprint
+        except mdaq._UnexpectedProtocol:
+            same = False
+        print('Resuming %s after interval %d (%s)'%(filenames[0],resume.intervals,
+              'same configuration' if same else 'reconfiguring the module'))
+
+    if not same:
+        hw.reset()
+        time.sleep(0.8)
+
+        hw.setWave(ONDAMAC)
+        #hw.selectWave('PROG')         # <<< HARDWARE-DEPENDENT-LINE >>>
+        hw.setTimeBase(U)
+        hw.setAmplitude(0x400)
+        hw.setCycleNumber(N) 
+
+        if resume is not None and _fingerprint(hw,hw.getWave()) != resume.fingerprint:
+            sys.exit('The configuration (wave, --timebase) is not the one of '+
+                     'the run %s'%filenames[0])
+
+    if args.fit is not None:
+        K = int(hw.getStatus().split()[0],16)   # <<< HARDWARE-DEPENDENT-LINE >>>
+        vaxis = velocity.axis(hw.getWave(),K,U=U,calib=calib,firmware='MDAQ107-MAC')
+
+    if args.http is not None:
+        # Separate process: the viewers cost nothing to the acquisition.
+        import dashboard
+        web = subprocess.Popen([sys.executable,dashboard.__file__,args.shm,
+                                '--port',str(args.http)])
+        atexit.register(web.terminate)
+        print('Live spectrum on http://localhost:%d/'%args.http)
+
+    if resume is None:
+        input('Presione una tecla para comenzar a medir')
+
+    for n,filename in enumerate(filenames):
+        if n > 0 and args.next is not None:
+            print('Before %s: %s'%(filename,args.next))
+            ret = subprocess.call('%s %s'%(args.next,filename),shell=True)
+            if ret != 0:
+                print('"%s" failed (exit %d): the chain ends here'%(args.next,ret))
+                break
+        if args.fit is not None:
+            # A new one for each run: no warm start from another spectrum.
+            fw = fit.Worker(fit.Fitter(fit.Model(components),vaxis))
+        else:
+            fw = None
+        if resume is not None:
+            state, resume = resume, None
+            state.resumes += 1
+            fid = open(filename+'.log','a')
+            fid.write('#Resumed after interval %d: %s \n'%(state.intervals,
+                      datetime.datetime.now().strftime("%b-%d-%Y %H:%M:%S")))
+            crit = criterion(fw)
+        else:
+            filename = _safename(filename)
+            fid,state = _newrun(hw,filename,N)
+            crit = criterion(fw)
+
+        print('--------------------------------------------------------------------------------')
+        print('%s running'%__file__)
+        print('Port: %s'%port)
+        print('Output file: %s'%filename)
+        print('time step %d seconds:'%T)
+        if crit is not None:
+            print('Stop criterion:\n' + crit.report())
+        print('\n Ctrl + C to stop and quit')
+        print('--------------------------------------------------------------------------------')
  
-    hw.reset()
-    time.sleep(0.8)
-
-    hw.setWave(ONDAMAC)
-    #hw.selectWave('PROG')         # <<< HARDWARE-DEPENDENT-LINE >>>
-    hw.setTimeBase(U)
-    hw.setAmplitude(0x400)
-    hw.setCycleNumber(N) 
-
-    filename = _safename(filename)
-
-    y_wa = hw.getWave()
-    np.savetxt(filename+'.wave', mdaq.hes2numlist(y_wa,4), fmt = '%d')    
-
-    input('Presione una tecla para comenzar a medir')
-
-    fid = open(filename+'.log','w')
-    fid.write('#Hardware mdaq107, script spectrum107.py (ver %s)\n'%__version__)
-    fid.write('#Veiga´s MAC wave (smooth triangular)\n')
-    fid.write('#Status: KKKK QQQQ NNNN OOOO UUUU\n')
-    fid.write('#Status: ' + hw.getStatus() + '\n')
-    fid.write('#Init date: %s \n'%(datetime.datetime.now().strftime("%I:%M%p %B %d, %Y")))
-
-
-    print('--------------------------------------------------------------------------------')
-    print('%s running'%__file__)
-    print('Port: %s'%port)
-    print('Output file: %s'%filename)
-    print('time step %d seconds:'%T)
-    print('\n Ctrl + C to stop and quit')
-    print('--------------------------------------------------------------------------------')
- 
-    fid.write('#Init time: %s \n'%(datetime.datetime.now().strftime("%b-%d-%Y %H:%M:%S")))
-    fid.close()
-
-    espec0(hw,N,fout = filename)
+        if n > 0 and args.next is not None:
+            fid.write('#After: %s %s\n'%(args.next,filenames[n]))
+        fid.write('#Init time: %s \n'%(datetime.datetime.now().strftime("%b-%d-%Y %H:%M:%S")))
+        fid.close()
+
+        if args.shm is not None:
+            pub = livespec.Publisher(args.shm,1024)   # <<< HARDWARE-DEPENDENT-LINE >>>
+        else:
+            pub = None
+        if args.archive:
+            ar = archive.Writer(filename+'.mdz',1024,prefix=True)   # <<< HARDWARE-DEPENDENT-LINE >>>
+        else:
+            ar = None
+        al = align.Aligner() if args.align else None
+        if args.monitor is not None:
+            mon = ratemeter.Monitor(period = args.monitor)
+        else:
+            mon = None
+        if args.screen is not None:
+            scr = quality.Screen(1024,threshold = args.screen)   # <<< HARDWARE-DEPENDENT-LINE >>>
+        else:
+            scr = None
+        if prof is not None:
+            prof.reset()
+            prof.start()
+        try:
+            if args.continuous:
+                DONE = espec1(hw,T,fout = filename,criterion = crit,publisher = pub,
+                              archive = ar,aligner = al,screen = scr,
+                              profiler = prof,fitter = fw)
+            else:
+                DONE = espec0(hw,N,fout = filename,criterion = crit,publisher = pub,
+                              archive = ar,state = state,aligner = al,
+                              screen = scr,profiler = prof,
+                              monitor = mon,fitter = fw)
+        finally:
+            if fw is not None:
+                fw.stop()
+            if prof is not None:
+                prof.stop()
+                prof.write(filename+'.profile')
+                print('Profile on %s.profile'%filename)
+            if pub is not None:
+                pub.close()
+            if ar is not None:
+                ar.close()
+        if not DONE:
+            break
   
 
 
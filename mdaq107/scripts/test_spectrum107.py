@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tests of the resume of spectrum107 runs, on an emulated mdaq107 whose
+counters are synthetic intervals (common/synth.py). """
+
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[1:1] = [p for p in (os.path.normpath(os.path.join(_HERE,'..')),
+                 os.path.normpath(os.path.join(_HERE,'..','..','common')))
+                 if p not in sys.path]
+import archive
+import decode
+import fit
+import mdaq
+import runstate
+import stop
+import synth
+
+N = 2                                      # cycles per interval (~60 ms)
+
+
+class Crash(Exception):
+    pass
+
+
+class FakeModule():
+    """ The Instrument calls made by espec0, on intervals drawn by
+    synth.Generator. """
+
+    VERBOSE = False
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.k = 0
+        self.N = 0
+        self.t = 0.
+
+    def getStatus(self):
+        return '0400 0000 %04X 0000 0500' % self.N
+
+    def clear(self, soft=False):
+        pass
+
+    def setCycleNumber(self, N):
+        self.N = N
+
+    def start(self):
+        self.t = time.time()
+
+    def stop(self):
+        pass
+
+    def getCycleNumber(self):
+        return self.N if time.time() - self.t >= self.N/mdaq.frequency(0x500) else 0
+
+    def getCounters(self):
+        c = self.counts[self.k]
+        self.k += 1
+        return synth.hexstream(c, 'MDAQ107-MAC')
+
+
+@pytest.fixture
+def spectrum107(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('macveiga1.wave', 'w') as fid:
+        fid.write('0000'*1024 + '\n')
+    return importlib.import_module('spectrum107')
+
+
+@pytest.fixture
+def counts():
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)], rate=1e6, seed=0)
+    return gen.intervals(20)[0]
+
+
+def _run(spectrum107, hw, intervals, state, ar=None, crash=None):
+    if crash is not None:
+        commit = state.commit
+        def crashing(i, *args):
+            commit(i, *args)
+            if i == crash:
+                raise Crash()
+        state.commit = crashing
+    try:
+        return spectrum107.espec0(hw, N, fout='run.00', state=state,
+                                  archive=ar,
+                                  criterion=stop.MaxIntervals(intervals))
+    except Crash:
+        return None
+
+
+def _lines():
+    with open('run.00') as fid:
+        return [decode.hexws2array(line.split(':', 1)[1]) for line in fid]
+
+
+def test_committed_size_is_the_file_size(spectrum107, counts):
+    st = runstate.State('run.00.state', 'fp', N)
+    assert _run(spectrum107, FakeModule(counts), 3, st)
+    assert st.size == os.path.getsize('run.00')
+    assert np.array_equal(_lines(), counts[:3])
+
+
+def test_resume_truncates_what_was_not_committed(spectrum107, counts):
+    hw = FakeModule(counts)
+    assert _run(spectrum107, hw, 5, runstate.State('run.00.state', 'fp', N),
+                crash=3) is None
+    with open('run.00', 'a') as fid:
+        fid.write('3.00 4.00 1.00:1 2 3')  # cut while writing interval 4
+    st = runstate.load('run.00.state')
+    assert _run(spectrum107, hw, 5, st)
+    assert np.array_equal(_lines(), counts[:5])
+    assert np.array_equal(st.totals, counts[:5].sum(axis=0))
+
+
+def test_resume_refuses_a_short_file(spectrum107, counts):
+    hw = FakeModule(counts)
+    _run(spectrum107, hw, 5, runstate.State('run.00.state', 'fp', N), crash=3)
+    st = runstate.load('run.00.state')
+    with open('run.00', 'r+') as fid:
+        fid.truncate(st.size - 10)
+    with pytest.raises(RuntimeError):
+        _run(spectrum107, hw, 5, st)
+
+
+def test_fit_of_the_accumulated_spectrum(spectrum107, counts):
+    gen = synth.Generator([fit.Sextet(A=0.1, B=33., w=0.3)])
+    model = fit.Model([fit.Sextet(A=0.08, B=32., w=0.35)])
+    fw = fit.Worker(fit.Fitter(model, gen.velocity()))
+    assert spectrum107.espec0(FakeModule(counts), N, fout='run.00',
+                              criterion=stop.MaxIntervals(4), fitter=fw)
+    fw.stop()
+    assert fw.nfits >= 2
+    with open('run.00.fit') as fid:
+        lines = fid.read().split('\n')
+    assert lines[0].startswith('#fit %d,' % fw.nfits)
+    fitted = dict((w[0], float(w[1])) for w in (l.split() for l in lines[1:] if l))
+    assert list(fitted) == model.names
+    assert fitted['sextet0.B'] == pytest.approx(33., abs=0.1)
+    assert not os.path.exists('run.00.fit.tmp')
+
+
+def test_resume_rebuilds_the_archive(spectrum107, counts):
+    hw = FakeModule(counts)
+    ar = archive.Writer('run.00.mdz', 1024, blocksize=4, prefix=True)
+    _run(spectrum107, hw, 8, runstate.State('run.00.state', 'fp', N), ar,
+         crash=6)
+    ar._buf, ar._times = [], []            # the block being filled is lost
+    ar.close()
+    assert len(archive.Reader('run.00.mdz')) == 4
+    ar = archive.Writer('run.00.mdz', 1024, prefix=True)
+    assert _run(spectrum107, hw, 8, runstate.load('run.00.state'), ar)
+    ar.close()
+    assert np.array_equal(archive.Reader('run.00.mdz')[:], counts[:8])
+
+
+class ContinuousModule(FakeModule):
+    """ The calls made by espec1: cumulative counters, counting at the
+    rate of the first synthetic interval since start(). A protocol error
+    is raised on the getCounters calls listed in "fail". """
+
+    def __init__(self, counts, fail=()):
+        FakeModule.__init__(self, counts)
+        self.fail = set(fail)
+        self.calls = 0
+
+    def _cycles(self):
+        return int((time.time() - self.t)*mdaq.frequency(0x500))
+
+    def getCycleNumber(self):
+        return self._cycles()
+
+    def getCounters(self):
+        self.calls += 1
+        if self.calls in self.fail:
+            raise mdaq._UnexpectedProtocol('Y', tipo='EchoFail')
+        return synth.hexstream(self.counts[0]*self._cycles()//N, 'MDAQ107-MAC')
+
+    def recover(self, restart=False):
+        return []
+
+
+class RejectFirst():
+    """ A quality screen rejecting the first interval. """
+
+    def __init__(self):
+        self.n = 0
+        self.last = (9.,)
+
+    def update(self, interval, exposure=1.):
+        self.n += 1
+        return self.n > 1
+
+    def quarantine(self, fname, interval, ti=0., tf=0.):
+        pass
+
+
+def _widths():
+    with open('run.00') as fid:
+        return [float(line.split(':', 1)[0].split()[2]) for line in fid]
+
+
+def test_continuous_waits_after_a_rejected_interval(spectrum107, counts):
+    T = 0.1
+    assert spectrum107.espec1(ContinuousModule(counts), T, fout='run.00',
+                              criterion=stop.MaxIntervals(3),
+                              screen=RejectFirst())
+    assert len(_widths()) == 3 and min(_widths()) > 0.8*T
+
+
+def test_continuous_recovers_during_the_recovery(spectrum107, counts):
+    # The first download and the reading after its recovery both fail.
+    T = 0.1
+    assert spectrum107.espec1(ContinuousModule(counts, fail=(1, 2)), T,
+                              fout='run.00', criterion=stop.MaxIntervals(2))
+    assert len(_widths()) == 2 and min(_widths()) > 0.8*T
+    with open('run.00.log') as fid:
+        assert fid.read().count('#Protocol error') == 2
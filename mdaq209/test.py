@@ -3,7 +3,10 @@
 
 """ test module for mdaq.py working on mdaq209 """
 
-import sys
+import sys, os
+# common/ (mdaqcore, decode) of this repository.
+sys.path.insert(1,os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),'..','common')))
 import mdaq
 import time
 